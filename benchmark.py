@@ -0,0 +1,209 @@
+# Benchmarks of the equity simulator in main.py: hands evaluated per second, trials per second, and the time to answer
+# full questions at each street. Results are recorded to a JSON file with the machine info, and can be compared against
+# a saved baseline to flag regressions.
+#
+#     python benchmark.py run --output results.json
+#     python benchmark.py compare baseline.json results.json
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import main
+
+
+def measure_rate(function, units_per_call, min_seconds):
+    """
+    Calls the function until at least min_seconds have passed.
+    :param function: a function taking no argument.
+    :param units_per_call: the number of units (hands, trials, questions) the function does per call.
+    :return: the number of units done per second.
+    """
+    # a first call outside of the timing, so that tables built on first use are not counted
+    function()
+    num_calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        num_calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return num_calls * units_per_call / elapsed
+
+
+def random_hands(num_hands, seed=0):
+    """
+    :return: a tuple of 2 arrays of shape (num_hands, 5), the codes of random 5 card hands and their Card objects.
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.array([main.Deck().codes[rng.permutation(52)[:5]] for i in range(num_hands)])
+    cards = np.vectorize(main.card_from_code, otypes=[object])(codes)
+    return codes, cards
+
+
+def benchmark_evaluator(min_seconds):
+    """
+    :return: a dict of the number of hands evaluated per second, by the reference Hand, HandEvaluator.evaluate_cards()
+    and HandEvaluator.evaluate_codes()
+    """
+    evaluator = main.get_evaluator()
+    codes, cards = random_hands(1000)
+
+    def reference():
+        for hand_cards in cards:
+            main.Hand(hand_cards)
+
+    def lookup():
+        for hand_cards in cards:
+            evaluator.evaluate_cards(hand_cards)
+
+    def vectorized():
+        evaluator.evaluate_codes(codes)
+
+    return {
+        "evaluator.reference_hands_per_sec": measure_rate(reference, len(cards), min_seconds),
+        "evaluator.lookup_hands_per_sec": measure_rate(lookup, len(cards), min_seconds),
+        "evaluator.vectorized_hands_per_sec": measure_rate(vectorized, len(codes), min_seconds),
+    }
+
+
+def make_question(num_players, board_input, num_trials, engine, known_hole_cards=()):
+    """
+    :param known_hole_cards: the hole cards of the first players, the others being all unknown.
+    :return: a Question answered by Monte Carlo simulation whatever the number of unknown cards.
+    """
+    hole_cards_input = np.full([num_players, main.NUM_HOLE_CARDS], "*", dtype="<U2")
+    for i, hole_cards in enumerate(known_hole_cards):
+        hole_cards_input[i] = hole_cards
+    return main.Question(hole_cards_input, np.array(board_input, dtype="<U2"), np.empty([0], dtype="<U2"),
+                         num_trials, engine=engine, seed=0, exact_threshold=0)
+
+
+def answer_quietly(question):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return question.answer()
+
+
+def benchmark_trials(min_seconds):
+    """
+    :return: a dict of the number of trials per second of each engine, for 2, 6 and 10 players with all cards unknown.
+    """
+    results = {}
+    empty_board = [["*"] * 3] * 3
+    for num_players in (2, 6, 10):
+        for engine, num_trials in (("trial", 200), ("batch", 5000)):
+            question = make_question(num_players, empty_board, num_trials, engine)
+            results["trials.{}.{}_players_per_sec".format(engine, num_players)] = measure_rate(
+                lambda: answer_quietly(question), num_trials, min_seconds)
+    return results
+
+
+# The streets of the full question benchmarks: the board known so far, with 3 players of which the first 2 are known.
+STAGES = {
+    "flop": [["Ks", "*", "8d"], ["*", "*", "*"], ["4h", "*", "Jc"]],
+    "turn": [["Ks", "9c", "8d"], ["2d", "*", "Qh"], ["4h", "7s", "Jc"]],
+    "river": [["Ks", "9c", "8d"], ["2d", "6h", "Qh"], ["4h", "7s", "Jc"]],
+}
+STAGE_HOLE_CARDS = (["As", "Ad", "Tc", "9d"], ["Qs", "Js", "Th", "5h"])
+
+
+def benchmark_questions(min_seconds):
+    """
+    :return: a dict of the number of full questions answered per second at each street, with the default settings of
+    Question (so the turn and river are answered exactly).
+    """
+    results = {}
+    for stage, board_input in STAGES.items():
+        hole_cards_input = np.full([3, main.NUM_HOLE_CARDS], "*", dtype="<U2")
+        hole_cards_input[:2] = STAGE_HOLE_CARDS
+
+        def answer():
+            question = main.Question(hole_cards_input, np.array(board_input, dtype="<U2"),
+                                     np.empty([0], dtype="<U2"), 20000, engine="batch", seed=0)
+            answer_quietly(question)
+
+        results["questions.{}_per_sec".format(stage)] = measure_rate(answer, 1, min_seconds)
+    return results
+
+
+def machine_info():
+    """:return: a dict describing the machine and the code the benchmarks ran on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "commit": commit,
+    }
+
+
+def run(output, min_seconds):
+    results = {}
+    for benchmark in (benchmark_evaluator, benchmark_trials, benchmark_questions):
+        results.update(benchmark(min_seconds))
+    report = {"machine": machine_info(), "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    for name, value in results.items():
+        print("{:45} {:>14.1f}".format(name, value))
+    print("Saved to", output)
+
+
+def compare(baseline, current, threshold):
+    """
+    Flags the results of current more than threshold (a fraction) slower than those of baseline. All results are rates,
+    higher being better.
+    :return: the number of regressions.
+    """
+    with open(baseline) as f:
+        baseline_results = json.load(f)["results"]
+    with open(current) as f:
+        current_results = json.load(f)["results"]
+    regressions = 0
+    for name in sorted(set(baseline_results) | set(current_results)):
+        if name not in baseline_results or name not in current_results:
+            print("{:45} only in {}".format(name, baseline if name in baseline_results else current))
+            continue
+        change = current_results[name] / baseline_results[name] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        print("{:45} {:>14.1f} {:>14.1f} {:>+8.1%} {}".format(name, baseline_results[name], current_results[name],
+                                                              change, flag))
+    print("{} regression(s) beyond {:.0%}".format(regressions, threshold))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the 4 card tic-tac-toe poker equity simulator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and save the results")
+    run_parser.add_argument("--output", default="benchmark_results.json", help="the JSON file to save the results to")
+    run_parser.add_argument("--min-seconds", type=float, default=1.0, help="the least time spent on each benchmark")
+    compare_parser = subparsers.add_parser("compare", help="flag the regressions against a saved baseline")
+    compare_parser.add_argument("baseline", help="the JSON file of the baseline results")
+    compare_parser.add_argument("current", help="the JSON file of the results to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="the slowdown, as a fraction, flagged as a regression")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args.output, args.min_seconds)
+    else:
+        raise SystemExit(1 if compare(args.baseline, args.current, args.threshold) else 0)
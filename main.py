@@ -4,18 +4,27 @@
 # On the flop the 4 corners of the board will be dealt, and on the turn, the 4 sides, with the river being the center
 #     card alone.
 
+import argparse
 import collections
+import concurrent.futures
 import numpy as np
 import copy
+import json
+import math
+import os
 import random
-from itertools import combinations
+import sqlite3
+import sys
+import time
+from itertools import combinations, combinations_with_replacement, islice, permutations, repeat
 
 
 class Card:
     """
     A card. Rank and suits follow the global variable RANK_NAMES and SUIT_NAMES. Name takes a upper case rank followed
     by a lower case suit, e.g. As, Th, 9d, 4c. The rank 10 (Ten) should be called T.
-    Can be created in Deck().__init__ .
+    Cards are handled as small integer codes (see Card.code()) by the Deck and the BatchSimulator, Card objects being
+    views of those codes. There is only one Card object per card, from card_from_code(), and it is never copied.
     """
 
     def __init__(self, rank, suit):
@@ -25,52 +34,443 @@ class Card:
     def __repr__(self):
         return self.name()
 
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # cards never change, so the copies of players and boards in each Trial can share them
+        return self
+
     def name(self):
-        # as a function rather than an attribute because in the Deck functions, when a card has to be deleted a new
-        # copy of the deck has to be made. Not having to copy the Card.name saves some CPU time.
         return RANK_NAMES[self.rank] + SUIT_NAMES[self.suit]
 
+    def code(self):
+        # the card as a small integer. The rank takes the high bits and the suit the lowest 2, so that
+        # rank = code >> 2 and suit = (code & 3) + 1
+        return (self.rank << 2) | (self.suit - 1)
+
+
+def card_from_code(code):
+    """
+    :param code: the code of a card, as in Card.code()
+    :return: the Card object of that code.
+    """
+    card = CARDS_BY_CODE.get(code)
+    if card is None:
+        card = CARDS_BY_CODE[code] = Card(code >> 2, (code & 3) + 1)
+    return card
+
+
+def card_name_to_code(card_name):
+    """
+    :param card_name: a card name, e.g. As, Th, 9d, 4c.
+    :return: the code of the card, as in Card.code()
+    """
+    for rank, rank_name in RANK_NAMES.items():
+        if rank_name == card_name[0]:
+            for suit, suit_name in SUIT_NAMES.items():
+                if suit_name == card_name[1]:
+                    return (rank << 2) | (suit - 1)
+    raise Exception("Card not recognized", card_name)
+
+
+def card_code_to_name(code):
+    """The reverse of card_name_to_code()"""
+    return RANK_NAMES[code >> 2] + SUIT_NAMES[(code & 3) + 1]
+
 
 class Deck:
     """
-    A deck. Attribute Deck.cards contain the cards in the deck in an array.
+    A deck, backed by a preallocated array of card codes, Deck.codes. The first Deck.size codes are the cards still in
+    the deck; taking a card out swaps it with the last of those and shrinks Deck.size, so dealing never copies the
+    array. The cards taken out since the deck had a given size can be put back with Deck.reset(), which undoes the
+    swaps too.
+    Attribute Deck.cards contain the cards in the deck in an array of Card objects.
     """
 
     def __init__(self, num_ranks=13, num_suits=4):
         '''
         :param num_ranks: number of ranks in the deck of this game. Default to 13
         :param num_suits: number of suits in the deck of this game. Default to 4
-        :return: a Deck object, with the attribute Deck.cards containing Card objects newly created.
+        :return: a Deck object, with the attribute Deck.codes containing the codes of all the cards.
         '''
-        self.cards = np.empty([num_ranks * num_suits], dtype=Card)
+        self.codes = np.empty([num_ranks * num_suits], dtype=np.int64)
         card_index = 0
         for i in range(1, num_suits + 1):
             for j in range(15 - num_ranks, 15):
-                self.cards[card_index] = Card(j, i)
+                self.codes[card_index] = (j << 2) | (i - 1)
                 card_index += 1
+        self.size = len(self.codes)
+        # the index of each card code in Deck.codes, to take a named card out without searching for it
+        self.positions = np.full(1 << 6, -1, dtype=np.int64)
+        self.positions[self.codes] = np.arange(len(self.codes))
+        # the index each card taken out was swapped from, in the order taken, for Deck.reset()
+        self.taken_indices = []
 
     def __repr__(self):
-        return "Deck object with {} Card objects".format(len(self.cards))
+        return "Deck object with {} Card objects".format(self.size)
+
+    @property
+    def cards(self):
+        return np.array([card_from_code(code) for code in self.codes[:self.size]], dtype=Card)
+
+    def remaining_codes(self):
+        """:return: a copy of the codes of the cards still in the deck."""
+        return self.codes[:self.size].copy()
+
+    def take_out(self, index):
+        """Takes the card at the index of Deck.codes out of the deck, by swapping it to the end. Returns its code."""
+        last = self.size - 1
+        code = self.codes[index]
+        last_code = self.codes[last]
+        self.codes[index], self.codes[last] = last_code, code
+        self.positions[last_code], self.positions[code] = index, last
+        self.size = last
+        self.taken_indices.append(index)
+        return code
 
     def pick(self, card_name_to_pick):
         """Takes the named Card object out of the deck and returns it. The Card object will be removed from the deck."""
-        for i in range(len(self.cards)):
-            if self.cards[i].name() == card_name_to_pick:
-                result = self.cards[i]
-                self.cards = np.delete(self.cards, i)
-                return result
-        raise Exception("Card picked not in deck", card_name_to_pick)
+        try:
+            index = self.positions[card_name_to_code(card_name_to_pick)]
+        except Exception:
+            index = -1
+        if index < 0 or index >= self.size:
+            raise Exception("Card picked not in deck", card_name_to_pick)
+        return card_from_code(int(self.take_out(index)))
 
     def deal(self):
         """Takes a random Card object out of the deck and returns it. The Card object will be removed from the deck."""
-        if len(self.cards) > 0:
-            card_key = random.choice(range(len(self.cards)))
-            result = self.cards[card_key]
-            self.cards = np.delete(self.cards, card_key)
-            return result
+        if self.size > 0:
+            return card_from_code(int(self.take_out(random.randrange(self.size))))
         else:
             raise Exception("No more cards in deck")
 
+    def reset(self, size):
+        """
+        Puts back the cards taken out since the deck had this size, undoing their swaps from the last one taken, so
+        that the deck is back in the order it had then.
+        """
+        while self.size < size:
+            index = self.taken_indices.pop()
+            last = self.size
+            code, last_code = self.codes[last], self.codes[index]
+            self.codes[index], self.codes[last] = code, last_code
+            self.positions[code], self.positions[last_code] = index, last
+            self.size = last + 1
+
+    def copy(self):
+        """Returns a copy of the deck, without creating the cards again."""
+        result = copy.copy(self)
+        result.codes = self.codes.copy()
+        result.positions = self.positions.copy()
+        result.taken_indices = list(self.taken_indices)
+        return result
+
+
+def new_deck(num_ranks=None, num_suits=None):
+    """
+    Returns a full Deck, copied from one made once per process. Defaults to the global variables DECK_NUM_RANKS and
+    DECK_NUM_SUITS.
+    """
+    key = (DECK_NUM_RANKS if num_ranks is None else num_ranks, DECK_NUM_SUITS if num_suits is None else num_suits)
+    if key not in DECKS:
+        DECKS[key] = Deck(num_ranks=key[0], num_suits=key[1])
+    return DECKS[key].copy()
+
+
+class GameVariant:
+    """
+    The settings of a game: the number of ranks and suits in the deck, and the ranks of the wheel allowed, e.g. the
+    standard game or a short deck one. Questions of several variants can be answered in the same process, each variant
+    getting its own deck and evaluator. The predefined variants are in the global variable GAME_VARIANTS; by default
+    the global variables DECK_NUM_RANKS, DECK_NUM_SUITS and WHEEL_RANKS make the variant, see get_variant().
+    """
+
+    def __init__(self, name, num_ranks=13, num_suits=4, wheel_ranks=(14, 5, 4, 3, 2)):
+        '''
+        :param wheel_ranks: the ranks of the wheel allowed in the game, as in the global variable WHEEL_RANKS. None if
+        wheels are not allowed.
+        '''
+        self.name = name
+        self.num_ranks = num_ranks
+        self.num_suits = num_suits
+        self.wheel_ranks = None if wheel_ranks is None else tuple(sorted((int(rank) for rank in wheel_ranks),
+                                                                         reverse=True))
+
+    def __repr__(self):
+        return "GameVariant {}: {}".format(self.name, self.settings_name())
+
+    def settings_name(self):
+        """
+        :return: a string naming the settings, e.g. 13x4 wheel 14,5,4,3,2, the same for variants of equal settings.
+        """
+        settings = "{}x{}".format(self.num_ranks, self.num_suits)
+        if self.wheel_ranks is not None:
+            settings += " wheel " + ",".join(str(rank) for rank in self.wheel_ranks)
+        return settings
+
+    def new_deck(self):
+        """:return: a full Deck of the variant, see new_deck()"""
+        return new_deck(self.num_ranks, self.num_suits)
+
+    def evaluator(self):
+        """:return: the HandEvaluator of the variant, see get_evaluator()"""
+        return get_evaluator(self.num_ranks, self.wheel_ranks)
+
+
+def get_variant(variant=None):
+    """
+    :param variant: a GameVariant, the name of one of GAME_VARIANTS, or None for the variant of the global variables
+    DECK_NUM_RANKS, DECK_NUM_SUITS and WHEEL_RANKS.
+    :return: a GameVariant object.
+    """
+    if variant is None:
+        return GameVariant("default", DECK_NUM_RANKS, DECK_NUM_SUITS, WHEEL_RANKS)
+    if isinstance(variant, GameVariant):
+        return variant
+    if variant not in GAME_VARIANTS:
+        raise Exception("Unknown game variant", variant)
+    return GAME_VARIANTS[variant]
+
+
+class HandRange:
+    """
+    A weighted range of 4-card holdings a player may hold, instead of known or uniformly dealt hole cards.
+    HandRange.holdings contains the card codes of each holding in an array of shape (number of holdings, 4), with their
+    HandRange.weights. Use parse_range() to create one from a text like "AAxx ds, AsKsQhJh:0.5".
+    """
+
+    def __init__(self, holdings, weights, description=""):
+        self.holdings = np.asarray(holdings, dtype=np.int64).reshape(-1, NUM_HOLE_CARDS)
+        self.weights = np.asarray(weights, dtype=float)
+        self.description = description
+        # the cards of each holding as a bitmask of their codes, to check for cards already taken at once
+        self.masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), self.holdings.astype(np.uint64)), axis=1)
+
+    def __repr__(self):
+        return "HandRange {} of {} holdings".format(self.description, len(self.holdings))
+
+    def holding_name(self, index):
+        """:return: the names of the cards of a holding, e.g. AsAhKd7c"""
+        return "".join(card_code_to_name(code) for code in self.holdings[index])
+
+
+class RangeSampler:
+    """
+    Draws holdings of a range in many trials at once, each from the holdings not colliding with the cards already
+    taken in its trial, with probabilities proportional to their weights, without checking every holding of the range.
+    The weight of the holdings fitting, among those up to any index of the range, is found by inclusion-exclusion over
+    the sets of cards taken a holding may contain: the weight of all the holdings up to that index, less that of those
+    containing each card taken, plus that of those containing each pair of them, and so on. Each of those weights is
+    looked up in an index of the holdings by their sets of 1 to 3 cards, sorted by the set then the index of the
+    holding, with their cumulative weights. A binary search on that weight then finds the holding drawn.
+    Use get_range_sampler() rather than creating one directly, as the index takes some time to build.
+    """
+
+    def __init__(self, holdings, weights):
+        '''
+        :param holdings: the codes of the holdings of the range, in an array of shape (number of holdings, 4).
+        :param weights: their weights.
+        '''
+        holdings = np.sort(np.asarray(holdings, dtype=np.int64), axis=1)
+        weights = np.asarray(weights, dtype=float)
+        self.num_holdings = len(holdings)
+        self.cumulative_weights = np.concatenate(([0.0], np.cumsum(weights)))
+        self.total = self.cumulative_weights[-1]
+        self.masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), holdings.astype(np.uint64)), axis=1)
+        self.weights = weights
+        # the keys of the index are (the set of cards, as the index of their sorted codes among all sets of that size)
+        # x number of holdings + the index of the holding
+        self.subset_keys = []
+        self.subset_cumulative_weights = []
+        holding_indices = np.arange(self.num_holdings, dtype=np.int64)
+        for size in range(1, NUM_HOLE_CARDS):
+            keys = np.concatenate([np.ravel_multi_index(tuple(holdings[:, columns].T), (CARD_CODE_LIMIT,) * size) *
+                                   self.num_holdings + holding_indices
+                                   for columns in combinations(range(NUM_HOLE_CARDS), size)])
+            order = np.argsort(keys, kind="stable")
+            self.subset_keys.append(keys[order])
+            self.subset_cumulative_weights.append(np.concatenate(
+                ([0.0], np.cumsum(np.tile(weights, len(keys) // self.num_holdings)[order]))))
+        # the whole holdings, by their sorted bitmasks
+        self.mask_order = np.argsort(self.masks)
+        self.sorted_masks = self.masks[self.mask_order]
+
+    def __repr__(self):
+        return "RangeSampler of {} holdings".format(self.num_holdings)
+
+    def fitting_weights(self, taken_codes, last_indices=None):
+        '''
+        :param taken_codes: the codes of the cards taken in each trial, all different, in an array of shape (number of
+        trials, number of cards taken).
+        :param last_indices: None for the whole range, or for each trial the index of the last holding of the range to
+        count.
+        :return: the total weight of the holdings of the range, up to last_indices, with none of the cards taken, for
+        each trial.
+        '''
+        if last_indices is None:
+            last_indices = np.full(len(taken_codes), self.num_holdings - 1)
+        return self.subset_terms(taken_codes)(last_indices)
+
+    def subset_terms(self, taken_codes):
+        '''
+        Looks up once what fitting_weights() needs of the sets of cards taken, for a binary search on the last index.
+        :param taken_codes: as in fitting_weights()
+        :return: a function of the last indices returning the fitting weights up to them.
+        '''
+        taken_codes = np.sort(taken_codes, axis=1)
+        num_taken = taken_codes.shape[1]
+        # by the size of the sets, the first key of each set in each trial, and the sign of its term
+        first_keys, signs = [], []
+        # the terms not depending on the last index: the weights below the first key of each set
+        constant = np.zeros(len(taken_codes))
+        for size in range(1, min(NUM_HOLE_CARDS - 1, num_taken) + 1):
+            cards = taken_codes[:, list(combinations(range(num_taken), size))]
+            keys = np.ravel_multi_index(tuple(np.moveaxis(cards, -1, 0)), (CARD_CODE_LIMIT,) * size) * \
+                self.num_holdings
+            sign = -1.0 if size % 2 == 1 else 1.0
+            constant -= sign * self.subset_cumulative_weights[size - 1][
+                np.searchsorted(self.subset_keys[size - 1], keys)].sum(axis=1)
+            first_keys.append(keys)
+            signs.append(sign)
+        # the whole holdings made of cards taken, and their signed weights
+        holding_indices = np.zeros((len(taken_codes), 0), dtype=np.int64)
+        holding_weights = np.zeros((len(taken_codes), 0))
+        if num_taken >= NUM_HOLE_CARDS:
+            cards = taken_codes[:, list(combinations(range(num_taken), NUM_HOLE_CARDS))]
+            cards_masks = np.bitwise_or.reduce(np.left_shift(np.uint64(1), cards.astype(np.uint64)), axis=-1)
+            position = np.minimum(np.searchsorted(self.sorted_masks, cards_masks), self.num_holdings - 1)
+            holding_indices = self.mask_order[position]
+            holding_weights = np.where(self.sorted_masks[position] == cards_masks, self.weights[holding_indices], 0.0)
+
+        def fitting_weights(last_indices):
+            fitting = self.cumulative_weights[last_indices + 1] + constant
+            for size, (keys, sign) in enumerate(zip(first_keys, signs), 1):
+                fitting += sign * self.subset_cumulative_weights[size - 1][np.searchsorted(
+                    self.subset_keys[size - 1], keys + last_indices[:, np.newaxis], side="right")].sum(axis=1)
+            fitting += np.where(holding_indices <= last_indices[:, np.newaxis], holding_weights, 0.0).sum(axis=1)
+            # what the rounding errors of the sums leave of holdings none of which fits
+            fitting[fitting <= self.total * 1e-9] = 0.0
+            return fitting
+
+        return fitting_weights
+
+    def draw(self, taken, taken_codes, rng):
+        '''
+        :param taken: the bitmask of the cards taken in each trial.
+        :param taken_codes: the codes of those cards, as in fitting_weights().
+        :param rng: a numpy random Generator
+        :return: a tuple of the index of the holding drawn in each trial, and the total weight of the holdings fitting
+        it, 0 where none fits, the holding then being any.
+        '''
+        num_trials = len(taken)
+        fitting_weights = self.subset_terms(taken_codes)
+        available = fitting_weights(np.full(num_trials, self.num_holdings - 1))
+        targets = rng.random(num_trials) * available
+        if taken_codes.shape[1] == 0:
+            picks = np.searchsorted(self.cumulative_weights[1:], targets, side="right")
+        else:
+            # the first holding whose fitting weight up to it is above the target
+            low = np.zeros(num_trials, dtype=np.int64)
+            high = np.full(num_trials, self.num_holdings - 1)
+            while (low < high).any():
+                middle = (low + high) // 2
+                above = fitting_weights(middle) > targets
+                high = np.where(above, middle, high)
+                low = np.where(above, low, middle + 1)
+            picks = low
+        picks = np.minimum(picks, self.num_holdings - 1)
+        # the holding found fits, but for the rounding errors of the sums, after which the holdings fitting are checked
+        colliding = np.flatnonzero(((self.masks[picks] & taken) != 0) & (available > 0))
+        if len(colliding) > 0:
+            cumulative_fitting = np.cumsum(np.where((self.masks[np.newaxis, :] & taken[colliding, np.newaxis]) == 0,
+                                                    self.weights[np.newaxis, :], 0), axis=1)
+            available[colliding] = cumulative_fitting[:, -1]
+            picks[colliding] = np.minimum(np.count_nonzero(
+                cumulative_fitting <= (rng.random(len(colliding)) * available[colliding])[:, np.newaxis], axis=1),
+                self.num_holdings - 1)
+        return picks, available
+
+
+def get_range_sampler(holdings, weights):
+    """
+    Returns a RangeSampler of the holdings and weights, building its index the first time it is asked for in the
+    process. Only the RANGE_SAMPLER_CACHE_SIZE last ones are kept.
+    """
+    key = (np.ascontiguousarray(holdings, dtype=np.int64).tobytes(),
+           np.ascontiguousarray(weights, dtype=float).tobytes())
+    if key not in RANGE_SAMPLERS:
+        if len(RANGE_SAMPLERS) >= RANGE_SAMPLER_CACHE_SIZE:
+            del RANGE_SAMPLERS[next(iter(RANGE_SAMPLERS))]
+        RANGE_SAMPLERS[key] = RangeSampler(holdings, weights)
+    return RANGE_SAMPLERS[key]
+
+
+def parse_range(text, variant=None):
+    """
+    Creates a HandRange from a comma separated list of entries, each optionally followed by : and its weight (1 by
+    default). An entry is either 4 card names, e.g. AsAhKd7c, or 4 ranks where x is any rank, e.g. AAxx or AKQJ,
+    optionally followed by ds (double suited), ss (single suited) or r (rainbow). * is any holding.
+    A holding matching several entries takes the largest of their weights.
+    :param variant: the GameVariant of the deck of the holdings, see get_variant()
+    """
+    all_holdings = four_card_holdings(variant)
+    ranks = all_holdings >> 2
+    suit_counts = np.sort(np.stack([np.count_nonzero((all_holdings & 3) == suit, axis=1) for suit in range(4)],
+                                   axis=1), axis=1)[:, ::-1]
+    rank_values = {rank_name: rank for rank, rank_name in RANK_NAMES.items()}
+    suit_values = set(SUIT_NAMES.values())
+    weights = np.zeros(len(all_holdings))
+    for entry in text.split(","):
+        entry = entry.replace(" ", "")
+        if entry == "":
+            continue
+        weight = 1.0
+        if ":" in entry:
+            entry, weight_text = entry.split(":", 1)
+            try:
+                weight = float(weight_text)
+            except ValueError:
+                raise Exception("Range weight not recognized", weight_text)
+        if len(entry) == 2 * NUM_HOLE_CARDS and all(entry[i] in suit_values for i in range(1, len(entry), 2)):
+            codes = sorted(card_name_to_code(entry[i:i + 2]) for i in range(0, len(entry), 2))
+            matches = (all_holdings == codes).all(axis=1)
+        else:
+            if entry == "*":
+                entry = "x" * NUM_HOLE_CARDS
+            pattern, suitedness = entry[:NUM_HOLE_CARDS], entry[NUM_HOLE_CARDS:]
+            if len(pattern) != NUM_HOLE_CARDS or suitedness not in SUIT_PATTERNS or \
+                    any(rank_name not in rank_values and rank_name not in "xX" for rank_name in pattern):
+                raise Exception("Range entry not recognized", entry)
+            matches = np.ones(len(all_holdings), dtype=bool)
+            for rank_name, count in collections.Counter(pattern.replace("X", "x")).items():
+                if rank_name != "x":
+                    matches &= np.count_nonzero(ranks == rank_values[rank_name], axis=1) >= count
+            if SUIT_PATTERNS[suitedness] is not None:
+                matches &= (suit_counts == SUIT_PATTERNS[suitedness]).all(axis=1)
+        if not matches.any():
+            raise Exception("Range entry matches no holding", entry)
+        weights[matches] = np.maximum(weights[matches], weight)
+    in_range = weights > 0
+    if not in_range.any():
+        raise Exception("Empty range", text)
+    return HandRange(all_holdings[in_range], weights[in_range], description=text)
+
+
+def four_card_holdings(variant=None):
+    """
+    :param variant: a GameVariant, see get_variant()
+    :return: the codes of every 4-card holding of the deck of the game, in an array of shape (number of holdings, 4),
+    each holding sorted. Made once per process.
+    """
+    variant = get_variant(variant)
+    key = (variant.num_ranks, variant.num_suits)
+    if key not in FOUR_CARD_HOLDINGS:
+        FOUR_CARD_HOLDINGS[key] = np.array(list(combinations(np.sort(variant.new_deck().codes), NUM_HOLE_CARDS)),
+                                           dtype=np.int64)
+    return FOUR_CARD_HOLDINGS[key]
+
 
 class Board:
     """
@@ -83,8 +483,9 @@ class Board:
     def __repr__(self):
         return "Board: \n" + str(self.board_cards)
 
-    def generate_board_combos(self):
+    def generate_board_combos(self, evaluator=None):
         """
+        :param evaluator: the HandEvaluator of the game, get_evaluator() by default.
         :return: An array of 8 three-Card-object-combinations that lie on straight lines on the board.
         """
         self.board_combos = np.empty((8, 3), dtype=Card)
@@ -95,47 +496,101 @@ class Board:
         # diagonals
         self.board_combos[6] = np.diag(self.board_cards)
         self.board_combos[7] = np.diag(np.fliplr(self.board_cards))
+        # what HandEvaluator.evaluate_line() needs of each line, worked out once for all the players. None for the lines
+        # with undealt cards.
+        if evaluator is None:
+            evaluator = get_evaluator()
+        self.line_data = [None if any(card is None for card in board_combo) else evaluator.line_data(board_combo)
+                          for board_combo in self.board_combos]
 
 
 class Player:
     """
     Player object containing hole cards they hold in the attribute Player.hole_cards. The method
-    Player.generate_showdown_hand(self, board) creates the attribute Player.showdown_hand, which is a Hand object that
-    the player can best make on the board.
+    Player.generate_showdown_hand(self, board) creates the attribute Player.showdown_strength, which is the strength of
+    the best hand the player can make on the board.
     """
 
     def __init__(self, player_num, hole_cards = [None, None, None, None]):
         self.hole_cards = np.array(hole_cards)
         self.player_num = player_num
+        # see Player.generate_fixed_lines()
+        self.fixed_lines = {}
 
     def __repr__(self):
         return "Player {} holding {}".format(self.player_num, self.hole_cards)
 
-    def generate_hole_cards_combos(self):
+    def __deepcopy__(self, memo):
+        # Trial copies the players for every trial. Only the hole cards change in a trial, the fixed_lines are shared.
+        result = Player(self.player_num, copy.deepcopy(self.hole_cards, memo))
+        result.fixed_lines = self.fixed_lines
+        return result
+
+    def generate_hole_cards_combos(self, evaluator=None):
         """
         Create an attribute hole_cards_combos, an array that contains all two-card-combos the player can make with his
-        hole cards.
+        hole cards, and an attribute hole_pairs, the same combos as HandEvaluator.hole_pairs() needs them.
+        :param evaluator: the HandEvaluator of the game, get_evaluator() by default.
         """
         self.hole_cards_combos = np.empty(NUM_HOLE_CARDS * (NUM_HOLE_CARDS - 1) // 2, dtype=Card)
         i = 0
         for combo in combinations(self.hole_cards, 2):
             self.hole_cards_combos[i] = np.array(combo)
             i += 1
+        self.hole_pairs = (get_evaluator() if evaluator is None else evaluator).hole_pairs(self.hole_cards)
 
-    def generate_showdown_hand(self, board):
+    def generate_showdown_hand(self, board, evaluator=None):
         '''
         :param board: a Board object
-        Creates an attribute showdown_hand, a hand object representing the best hand the player can make on the given
-        board
+        :param evaluator: the HandEvaluator of the game, get_evaluator() by default.
+        Creates the attributes showdown_strength, the integer strength (see HandEvaluator) of the best hand the player
+        can make on the given board, and showdown_cards, a tuple of the 5 Card objects making that hand.
         '''
+        if evaluator is None:
+            evaluator = get_evaluator()
+        best_strength = -1
+        best_line = None
+        for line, line_data in enumerate(board.line_data):
+            # the lines that do not change from trial to trial have been worked out once already
+            if line in self.fixed_lines:
+                if self.fixed_lines[line][0] > best_strength:
+                    best_strength, best_cards = self.fixed_lines[line]
+                    best_line = None
+                continue
+            current_strength, current_pair = evaluator.evaluate_line(self.hole_pairs, line_data)
+            if current_strength > best_strength:
+                best_strength, best_line, best_pair = current_strength, line, current_pair
+        # the cards are only put together for the best line
+        if best_line is not None:
+            best_cards = (self.hole_cards[best_pair[0]], self.hole_cards[best_pair[1]]) + \
+                tuple(board.board_combos[best_line])
+        self.showdown_strength = best_strength
+        self.showdown_cards = best_cards
 
-        best_hand = None
-        for board_combo in board.board_combos:
-            for hole_cards_combo in self.hole_cards_combos:
-                current_hand = Hand(np.concatenate((hole_cards_combo, board_combo)))
-                if best_hand == None or current_hand.compare(best_hand) == 1:
-                    best_hand = current_hand
-        self.showdown_hand = best_hand
+    def generate_fixed_lines(self, board, evaluator=None):
+        '''
+        :param board: a Board object, with None for the undealt cards.
+        :param evaluator: the HandEvaluator of the game, get_evaluator() by default.
+        Creates an attribute fixed_lines, a dict of the best hand the player can make on each line of the board that is
+        already complete, as a tuple of its strength and its 5 Card objects, by the index of the line in
+        Board.board_combos. Player.generate_showdown_hand() then only has to evaluate the lines that change from trial
+        to trial, e.g. only the 4 lines through the center on the turn. Empty if the player has undealt hole cards.
+        '''
+        self.fixed_lines = {}
+        if any(card is None for card in self.hole_cards):
+            return
+        # on a copy of the board, not to have its board_combos copied by every Trial
+        if evaluator is None:
+            evaluator = get_evaluator()
+        board = Board(board.board_cards)
+        board.generate_board_combos(evaluator)
+        hole_pairs = evaluator.hole_pairs(self.hole_cards)
+        for line, line_data in enumerate(board.line_data):
+            if line_data is None:
+                continue
+            strength, pair = evaluator.evaluate_line(hole_pairs, line_data)
+            self.fixed_lines[line] = (strength, (self.hole_cards[pair[0]], self.hole_cards[pair[1]]) +
+                                      tuple(board.board_combos[line]))
 
 
 class Hand:
@@ -268,187 +723,2857 @@ class Hand:
         return 0
 
 
-class Question:
+class HandEvaluator:
     """
-    An object representing an equity (winning probability) question by the user: If player A holds this and player B
-    holds that on this board, what is the equity of each of the players? Do this many trials in a Monte Carlo
-    simulation to find out.
-    Method Question.answer() prints and returns the results.
+    A lookup table evaluator for 5-card-poker-hands, the fast replacement of Hand.get_hand_ranking(). It turns 5 cards
+    into a single integer strength, so that comparing two hands is a single < .
+    The strength packs the same 6 values as Hand.hand_ranking: the hand ranking category from bit 20 upwards, then the
+    5 card rankings, 4 bits each, from the one compared first down to the one compared last. The ordering of the
+    strengths is thus exactly the ordering of Hand.compare().
+    Use get_evaluator() rather than creating one directly, as the tables take some time to build. The tables are
+    saved to a directory of the on-disk cache, if there is one, and memory-mapped from there by the later processes.
     """
 
-    def __init__(self, hole_cards_input, board_input, dead_cards_input, num_trials):
-        self.deck = Deck(num_ranks=DECK_NUM_RANKS, num_suits=DECK_NUM_SUITS)
-        self.players = np.empty(len(hole_cards_input), dtype=Player)
-        self.board = Board()
-        self.num_trials = num_trials
-        # create players and their hole cards
-        for i in range(len(hole_cards_input)):
-            self.players[i] = Player(player_num=i + 1)
-            for j in range(NUM_HOLE_CARDS):
-                if hole_cards_input[i, j] != "*":
-                    self.players[i].hole_cards[j] = self.deck.pick(hole_cards_input[i, j])
-                else:
-                    self.players[i].hole_cards[j] = None
-        # put the cards on the board
-        for i in range(3):
-            for j in range(3):
-                if board_input[i, j] != "*":
-                    self.board.board_cards[i, j] = self.deck.pick(board_input[i, j])
-        # take away the dead cards
-        for card_name in dead_cards_input:
-            self.deck.pick(card_name)
+    def __init__(self, num_ranks=13, wheel_ranks=None, cache_dir=None):
+        '''
+        :param num_ranks: number of ranks in the deck of this game, the lowest ranks being removed in short decks.
+        :param wheel_ranks: the ranks of the wheel allowed in the game, as in the global variable WHEEL_RANKS. None if
+        wheels are not allowed.
+        :param cache_dir: the directory of the on-disk cache of the tables, None not to cache them. The tables are kept
+        in a subdirectory for the version of their format (global variable EVALUATOR_TABLES_VERSION) and the settings.
+        '''
+        self.num_ranks = num_ranks
+        self.wheel_ranks = None if wheel_ranks is None else tuple(sorted(wheel_ranks, reverse=True))
+        self.tables_dir = None
+        if cache_dir is not None:
+            wheel = "nowheel" if self.wheel_ranks is None else \
+                "wheel" + "-".join(str(rank) for rank in self.wheel_ranks)
+            self.tables_dir = os.path.join(cache_dir, "v{}".format(EVALUATOR_TABLES_VERSION),
+                                           "{}ranks_{}".format(num_ranks, wheel))
+        tables = self.load_tables(("product_keys", "product_key_strengths", "flush_strengths"))
+        if tables is None:
+            tables = self.build_tables()
+            self.save_tables(("product_keys", "product_key_strengths", "flush_strengths"), tables)
+        # numpy versions of the tables, for evaluate_codes()
+        self.product_keys, self.product_key_strengths, self.flush_strengths_array = tables
+        self.rank_primes = np.array(RANK_PRIMES, dtype=np.int64)
+        # and python versions, for the scalar evaluate(), faster on dicts and lists than on numpy arrays
+        self.rank_product_strengths = dict(zip(self.product_keys.tolist(), self.product_key_strengths.tolist()))
+        self.flush_strengths = self.flush_strengths_array.tolist()
 
-    def answer(self):
+    def __repr__(self):
+        return "HandEvaluator for {} ranks, wheel {}".format(self.num_ranks, self.wheel_ranks)
+
+    def load_tables(self, names):
         """
-        :return: Simulation results in an array, each element is the equity of a player, ordered by the player number.
-        The index for each player is [Player.player_num - 1]
+        :return: a tuple of the tables of these names memory-mapped from the on-disk cache, None if they are not all
+        there.
         """
-        results = np.zeros(len(self.players), dtype=float)
-        for i in range(self.num_trials):
-            trial_winners = Trial(players=self.players, board=self.board, deck=self.deck).run()
-            for player in trial_winners:
-                # if there are 2 winners in a hand, each of them have 50% equity, thus the 1 / len(trial_winners)
-                # index - 1 because our player_nums start from 1, python counts start from 0
-                results[player.player_num - 1] += 1 / len(trial_winners)
-        print("###########################")
-        print("Results after {} trials:\n".format(self.num_trials))
-        for i in range(len(results)):
-            print("    Player {}: {}%".format(i + 1, str(100 * results[i] / self.num_trials)))
-        print("###########################\n\n")
-        return results
+        if self.tables_dir is None:
+            return None
+        paths = [os.path.join(self.tables_dir, name + ".npy") for name in names]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return tuple(np.load(path, mmap_mode="r") for path in paths)
 
+    def save_tables(self, names, tables):
+        """
+        Saves the tables to the on-disk cache, each written to a temporary file first so that another process never
+        loads half a table. The tables are still used if the cache cannot be written to.
+        """
+        if self.tables_dir is None:
+            return
+        try:
+            os.makedirs(self.tables_dir, exist_ok=True)
+            for name, table in zip(names, tables):
+                path = os.path.join(self.tables_dir, name + ".npy")
+                temporary_path = "{}.{}.tmp".format(path, os.getpid())
+                with open(temporary_path, "wb") as f:
+                    np.save(f, table)
+                os.replace(temporary_path, path)
+        except OSError:
+            pass
 
-class Trial:
-    """
-    A single trial of the Monte Carlo simulation. Method Trial.run() returns the result.
-    """
+    def build_tables(self):
+        """
+        :return: a tuple of the tables, as numpy arrays: the products of the primes of the ranks of the non flush hands,
+        sorted, their strengths, and the strengths of the flushes indexed by the bitmask of their ranks.
+        """
+        # Non flush hands are keyed by the product of the primes of the 5 card ranks, which does not depend on the
+        # order of the cards and is unique to each combination of ranks.
+        rank_product_strengths = {}
+        # Flush hands have 5 distinct ranks, so they are indexed by the bitmask of the card ranks instead.
+        flush_strengths = [0] * (1 << 15)
+        for ranks in combinations_with_replacement(range(14, 14 - self.num_ranks, -1), 5):
+            # with 4 suits there is no five of a kind
+            if ranks[0] == ranks[4]:
+                continue
+            product = 1
+            for rank in ranks:
+                product *= RANK_PRIMES[rank]
+            rank_product_strengths[product] = self._compute_strength(ranks, is_flush=False)
+            if len(set(ranks)) == 5:
+                bitmask = 0
+                for rank in ranks:
+                    bitmask |= 1 << rank
+                flush_strengths[bitmask] = self._compute_strength(ranks, is_flush=True)
+        product_keys = np.array(sorted(rank_product_strengths), dtype=np.int64)
+        return (product_keys, np.array([rank_product_strengths[key] for key in product_keys], dtype=np.int32),
+                np.array(flush_strengths, dtype=np.int32))
 
-    def __init__(self, players, board, deck):
-        # deepcopy from the arguments so that the changes done in this trial would not affect other trials.
-        self.players = copy.deepcopy(players)
-        self.board = copy.deepcopy(board)
-        self.deck = copy.deepcopy(deck)
+    def _compute_strength(self, ranks, is_flush):
+        """
+        Works out the strength of a hand from its ranks, following the same rules as Hand.get_hand_ranking(). Only used
+        to build the tables.
+        :param ranks: a tuple of the 5 card ranks, sorted from high to low.
+        :param is_flush: boolean. True if all 5 cards are of the same suit.
+        """
+        ordered_ranks_counts = sorted(collections.Counter(ranks).items(), key=lambda item: (-item[1], -item[0]))
+        ordered_ranks = [rank for rank, count in ordered_ranks_counts]
+        counts = [count for rank, count in ordered_ranks_counts]
 
-    def run(self):
+        straight_rank = None
+        if len(ordered_ranks) == 5:
+            if ordered_ranks[0] - ordered_ranks[4] == 4:
+                straight_rank = ordered_ranks[0]
+            elif self.wheel_ranks is not None and tuple(ordered_ranks) == self.wheel_ranks:
+                # the ace plays as a 1, so the top card of the wheel is the second highest rank
+                straight_rank = ordered_ranks[1]
+
+        if is_flush:
+            if straight_rank is not None:
+                return pack_strength(9, [straight_rank])
+            return pack_strength(6, ordered_ranks)
+        if straight_rank is not None:
+            return pack_strength(5, [straight_rank])
+        if counts[0] == 4:
+            return pack_strength(8, ordered_ranks)
+        if counts[0] == 3:
+            if counts[1] == 2:
+                return pack_strength(7, ordered_ranks)
+            return pack_strength(4, ordered_ranks)
+        if counts[0] == 2:
+            if counts[1] == 2:
+                return pack_strength(3, ordered_ranks)
+            return pack_strength(2, ordered_ranks)
+        return pack_strength(1, ordered_ranks)
+
+    def evaluate(self, ranks, suits):
         """
-        :return: An array of Player objects who have won in this trial.
+        :param ranks: a sequence of the 5 card ranks, in any order.
+        :param suits: a sequence of the 5 card suits, in the same order as ranks.
+        :return: the integer strength of the hand. The higher, the better.
         """
+        if suits[0] == suits[1] == suits[2] == suits[3] == suits[4]:
+            return self.flush_strengths[(1 << ranks[0]) | (1 << ranks[1]) | (1 << ranks[2]) | (1 << ranks[3]) |
+                                        (1 << ranks[4])]
+        return self.rank_product_strengths[RANK_PRIMES[ranks[0]] * RANK_PRIMES[ranks[1]] * RANK_PRIMES[ranks[2]] *
+                                           RANK_PRIMES[ranks[3]] * RANK_PRIMES[ranks[4]]]
 
-        # deal the (remainder of) the board
-        for i in range(3):
-            for j in range(3):
-                if self.board.board_cards[i, j] is None:
-                    self.board.board_cards[i, j] = self.deck.deal()
-        self.board.generate_board_combos()
+    def evaluate_cards(self, cards):
+        """
+        :param cards: a sequence of 5 Card objects.
+        :return: the integer strength of the hand. The higher, the better.
+        """
+        return self.evaluate([card.rank for card in cards], [card.suit for card in cards])
 
-        # deal to players, if they have None in their hole_cards
-        for player in self.players:
-            for i in range(len(player.hole_cards)):
-                if player.hole_cards[i] is None:
-                    player.hole_cards[i] = self.deck.deal()
-            player.generate_hole_cards_combos()
-            player.generate_showdown_hand(self.board)
+    def line_data(self, cards):
+        """
+        :param cards: the 3 Card objects of a line of the board.
+        :return: what evaluate_line() needs of the line: a tuple of the product of the primes of its ranks, the bitmask
+        of its ranks, and its suit if the 3 cards are of the same suit, 0 otherwise.
+        """
+        suit = cards[0].suit if cards[0].suit == cards[1].suit == cards[2].suit else 0
+        return (RANK_PRIMES[cards[0].rank] * RANK_PRIMES[cards[1].rank] * RANK_PRIMES[cards[2].rank],
+                (1 << cards[0].rank) | (1 << cards[1].rank) | (1 << cards[2].rank), suit)
 
-        # showdown
-        winning_players = np.array([self.players[0]])
-        for player in self.players[1:]:
-            compare_result = player.showdown_hand.compare(winning_players[0].showdown_hand)
-            if compare_result == 1:
-                winning_players = np.array([player])
-            # in case of a tie
-            elif compare_result == 0:
-                winning_players = np.append(winning_players, player)
-        return winning_players
+    def hole_pairs(self, hole_cards):
+        """
+        :param hole_cards: the Card objects of the hole cards of a player.
+        :return: what evaluate_line() needs of the pairs of hole cards: a tuple of
+                     a list of (product of the primes of the ranks, (index, index) of the pair in hole_cards), one per
+                     pair of ranks, as the pairs with the same ranks make the same non flush hands,
+                     a dict of the suited pairs, by the suit, as lists of (bitmask of the ranks, (index, index)).
+        """
+        rank_pairs = {}
+        suited_pairs = {}
+        for i, j in HOLE_CARD_PAIRS.tolist():
+            first, second = hole_cards[i], hole_cards[j]
+            rank_pairs.setdefault(RANK_PRIMES[first.rank] * RANK_PRIMES[second.rank], (i, j))
+            if first.suit == second.suit:
+                suited_pairs.setdefault(first.suit, []).append(((1 << first.rank) | (1 << second.rank), (i, j)))
+        return list(rank_pairs.items()), suited_pairs
 
+    def evaluate_line(self, hole_pairs, line_data):
+        """
+        The best hand of exactly 2 hole cards and the 3 cards of a line, without evaluating every pair of hole cards:
+        flushes are only looked for if the line is of one suit, with the hole pairs of that suit, and since a line of
+        one suit has 3 different ranks, a flush there beats any non flush hand, so the other pairs are then skipped.
+        Non flush hands, straights included, only depend on the ranks, so they are evaluated once per pair of ranks.
+        :param hole_pairs: from hole_pairs()
+        :param line_data: from line_data()
+        :return: a tuple of the strength of the best hand and the (index, index) of its hole cards.
+        """
+        line_product, line_bitmask, line_suit = line_data
+        rank_pairs, suited_pairs = hole_pairs
+        best_strength = -1
+        if line_suit in suited_pairs:
+            for bitmask, pair in suited_pairs[line_suit]:
+                strength = self.flush_strengths[line_bitmask | bitmask]
+                if strength > best_strength:
+                    best_strength, best_pair = strength, pair
+            return best_strength, best_pair
+        for product, pair in rank_pairs:
+            strength = self.rank_product_strengths[line_product * product]
+            if strength > best_strength:
+                best_strength, best_pair = strength, pair
+        return best_strength, best_pair
 
-def card_input_validate(card_names, previous_cards, num_cards_required=None):
+    def center_tables(self):
+        """
+        The tables of center_strengths(), built the first time they are needed, or loaded from the on-disk cache: the
+        products of the primes of every 4 ranks, sorted, and for each of them the strength of the non flush hand they
+        make with a fifth card of each rank (indexed by the rank, -1 where there would be 5 cards of a rank).
+        """
+        if not hasattr(self, "partial_keys"):
+            tables = self.load_tables(("partial_keys", "partial_strengths"))
+            if tables is not None:
+                self.partial_keys, self.partial_strengths = tables
+                return tables
+            deck_ranks = range(14, 14 - self.num_ranks, -1)
+            partial_strengths = {}
+            for ranks in combinations_with_replacement(deck_ranks, 4):
+                product = 1
+                for rank in ranks:
+                    product *= RANK_PRIMES[rank]
+                strengths = [-1] * 15
+                for rank in deck_ranks:
+                    if ranks.count(rank) < 4:
+                        strengths[rank] = self.rank_product_strengths[product * RANK_PRIMES[rank]]
+                partial_strengths[product] = strengths
+            self.partial_keys = np.array(sorted(partial_strengths), dtype=np.int64)
+            self.partial_strengths = np.array([partial_strengths[key] for key in self.partial_keys], dtype=np.int32)
+            self.save_tables(("partial_keys", "partial_strengths"), (self.partial_keys, self.partial_strengths))
+        return self.partial_keys, self.partial_strengths
+
+    def center_strengths(self, codes):
+        '''
+        The best hands made by adding each possible fifth card to many 4-card partial hands, looking each partial hand
+        up once rather than evaluating every 5-card hand.
+        :param codes: an integer array of card codes, with the 4 cards of each partial hand on the last axis, and the
+        partial hands to take the best of on the 2 axes before it.
+        :return: an array of the strength of the best hand for each fifth card, indexed by its code on the last axis,
+        of the shape of codes without its last 3 axes, plus that last axis. -1 where no hand is possible.
+        '''
+        partial_keys, partial_strengths = self.center_tables()
+        ranks = codes >> 2
+        suits = codes & 3
+        products = self.rank_primes[ranks].prod(axis=-1)
+        rank_strengths = partial_strengths[np.searchsorted(partial_keys, products)].max(axis=(-3, -2))
+        # a fifth card of each suit and rank, non flush hands first
+        strengths = np.repeat(rank_strengths[..., :, np.newaxis], 4, axis=-1)
+        # then flushes, for the few partial hands of 4 cards of one suit
+        is_suited = (suits == suits[..., :1]).all(axis=-1)
+        if is_suited.any():
+            suited = np.nonzero(is_suited)
+            bitmasks = np.bitwise_or.reduce(np.left_shift(1, ranks[suited]), axis=-1)
+            flush_strengths = self.flush_strengths_array[bitmasks[:, np.newaxis] | (1 << np.arange(15))]
+            outer = suited[:-2]
+            for rank in range(15 - self.num_ranks, 15):
+                np.maximum.at(strengths, outer + (rank, suits[suited][:, 0]), flush_strengths[:, rank])
+        # strengths[..., rank, suit] is the strength for the card of code (rank << 2) | suit
+        return strengths.reshape(strengths.shape[:-2] + (-1,))
+
+    def evaluate_codes(self, codes):
+        '''
+        Vectorized evaluation of many hands at once.
+        :param codes: an integer array of card codes (see Card.code()), with the 5 cards of each hand on the last axis.
+        :return: an int32 array of the hand strengths, of the shape of codes without its last axis.
+        '''
+        ranks = codes >> 2
+        suits = codes & 3
+        is_flush = (suits == suits[..., :1]).all(axis=-1)
+        products = self.rank_primes[ranks].prod(axis=-1)
+        strengths = self.product_key_strengths[np.searchsorted(self.product_keys, products)]
+        if is_flush.any():
+            bitmasks = np.bitwise_or.reduce(np.left_shift(1, ranks), axis=-1)
+            strengths = np.where(is_flush, self.flush_strengths_array[bitmasks], strengths)
+        return strengths
+
+
+def pack_strength(category, ranks):
     """
-    To validate user input of cards, preventing wrong number of cards, cards not recognized in our notation, and
-    duplicated cards.
-    Called by prompt_user()
-    :param card_names: an array of strings, for the card names.
-    :param previous_cards: a set of strings, for the card names previously entered, to check for duplicates.
-    :param num_cards_required: the correct number of cards in card_names.
-    :return: boolean. True if the input is OK
+    Packs a hand ranking category and up to 5 card ranks into an integer strength, see HandEvaluator.
+    :param category: the hand ranking category, 1 (high card) to 9 (straightflush).
+    :param ranks: the card ranks, starting from the rank that needs to be compared first.
     """
-    if num_cards_required is not None and len(card_names) != num_cards_required:
-        print("Wrong number of cards.")
-        return False
-    for card_name in card_names:
-        if card_name == "*":
-            pass
-        elif len(card_name) == 2 and card_name[0] in RANK_NAMES.values() and card_name[1] in SUIT_NAMES.values():
-            pass
-        else:
-            print(card_name, " not recognized.")
-            return False
-        if card_name in previous_cards and card_name != "*":
-            print(card_name + " appearing more than once.")
-            return False
-        previous_cards.update(card_name)
-    return True
+    strength = category
+    for i in range(5):
+        strength = (strength << 4) | (ranks[i] if i < len(ranks) else 0)
+    return strength
 
 
-def prompt_user():
+def unpack_strength(strength):
     """
-    Prompts the user for inputs.
-    :return: A tuple containing:
-                 hole_cards_input: an array of strings for the names of the hole cards.
-                 board_input: a 2d array of strings, for the names of the board cards in each row.
-                 dead_cards_input: an array of strings, for the names of dead cards, if any.
-                 num_trials: the number of Monte Carlo trials to run.
+    The reverse of pack_strength().
+    :return: an array of 6 values in the same format as Hand.hand_ranking.
     """
-    while True:
-        try:
-            num_players = int(input("Number of players (2-10)? "))
-        except:
-            print("Not a valid number")
-        else:
-            if num_players > 1 and num_players < 11:
-                break
-            else:
-                print("Not a valid number")
+    hand_ranking = np.zeros(6, dtype=np.int8)
+    hand_ranking[0] = strength >> 20
+    for i in range(5):
+        hand_ranking[i + 1] = (strength >> (16 - 4 * i)) & 0xF
+    return hand_ranking
 
-    # previous_cards to record all card names entered for card_input_validate() to check for duplicates
-    previous_cards = set()
-    hole_cards_input = np.empty([num_players, NUM_HOLE_CARDS], dtype="<U2")
-    print("\nFormat e.g.: 'As' for ace of spades, '5c' for 5 of clubs, 'Th' for 10(ten) of hearts. Without the quotes.")
-    print("Use * for an unknown or undealt card.")
-    print("Separate each card with a comma.\n")
-    for i in range(num_players):
-        while True:
-            card_names = np.array(input("Player {} hole cards: \n".format(str(i + 1))).replace(" ", "").split(","))
-            if card_input_validate(card_names, previous_cards, NUM_HOLE_CARDS):
-                previous_cards.update(set(card_names))
-                hole_cards_input[i] = card_names
-                break
 
-    board_input = np.empty([3, 3], dtype="<U2")
-    for i in range(3):
-        while True:
-            card_names = np.array(input("Board row {}:\n".format(str(i + 1))).replace(" ", "").split(","))
-            if card_input_validate(card_names, previous_cards, 3):
-                previous_cards.update(set(card_names))
-                board_input[i] = card_names
-                break
+def get_evaluator(num_ranks=None, wheel_ranks="default"):
+    """
+    Returns a HandEvaluator, building its tables the first time it is asked for in the process, or loading them from
+    the on-disk cache in the directory of the global variable EVALUATOR_CACHE_DIR. Defaults to the global variables
+    DECK_NUM_RANKS and WHEEL_RANKS.
+    """
+    if num_ranks is None:
+        num_ranks = DECK_NUM_RANKS
+    if isinstance(wheel_ranks, str) and wheel_ranks == "default":
+        wheel_ranks = WHEEL_RANKS
+    key = (num_ranks, None if wheel_ranks is None else tuple(sorted(wheel_ranks, reverse=True)))
+    if key not in EVALUATORS:
+        EVALUATORS[key] = HandEvaluator(num_ranks=num_ranks, wheel_ranks=wheel_ranks, cache_dir=EVALUATOR_CACHE_DIR)
+    return EVALUATORS[key]
 
-    while True:
-        card_names = np.array(input("Dead cards: \n").replace(" ", "").split(","))
-        # even if the user hit enter without anything, card_names will still get [''] after the split.
-        # putting that into the validate function won't work as it will be counted as one unrecognized card.
-        if len(card_names) == 1 and card_names[0] == "":
-            dead_cards_input = np.empty([0], dtype="<U2")
-            break
-        elif card_input_validate(card_names, previous_cards, None):
-            dead_cards_input = card_names
-            break
 
-    while True:
-        try:
-            num_trials = int(input("Number of trials? "))
-        except:
-            print("Not a valid number")
-        else:
+def cross_check_evaluator(num_hands):
+    """
+    Cross-checks the HandEvaluator against the reference Hand.get_hand_ranking() and Hand.compare() on random hands,
+    dealt from a deck following the global variables DECK_NUM_RANKS, DECK_NUM_SUITS and WHEEL_RANKS.
+    :param num_hands: the number of random hands to check.
+    :return: the number of mismatches found. Each mismatch is printed out.
+    """
+    evaluator = get_evaluator()
+    mismatches = 0
+    previous_hand = None
+    previous_strength = None
+    for i in range(num_hands):
+        deck = Deck(num_ranks=DECK_NUM_RANKS, num_suits=DECK_NUM_SUITS)
+        hand = Hand(np.array([deck.deal() for j in range(5)]))
+        strength = evaluator.evaluate_cards(hand.cards)
+        if not np.array_equal(unpack_strength(strength), hand.hand_ranking):
+            print("Ranking mismatch on {}: {} vs {}".format(hand.cards, unpack_strength(strength), hand.hand_ranking))
+            mismatches += 1
+        elif previous_hand is not None and \
+                hand.compare(previous_hand) != (strength > previous_strength) - (strength < previous_strength):
+            print("Comparison mismatch on {} vs {}".format(hand.cards, previous_hand.cards))
+            mismatches += 1
+        previous_hand = hand
+        previous_strength = strength
+    print("Cross-checked {} hands, {} mismatches.".format(num_hands, mismatches))
+    return mismatches
+
+
+class SimulationStats:
+    """
+    Opt-in instrumentation of a simulation: the wall time and number of calls of each phase of the simulation loop, the
+    number of trials and of hands evaluated. Each phase timed is also passed on to the StatsHook objects in
+    SimulationStats.hooks, e.g. to forward it to a metrics system.
+    The phases of a Trial are "copy", "deal", "hole_cards_combos", "evaluate" and "showdown", those of the
+    BatchSimulator "deal" (or "enumerate"), "evaluate" and "showdown".
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.phase_seconds = collections.defaultdict(float)
+        self.phase_calls = collections.defaultdict(int)
+        self.num_trials = 0
+        self.num_hands_evaluated = 0
+        self.wall_seconds = 0.0
+
+    def __repr__(self):
+        return "SimulationStats of {} trials, {:.0f} trials/sec, {:.0f} hands evaluated/sec".format(
+            self.num_trials, self.trials_per_sec(), self.hands_per_sec())
+
+    def __getstate__(self):
+        # the hooks stay in the process they were given in
+        state = self.__dict__.copy()
+        state["hooks"] = []
+        return state
+
+    def add_phase(self, phase, seconds, calls=1):
+        self.phase_seconds[phase] += seconds
+        self.phase_calls[phase] += calls
+        for hook in self.hooks:
+            hook.on_phase(phase, seconds, calls)
+
+    def merge(self, other):
+        """Adds the stats of another SimulationStats object, e.g. of a worker process, to these."""
+        for phase in other.phase_seconds:
+            self.add_phase(phase, other.phase_seconds[phase], other.phase_calls[phase])
+        self.num_trials += other.num_trials
+        self.num_hands_evaluated += other.num_hands_evaluated
+
+    def finish(self, wall_seconds):
+        """Records the wall time of the whole simulation, and passes the stats on to the hooks."""
+        self.wall_seconds += wall_seconds
+        for hook in self.hooks:
+            hook.on_finish(self)
+
+    def trials_per_sec(self):
+        return self.num_trials / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def hands_per_sec(self):
+        return self.num_hands_evaluated / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def as_dict(self):
+        """:return: the stats as a dict of plain values, e.g. to be saved as JSON."""
+        return {
+            "num_trials": self.num_trials,
+            "num_hands_evaluated": self.num_hands_evaluated,
+            "wall_seconds": self.wall_seconds,
+            "trials_per_sec": self.trials_per_sec(),
+            "hands_per_sec": self.hands_per_sec(),
+            "phases": {phase: {"seconds": self.phase_seconds[phase], "calls": self.phase_calls[phase]}
+                       for phase in self.phase_seconds},
+        }
+
+    def report(self):
+        """:return: a printable table of the stats."""
+        lines = [repr(self)]
+        for phase in self.phase_seconds:
+            share = self.phase_seconds[phase] / self.wall_seconds if self.wall_seconds > 0 else 0.0
+            lines.append("    {:20} {:10.4f}s {:6.1%} {:10} calls".format(phase, self.phase_seconds[phase], share,
+                                                                          self.phase_calls[phase]))
+        return "\n".join(lines)
+
+
+class StatsHook:
+    """
+    The interface of the hooks of SimulationStats. Subclass it and override the methods to forward the stats, e.g. to a
+    metrics system.
+    """
+
+    def on_phase(self, phase, seconds, calls):
+        """Called each time a phase is timed, with its wall time and the number of calls it covers."""
+        pass
+
+    def on_finish(self, stats):
+        """Called with the SimulationStats object at the end of Question.answer()"""
+        pass
+
+
+class Estimate:
+    """
+    The running totals of a Monte Carlo simulation: the number of trials, and for each player the sum of the shares of
+    the pot won over the trials and the sum of their squares. The equities, their standard errors and confidence
+    intervals are estimated from them. Estimates of independent trials can be added up with +.
+    """
+
+    def __init__(self, num_trials, share_sums, share_square_sums):
+        self.num_trials = num_trials
+        self.share_sums = np.asarray(share_sums, dtype=float)
+        self.share_square_sums = np.asarray(share_square_sums, dtype=float)
+
+    def __repr__(self):
+        return "Estimate after {} trials: {}".format(self.num_trials, self.equities())
+
+    def __add__(self, other):
+        return Estimate(self.num_trials + other.num_trials, self.share_sums + other.share_sums,
+                        self.share_square_sums + other.share_square_sums)
+
+    def equities(self):
+        """
+        :return: the estimated equity of each player, between 0 and 1, in an array ordered by the player number.
+        """
+        return self.share_sums / max(self.num_trials, 1)
+
+    def std_errors(self):
+        """
+        :return: the standard error of the equity of each player. Infinite with fewer than 2 trials.
+        """
+        if self.num_trials < 2:
+            return np.full(len(self.share_sums), np.inf)
+        # sample variance of the share of the pot won in a trial
+        variances = (self.share_square_sums - self.share_sums * self.equities()) / (self.num_trials - 1)
+        return np.sqrt(np.maximum(variances, 0) / self.num_trials)
+
+    def confidence_intervals(self, z=1.96):
+        """
+        :param z: the number of standard errors on each side, 1.96 for a 95% confidence interval.
+        :return: a tuple of 2 arrays, the lower and upper ends of the confidence interval of each player's equity.
+        """
+        equities = self.equities()
+        return equities - z * self.std_errors(), equities + z * self.std_errors()
+
+    def effective_sample_size(self):
+        """
+        :return: the number of plain Monte Carlo trials the trials are worth, for the subclasses reducing variance.
+        """
+        return self.num_trials
+
+
+def empty_estimate(num_players):
+    """
+    :return: an Estimate of no trials yet for num_players players.
+    """
+    return Estimate(0, np.zeros(num_players), np.zeros(num_players))
+
+
+class ConditionalEstimate(Estimate):
+    """
+    The running totals of a simulation with the center card summed over exactly in each trial, see
+    BatchSimulator.run_center(): the share of each trial is the player's average share over every center card left.
+    ConditionalEstimate.share_moment_sums adds up the average squared shares too, which give the variance plain
+    sampling would have had, for the effective sample size.
+    """
+
+    def __init__(self, num_trials, share_sums, share_square_sums, share_moment_sums):
+        super().__init__(num_trials, share_sums, share_square_sums)
+        self.share_moment_sums = np.asarray(share_moment_sums, dtype=float)
+
+    def __add__(self, other):
+        if not isinstance(other, ConditionalEstimate):
+            return as_variance_reduced(other, self) + self
+        return ConditionalEstimate(self.num_trials + other.num_trials, self.share_sums + other.share_sums,
+                                   self.share_square_sums + other.share_square_sums,
+                                   self.share_moment_sums + other.share_moment_sums)
+
+    def __radd__(self, other):
+        return as_variance_reduced(other, self) + self
+
+    def effective_sample_size(self):
+        equities = self.equities()
+        plain_variances = self.share_moment_sums / max(self.num_trials, 1) - equities ** 2
+        return effective_sample_size(self.num_trials, plain_variances, self.std_errors())
+
+
+class StreetEstimate(ConditionalEstimate):
+    """
+    A ConditionalEstimate recording the equities street by street too, see BatchSimulator.run_center() with
+    street_report: StreetEstimate.turn_histograms counts the trials by each player's equity on the turn, given the
+    board but the center dealt in the trial, in STREET_HISTOGRAM_BINS bins of equal width, and
+    StreetEstimate.turn_variance_sums sums the variances of those equities when estimated from sampled hands. For each
+    card of StreetEstimate.center_codes, StreetEstimate.center_counts is the number of hands it could be the center in,
+    and StreetEstimate.center_share_sums the sums of each player's share of the pot with it there.
+    """
+
+    def __init__(self, num_trials, share_sums, share_square_sums, share_moment_sums, turn_histograms,
+                 turn_variance_sums, center_codes, center_counts, center_share_sums):
+        '''
+        :param turn_histograms: an array of shape (number of players, STREET_HISTOGRAM_BINS).
+        :param turn_variance_sums: an array of the sums over the trials of the variance of each player's equity on the
+        turn, as estimated from the hands of the trial.
+        :param center_codes: the codes of the cards that may be the center.
+        :param center_counts: an array of the number of hands of each center card.
+        :param center_share_sums: an array of shape (number of center cards, number of players).
+        '''
+        super().__init__(num_trials, share_sums, share_square_sums, share_moment_sums)
+        self.turn_histograms = np.asarray(turn_histograms, dtype=np.int64)
+        self.turn_variance_sums = np.asarray(turn_variance_sums, dtype=float)
+        self.center_codes = np.asarray(center_codes, dtype=np.int64)
+        self.center_counts = np.asarray(center_counts, dtype=np.int64)
+        self.center_share_sums = np.asarray(center_share_sums, dtype=float)
+
+    def __add__(self, other):
+        if not isinstance(other, StreetEstimate):
+            return as_variance_reduced(other, self) + self
+        return StreetEstimate(self.num_trials + other.num_trials, self.share_sums + other.share_sums,
+                              self.share_square_sums + other.share_square_sums,
+                              self.share_moment_sums + other.share_moment_sums,
+                              self.turn_histograms + other.turn_histograms,
+                              self.turn_variance_sums + other.turn_variance_sums, self.center_codes,
+                              self.center_counts + other.center_counts,
+                              self.center_share_sums + other.center_share_sums)
+
+    def __radd__(self, other):
+        return as_variance_reduced(other, self) + self
+
+    def turn_frequencies(self):
+        """
+        :return: an array of shape (number of players, STREET_HISTOGRAM_BINS), for each player the fraction of the
+        trials with an equity on the turn in each bin.
+        """
+        return self.turn_histograms / max(self.num_trials, 1)
+
+    def turn_std_errors(self):
+        """
+        :return: an array of the root mean square over the trials of the standard error of each player's equity on
+        the turn, the noise spreading StreetEstimate.turn_histograms over neighbouring bins. 0 if the hands of every
+        board were all gone through.
+        """
+        return np.sqrt(self.turn_variance_sums / max(self.num_trials, 1))
+
+    def center_equities(self):
+        """
+        :return: an array of shape (number of center cards, number of players), the equity of each player on the river
+        with each center card. nan for the cards never possible.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.center_share_sums / self.center_counts[:, np.newaxis]
+
+
+class StratifiedEstimate(Estimate):
+    """
+    The running totals of a simulation stratified by the rank of a corner card, see BatchSimulator.run_stratified(): for
+    each rank (stratum), its probability, the number of trials dealt with it, and the sums of the shares of the pot and
+    of their squares. The equities are the averages of the strata weighted by their probabilities, and the standard
+    errors only have the variance within the strata.
+    """
+
+    def __init__(self, stratum_probabilities, stratum_counts, stratum_share_sums, stratum_share_square_sums):
+        '''
+        :param stratum_probabilities: the probability of each stratum.
+        :param stratum_counts: the number of trials of each stratum.
+        :param stratum_share_sums: the sums of the shares of the pot, in an array of shape (number of strata, number
+        of players). The same for stratum_share_square_sums, with the squares.
+        '''
+        self.stratum_probabilities = np.asarray(stratum_probabilities, dtype=float)
+        self.stratum_counts = np.asarray(stratum_counts, dtype=np.int64)
+        self.stratum_share_sums = np.asarray(stratum_share_sums, dtype=float)
+        self.stratum_share_square_sums = np.asarray(stratum_share_square_sums, dtype=float)
+        super().__init__(int(self.stratum_counts.sum()), self.stratum_share_sums.sum(axis=0),
+                         self.stratum_share_square_sums.sum(axis=0))
+
+    def __add__(self, other):
+        if not isinstance(other, StratifiedEstimate):
+            return as_variance_reduced(other, self) + self
+        return StratifiedEstimate(self.stratum_probabilities, self.stratum_counts + other.stratum_counts,
+                                  self.stratum_share_sums + other.stratum_share_sums,
+                                  self.stratum_share_square_sums + other.stratum_share_square_sums)
+
+    def __radd__(self, other):
+        return as_variance_reduced(other, self) + self
+
+    def stratum_moments(self):
+        """
+        :return: a tuple of the probabilities of the strata with trials, normalized to add up to 1, and the means and
+        sample variances of the shares of the pot in each of them. The equities are biased while some strata have no
+        trials, the standard errors being infinite then.
+        """
+        sampled = self.stratum_counts > 0
+        counts = self.stratum_counts[sampled, np.newaxis]
+        means = self.stratum_share_sums[sampled] / counts
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variances = (self.stratum_share_square_sums[sampled] - means * self.stratum_share_sums[sampled]) / \
+                (counts - 1)
+        probabilities = self.stratum_probabilities[sampled]
+        return probabilities / probabilities.sum(), means, variances
+
+    def equities(self):
+        if self.num_trials == 0:
+            return np.zeros(len(self.share_sums))
+        probabilities, means, variances = self.stratum_moments()
+        return probabilities @ means
+
+    def std_errors(self):
+        # unknown until every stratum has the trials to estimate its variance
+        if (self.stratum_counts < MIN_STRATUM_TRIALS).any():
+            return np.full(len(self.share_sums), np.inf)
+        probabilities, means, variances = self.stratum_moments()
+        return np.sqrt(probabilities ** 2 @ (np.maximum(variances, 0) / self.stratum_counts[:, np.newaxis]))
+
+    def effective_sample_size(self):
+        probabilities, means, variances = self.stratum_moments()
+        # the variance within the strata plus that between them
+        plain_variances = probabilities @ (np.nan_to_num(variances) + (means - self.equities()) ** 2)
+        return effective_sample_size(self.num_trials, plain_variances, self.std_errors())
+
+
+def as_variance_reduced(estimate, like):
+    """
+    :param estimate: an Estimate of no trials, e.g. from empty_estimate().
+    :param like: a ConditionalEstimate, StreetEstimate or StratifiedEstimate.
+    :return: the estimate as an estimate of the class of like, to be added to it. Trials of another kind of simulation
+    cannot be added.
+    """
+    if estimate.num_trials > 0:
+        raise Exception("Cannot add up estimates of different kinds of simulation", estimate, like)
+    if isinstance(like, StratifiedEstimate):
+        return StratifiedEstimate(like.stratum_probabilities, np.zeros_like(like.stratum_counts),
+                                  np.zeros_like(like.stratum_share_sums), np.zeros_like(like.stratum_share_sums))
+    if isinstance(like, StreetEstimate):
+        return StreetEstimate(0, estimate.share_sums, estimate.share_square_sums, np.zeros_like(estimate.share_sums),
+                              np.zeros_like(like.turn_histograms), np.zeros_like(like.turn_variance_sums),
+                              like.center_codes,
+                              np.zeros_like(like.center_counts), np.zeros_like(like.center_share_sums))
+    return ConditionalEstimate(0, estimate.share_sums, estimate.share_square_sums, np.zeros_like(estimate.share_sums))
+
+
+def effective_sample_size(num_trials, plain_variances, std_errors):
+    """
+    :param plain_variances: the variance of the share of the pot of each player in a plain Monte Carlo trial.
+    :param std_errors: the standard errors of the equities of the simulation.
+    :return: the number of plain trials giving the same standard errors, for the player with the fewest. The number of
+    trials if no player's share varies.
+    """
+    varies = (plain_variances > 0) & (std_errors > 0)
+    if num_trials < 2 or not varies.any():
+        return num_trials
+    return float(np.min(plain_variances[varies] / std_errors[varies] ** 2))
+
+
+class PairedEstimate:
+    """
+    The running totals of a simulation of several variants of a question on common random numbers, see
+    SharedDrawSimulator: for each variant and player, the sums of the shares of the pot and of their squares, and of
+    the differences with the share of the same player in the first variant and of their squares. The variants are
+    simulated on the same draws, so the differences are much less noisy than between independent simulations.
+    Players a variant does not have count as 0 there.
+    """
+
+    def __init__(self, num_trials, share_sums, share_square_sums, difference_sums, difference_square_sums,
+                 num_players):
+        '''
+        :param share_sums, share_square_sums, difference_sums, difference_square_sums: arrays of shape (number of
+        variants, most players in a variant)
+        :param num_players: a tuple of the number of players of each variant.
+        '''
+        self.num_trials = num_trials
+        self.share_sums = np.asarray(share_sums, dtype=float)
+        self.share_square_sums = np.asarray(share_square_sums, dtype=float)
+        self.difference_sums = np.asarray(difference_sums, dtype=float)
+        self.difference_square_sums = np.asarray(difference_square_sums, dtype=float)
+        self.num_players = tuple(num_players)
+
+    def __repr__(self):
+        return "PairedEstimate of {} variants after {} trials".format(len(self.num_players), self.num_trials)
+
+    def __add__(self, other):
+        return PairedEstimate(self.num_trials + other.num_trials, self.share_sums + other.share_sums,
+                              self.share_square_sums + other.share_square_sums,
+                              self.difference_sums + other.difference_sums,
+                              self.difference_square_sums + other.difference_square_sums, self.num_players)
+
+    def variant_estimate(self, variant):
+        """:return: the Estimate of the equities of the players of a variant."""
+        num_players = self.num_players[variant]
+        return Estimate(self.num_trials, self.share_sums[variant, :num_players],
+                        self.share_square_sums[variant, :num_players])
+
+    def differences(self, variant):
+        """
+        :return: a tuple of 2 arrays, for each player of both the variant and the first variant: the equity in the
+        variant minus that in the first variant, and the standard error of that difference.
+        """
+        num_players = min(self.num_players[variant], self.num_players[0])
+        differences = Estimate(self.num_trials, self.difference_sums[variant, :num_players],
+                               self.difference_square_sums[variant, :num_players])
+        return differences.equities(), differences.std_errors()
+
+
+class WeightedEstimate(Estimate):
+    """
+    The running totals of a Monte Carlo simulation where the trials have weights, as when sampling hand ranges: the
+    equities are the weighted averages of the shares of the pot, and the standard errors those of a ratio estimate.
+    For each player with a range, the totals are broken down by holding too, in WeightedEstimate.holding_weight_sums
+    and WeightedEstimate.holding_share_sums, dicts of arrays by the player index.
+    """
+
+    def __init__(self, num_trials, share_sums, share_square_sums, weight_sum, weight_square_sum,
+                 share_weight_square_sums, holding_weight_sums=None, holding_share_sums=None):
+        '''
+        :param share_sums: for each player, the sum of weight x share of the pot.
+        :param share_square_sums: for each player, the sum of (weight x share) ** 2
+        :param weight_sum: the sum of the weights.
+        :param weight_square_sum: the sum of the squares of the weights.
+        :param share_weight_square_sums: for each player, the sum of weight ** 2 x share.
+        '''
+        super().__init__(num_trials, share_sums, share_square_sums)
+        self.weight_sum = weight_sum
+        self.weight_square_sum = weight_square_sum
+        self.share_weight_square_sums = np.asarray(share_weight_square_sums, dtype=float)
+        self.holding_weight_sums = {} if holding_weight_sums is None else holding_weight_sums
+        self.holding_share_sums = {} if holding_share_sums is None else holding_share_sums
+
+    def __add__(self, other):
+        if not isinstance(other, WeightedEstimate):
+            other = as_weighted_estimate(other)
+        holding_weight_sums = dict(self.holding_weight_sums)
+        holding_share_sums = dict(self.holding_share_sums)
+        for player in other.holding_weight_sums:
+            if player in holding_weight_sums:
+                holding_weight_sums[player] = holding_weight_sums[player] + other.holding_weight_sums[player]
+                holding_share_sums[player] = holding_share_sums[player] + other.holding_share_sums[player]
+            else:
+                holding_weight_sums[player] = other.holding_weight_sums[player]
+                holding_share_sums[player] = other.holding_share_sums[player]
+        return WeightedEstimate(self.num_trials + other.num_trials, self.share_sums + other.share_sums,
+                                self.share_square_sums + other.share_square_sums, self.weight_sum + other.weight_sum,
+                                self.weight_square_sum + other.weight_square_sum,
+                                self.share_weight_square_sums + other.share_weight_square_sums, holding_weight_sums,
+                                holding_share_sums)
+
+    def __radd__(self, other):
+        # an Estimate of no trials yet, plus this
+        return as_weighted_estimate(other) + self
+
+    def equities(self):
+        if self.weight_sum <= 0:
+            if self.num_trials > 0:
+                raise ValueError("No trial has holdings of the ranges that fit together", self.num_trials)
+            return np.zeros(len(self.share_sums))
+        return self.share_sums / self.weight_sum
+
+    def std_errors(self):
+        if self.num_trials < 2 or self.weight_sum <= 0:
+            return np.full(len(self.share_sums), np.inf)
+        equities = self.equities()
+        # sum of weight ** 2 x (share - equity) ** 2
+        deviations = self.share_square_sums - 2 * equities * self.share_weight_square_sums + \
+            equities ** 2 * self.weight_square_sum
+        return np.sqrt(np.maximum(deviations, 0) * self.num_trials / (self.num_trials - 1)) / self.weight_sum
+
+    def effective_sample_size(self):
+        """:return: the number of unweighted trials the weighted trials are worth."""
+        return self.weight_sum ** 2 / self.weight_square_sum if self.weight_square_sum > 0 else 0.0
+
+    def holding_equities(self, player_index):
+        """
+        :return: a tuple of 2 arrays, by holding of the range of the player: how often the holding was held, as a
+        fraction, and the equity of the player with it (nan if never held).
+        """
+        weight_sums = self.holding_weight_sums[player_index]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            equities = self.holding_share_sums[player_index] / weight_sums
+        return weight_sums / max(self.weight_sum, 1e-300), equities
+
+
+def as_weighted_estimate(estimate):
+    """:return: an Estimate of unweighted trials as a WeightedEstimate, every trial having a weight of 1."""
+    if isinstance(estimate, WeightedEstimate):
+        return estimate
+    return WeightedEstimate(estimate.num_trials, estimate.share_sums, estimate.share_square_sums, estimate.num_trials,
+                            estimate.num_trials, estimate.share_sums)
+
+
+class BatchSimulator:
+    """
+    The vectorized Monte Carlo engine. Instead of running Trial objects one at a time, a block of trials is sampled at
+    once as integer card codes (see Card.code()), and all the board lines x hole card pairs x players are evaluated with
+    numpy array operations, without any per trial Python objects.
+    Method BatchSimulator.run() returns the results.
+    """
+
+    def __init__(self, board_codes, hole_codes, stub_codes, num_ranks=None, wheel_ranks="default", ranges=None,
+                 variance_reduction=None, street_report=False):
+        '''
+        :param board_codes: an integer array of the 9 board card codes, row by row. -1 for an undealt card.
+        :param hole_codes: a 2d integer array of the hole card codes of each player. -1 for an undealt card.
+        :param stub_codes: an integer array of the codes of the cards left in the deck.
+        :param num_ranks, wheel_ranks: for get_evaluator()
+        :param ranges: None, or a list with for each player a HandRange, or None for the players without one. The hole
+        cards of the players with a range should be all undealt.
+        :param variance_reduction: None for plain sampling, "center" for run_center() or "stratified" for
+        run_stratified(), see VARIANCE_REDUCTIONS.
+        :param street_report: boolean. True for run_center() to record the equities on the turn and with each center
+        card too, which needs the "center" variance reduction.
+        '''
+        self.board_codes = np.asarray(board_codes, dtype=np.int64)
+        self.hole_codes = np.asarray(hole_codes, dtype=np.int64)
+        self.stub_codes = np.asarray(stub_codes, dtype=np.int64)
+        self.evaluator = get_evaluator(num_ranks, wheel_ranks)
+        self.num_ranks = self.evaluator.num_ranks
+        self.wheel_ranks = self.evaluator.wheel_ranks
+        self.unknown_board = np.flatnonzero(self.board_codes < 0)
+        # The holdings of the players with a range are sampled from it, then the other undealt cards uniformly. Only
+        # the holdings with all their cards still in the deck are kept, with the cards bitmask of the deck, and drawn
+        # by a RangeSampler of them.
+        self.range_tables = []
+        range_slots = np.zeros(self.hole_codes.shape, dtype=bool)
+        stub_mask = np.bitwise_or.reduce(np.left_shift(np.uint64(1), self.stub_codes.astype(np.uint64)))
+        for player, hand_range in enumerate(ranges or []):
+            if hand_range is None:
+                continue
+            if (self.hole_codes[player] >= 0).any():
+                raise Exception("A player with a range should have all hole cards unknown", player + 1)
+            available = (hand_range.masks & ~stub_mask) == 0
+            if not available.any():
+                raise Exception("No holding of the range left in the deck", player + 1)
+            self.range_tables.append((player, np.flatnonzero(available), hand_range.holdings[available],
+                                      hand_range.masks[available], hand_range.weights[available]))
+            range_slots[player] = True
+        self.set_range_samplers()
+        for i, j in combinations(range(len(self.range_tables)), 2):
+            holdings = self.range_tables[i][2]
+            # a block of the holdings at a time, as the first ones usually fit already
+            if not any(self.range_samplers[j].fitting_weights(holdings[start:start + BATCH_BLOCK_SIZE]).any()
+                       for start in range(0, len(holdings), BATCH_BLOCK_SIZE)):
+                raise ValueError("No holdings of the ranges of the players fit together", self.range_tables[i][0] + 1,
+                                 self.range_tables[j][0] + 1)
+        self.num_holdings = {player: len(ranges[player].holdings) for player, *table in self.range_tables}
+        self.unknown_holes = np.flatnonzero((self.hole_codes < 0).ravel() & ~range_slots.ravel())
+        if len(self.unknown_board) + len(self.unknown_holes) + NUM_HOLE_CARDS * len(self.range_tables) > \
+                len(self.stub_codes):
+            raise Exception("Not enough cards in deck")
+        # Only the lines with undealt cards change from trial to trial; the others, for the players whose hole cards
+        # are all known, are evaluated once here. E.g. on the turn, only the 4 lines through the center are left.
+        line_is_known = (self.board_codes[BOARD_LINES] >= 0).all(axis=1)
+        player_is_known = (self.hole_codes >= 0).all(axis=1)
+        self.varying_lines = np.flatnonzero(~line_is_known)
+        self.fixed_lines = np.flatnonzero(line_is_known)
+        self.unknown_players = np.flatnonzero(~player_is_known)
+        self.fixed_strengths = np.full(len(self.hole_codes), -1, dtype=np.int64)
+        if len(self.fixed_lines) > 0 and player_is_known.any():
+            self.fixed_strengths[player_is_known] = self.line_strengths(
+                self.board_codes[np.newaxis, :], self.hole_codes[np.newaxis, player_is_known], self.fixed_lines)[0]
+        self.hands_per_trial = len(HOLE_CARD_PAIRS) * (len(self.hole_codes) * len(self.varying_lines) +
+                                                       len(self.unknown_players) * len(self.fixed_lines))
+        if variance_reduction is not None:
+            if variance_reduction not in VARIANCE_REDUCTIONS:
+                raise Exception("Unknown variance reduction", variance_reduction)
+            if len(self.range_tables) > 0:
+                raise Exception("Variance reduction cannot be used with ranges")
+            if variance_reduction == "center" and self.board_codes[CENTER] >= 0:
+                raise Exception("The center card is already known")
+            if variance_reduction == "stratified" and (self.board_codes[CORNERS] >= 0).all():
+                raise Exception("The corner cards are already known")
+        if street_report and variance_reduction != "center":
+            raise Exception("The street report needs the center variance reduction")
+        self.variance_reduction = variance_reduction
+        self.street_report = street_report
+
+    def __repr__(self):
+        return "BatchSimulator for {} players, {} cards in deck".format(len(self.hole_codes), len(self.stub_codes))
+
+    def __getstate__(self):
+        # only the card codes are sent to the worker processes of simulate_in_chunks(), which get their own evaluator
+        state = self.__dict__.copy()
+        del state["evaluator"]
+        # and their own RangeSampler objects, built once per process
+        del state["range_samplers"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.evaluator = get_evaluator(self.num_ranks, self.wheel_ranks)
+        self.set_range_samplers()
+
+    def set_range_samplers(self):
+        """Sets BatchSimulator.range_samplers, the RangeSampler of each range of BatchSimulator.range_tables."""
+        self.range_samplers = [get_range_sampler(holdings, weights)
+                               for player, range_indices, holdings, masks, weights in self.range_tables]
+
+    def deal_block(self, num_trials, rng):
+        '''
+        Deals the undealt cards of num_trials trials at once.
+        :param rng: a numpy random Generator
+        :return: a tuple of the board codes, in an array of shape (num_trials, 9), and the hole card codes, in an array
+        of shape (num_trials, number of players, NUM_HOLE_CARDS)
+        '''
+        num_unknown_board = len(self.unknown_board)
+        num_unknown = num_unknown_board + len(self.unknown_holes)
+        # a random ordering of the deck for each trial, of which only the first num_unknown cards are used
+        order = np.argsort(rng.random((num_trials, len(self.stub_codes))), axis=1)[:, :num_unknown]
+        return self.fill_block(self.stub_codes[order])
+
+    def deal_inner_block(self, num_trials, num_inner, rng, hole_deals=None):
+        '''
+        Deals the undealt board cards of num_trials trials, then num_inner times the undealt hole cards of each trial
+        from the cards left, see run_center().
+        :param rng: a numpy random Generator
+        :param hole_deals: None to deal the hole cards at random. Otherwise every way of dealing them, from
+        inner_hole_deals(), num_inner of them, from the cards left by the board but the center, whose card is not used.
+        :return: a tuple of the board and hole card codes as in deal_block(), of num_trials * num_inner hands, those of
+        a trial next to each other.
+        '''
+        num_unknown_board = len(self.unknown_board)
+        board_order = np.argsort(rng.random((num_trials, len(self.stub_codes))), axis=1)[:, :num_unknown_board]
+        if hole_deals is not None:
+            is_dealt = np.zeros((num_trials, len(self.stub_codes)), dtype=bool)
+            np.put_along_axis(is_dealt, board_order[:, self.unknown_board != CENTER], True, axis=1)
+            cards_left = np.argsort(is_dealt, axis=1, kind="stable")[:, :len(self.stub_codes) - num_unknown_board + 1]
+            hole_order = cards_left[:, hole_deals]
+        else:
+            # the board cards of the trial are put last in the ordering of each of its hands
+            keys = rng.random((num_trials, num_inner, len(self.stub_codes)))
+            np.put_along_axis(keys, np.repeat(board_order[:, np.newaxis, :], num_inner, axis=1), 2.0, axis=2)
+            hole_order = np.argsort(keys, axis=2)[:, :, :len(self.unknown_holes)]
+        dealt = np.concatenate((np.repeat(board_order[:, np.newaxis, :], num_inner, axis=1), hole_order), axis=2)
+        return self.fill_block(self.stub_codes[dealt.reshape(num_trials * num_inner, -1)])
+
+    def inner_hole_deals(self):
+        '''
+        :return: every way of dealing the undealt hole cards once the board but the center is dealt, for
+        deal_inner_block(), as the indices of the cards among the cards left, in an array of shape (number of ways,
+        number of undealt hole cards). None if there are more than STREET_EXACT_INNER_TRIALS ways.
+        '''
+        num_cards_left = len(self.stub_codes) - len(self.unknown_board) + 1
+        hole_counts = tuple((self.hole_codes < 0).sum(axis=1))
+        num_deals = 1
+        num_remaining = num_cards_left
+        for num_unknown in hole_counts:
+            num_deals *= math.comb(num_remaining, num_unknown)
+            num_remaining -= num_unknown
+        if num_deals > STREET_EXACT_INNER_TRIALS:
+            return None
+        return np.array(list(self.generate_completions(tuple(range(num_cards_left)), 0, hole_counts)),
+                        dtype=np.int64).reshape(num_deals, len(self.unknown_holes))
+
+    def deal_range_block(self, num_trials, rng):
+        '''
+        Deals the undealt cards of num_trials trials at once, with the holdings of the players with a range sampled
+        from it first. Each holding is drawn among those not colliding with the holdings drawn before it, see
+        RangeSampler, so no trial is ever rejected; the trials are weighted to make up for it, by how much of the range
+        was still available.
+        :param rng: a numpy random Generator
+        :return: a tuple of the board and hole card codes as in deal_block(), the weights of the trials, and a dict of
+        the index in the range of the holding of each player with a range, in an array of shape (num_trials,)
+        '''
+        taken = np.zeros(num_trials, dtype=np.uint64)
+        taken_codes = np.zeros((num_trials, 0), dtype=np.int64)
+        trial_weights = np.ones(num_trials)
+        range_holdings = {}
+        holding_indices = {}
+        for (player, range_indices, holdings, masks, weights), sampler in zip(self.range_tables, self.range_samplers):
+            picks, available = sampler.draw(taken, taken_codes, rng)
+            trial_weights *= available / sampler.total
+            taken |= masks[picks]
+            taken_codes = np.concatenate((taken_codes, holdings[picks]), axis=1)
+            range_holdings[player] = holdings[picks]
+            holding_indices[player] = range_indices[picks]
+        # the other undealt cards, from the cards not taken by the holdings, which are put last in the ordering
+        keys = rng.random((num_trials, len(self.stub_codes)))
+        keys[((taken[:, np.newaxis] >> self.stub_codes.astype(np.uint64)[np.newaxis, :]) & np.uint64(1)) == 1] = 2.0
+        order = np.argsort(keys, axis=1)[:, :len(self.unknown_board) + len(self.unknown_holes)]
+        board, holes = self.fill_block(self.stub_codes[order])
+        for player in range_holdings:
+            holes[:, player] = range_holdings[player]
+        return board, holes, trial_weights, holding_indices
+
+    def fill_block(self, dealt):
+        '''
+        :param dealt: the codes of the cards dealt to the undealt places, in an array of shape (number of trials, number
+        of undealt cards). The board places come first, row by row, then the hole cards, player by player.
+        :return: a tuple of the board codes and the hole card codes, as in deal_block()
+        '''
+        num_trials = len(dealt)
+        num_unknown_board = len(self.unknown_board)
+        board = np.repeat(self.board_codes[np.newaxis, :], num_trials, axis=0)
+        board[:, self.unknown_board] = dealt[:, :num_unknown_board]
+        holes = np.repeat(self.hole_codes.reshape(1, -1), num_trials, axis=0)
+        holes[:, self.unknown_holes] = dealt[:, num_unknown_board:]
+        return board, holes.reshape(num_trials, len(self.hole_codes), -1)
+
+    def count_completions(self):
+        '''
+        :return: the number of different ways the undealt cards can be dealt. The board places are all different, while
+        the order of the undealt hole cards of a player does not matter.
+        '''
+        num_completions = math.perm(len(self.stub_codes), len(self.unknown_board))
+        num_remaining = len(self.stub_codes) - len(self.unknown_board)
+        for num_unknown in (self.hole_codes < 0).sum(axis=1):
+            num_completions *= math.comb(num_remaining, num_unknown)
+            num_remaining -= num_unknown
+        return num_completions
+
+    def generate_completions(self, remaining, num_board, hole_counts):
+        '''
+        Generates every way of dealing the undealt cards, each as a tuple of card codes in the order of fill_block().
+        :param remaining: a tuple of the codes of the cards still in the deck.
+        :param num_board: number of undealt board places.
+        :param hole_counts: a tuple of the number of undealt hole cards of each player.
+        '''
+        if num_board > 0:
+            for board_cards in permutations(remaining, num_board):
+                rest = tuple(card for card in remaining if card not in board_cards)
+                for hole_cards in self.generate_completions(rest, 0, hole_counts):
+                    yield board_cards + hole_cards
+        elif len(hole_counts) > 0:
+            for hole_cards in combinations(remaining, hole_counts[0]):
+                rest = tuple(card for card in remaining if card not in hole_cards)
+                for other_hole_cards in self.generate_completions(rest, 0, hole_counts[1:]):
+                    yield hole_cards + other_hole_cards
+        else:
+            yield ()
+
+    def showdown_strengths(self, board, holes, varying_lines=None):
+        '''
+        :param board: board codes, in an array of shape (num_trials, 9)
+        :param holes: hole card codes, in an array of shape (num_trials, number of players, NUM_HOLE_CARDS)
+        :param varying_lines: the lines with undealt cards to evaluate, all of them (BatchSimulator.varying_lines) by
+        default.
+        :return: the strength of the best hand of each player, in an array of shape (num_trials, number of players)
+        '''
+        if varying_lines is None:
+            varying_lines = self.varying_lines
+        strengths = np.repeat(self.fixed_strengths[np.newaxis, :], len(board), axis=0)
+        if len(varying_lines) > 0:
+            strengths = np.maximum(strengths, self.line_strengths(board, holes, varying_lines))
+        if len(self.fixed_lines) > 0 and len(self.unknown_players) > 0:
+            strengths[:, self.unknown_players] = np.maximum(
+                strengths[:, self.unknown_players],
+                self.line_strengths(board, holes[:, self.unknown_players], self.fixed_lines))
+        return strengths
+
+    def line_strengths(self, board, holes, lines):
+        '''
+        :param board: board codes, in an array of shape (num_trials, 9)
+        :param holes: hole card codes, in an array of shape (num_trials, number of players, NUM_HOLE_CARDS)
+        :param lines: the indices in BOARD_LINES of the lines to evaluate.
+        :return: the strength of the best hand of each player on those lines, in an array of shape (num_trials, number
+        of players)
+        '''
+        line_codes = board[:, BOARD_LINES[lines]]
+        pairs = holes[:, :, HOLE_CARD_PAIRS]
+        num_trials, num_players, num_pairs = pairs.shape[:3]
+        hands = np.empty((num_trials, num_players, num_pairs, len(lines), 5), dtype=np.int64)
+        hands[..., :2] = pairs[:, :, :, np.newaxis, :]
+        hands[..., 2:] = line_codes[:, np.newaxis, np.newaxis, :, :]
+        return self.evaluator.evaluate_codes(hands).max(axis=(2, 3))
+
+    def run(self, num_trials, rng, block_size=None, stats=None):
+        '''
+        :param num_trials: the number of trials to run.
+        :param rng: a numpy random Generator
+        :param block_size: the number of trials sampled at once. Defaults to the global variable BATCH_BLOCK_SIZE.
+        :param stats: a SimulationStats object to time the phases in. None for no instrumentation.
+        :return: an Estimate of the trials.
+        '''
+        if block_size is None:
+            block_size = BATCH_BLOCK_SIZE
+        if len(self.range_tables) > 0:
+            return self.run_ranges(num_trials, rng, block_size, stats)
+        if self.variance_reduction == "center":
+            return self.run_center(num_trials, rng, block_size, stats)
+        if self.variance_reduction == "stratified":
+            return self.run_stratified(num_trials, rng, block_size, stats)
+        share_sums = np.zeros(len(self.hole_codes), dtype=float)
+        share_square_sums = np.zeros(len(self.hole_codes), dtype=float)
+        trials_done = 0
+        while trials_done < num_trials:
+            block_trials = min(block_size, num_trials - trials_done)
+            if stats is None:
+                shares = self.pot_shares(*self.deal_block(block_trials, rng))
+            else:
+                shares = self.timed_pot_shares(lambda: self.deal_block(block_trials, rng), "deal", stats)
+            share_sums += shares.sum(axis=0)
+            share_square_sums += (shares ** 2).sum(axis=0)
+            trials_done += block_trials
+        return Estimate(num_trials, share_sums, share_square_sums)
+
+    def run_ranges(self, num_trials, rng, block_size, stats=None):
+        '''
+        BatchSimulator.run() for the questions with hand ranges, with the trials dealt by deal_range_block().
+        :return: a WeightedEstimate of the trials.
+        '''
+        num_players = len(self.hole_codes)
+        estimate = WeightedEstimate(0, np.zeros(num_players), np.zeros(num_players), 0.0, 0.0, np.zeros(num_players),
+                                    {player: np.zeros(size) for player, size in self.num_holdings.items()},
+                                    {player: np.zeros(size) for player, size in self.num_holdings.items()})
+        trials_done = 0
+        while trials_done < num_trials:
+            block_trials = min(block_size, num_trials - trials_done)
+            block = {}
+
+            def deal():
+                board, holes, block["weights"], block["holding_indices"] = self.deal_range_block(block_trials, rng)
+                return board, holes
+
+            if stats is None:
+                shares = self.pot_shares(*deal())
+            else:
+                shares = self.timed_pot_shares(deal, "deal", stats)
+            weights = block["weights"][:, np.newaxis]
+            holding_weight_sums, holding_share_sums = {}, {}
+            for player, indices in block["holding_indices"].items():
+                holding_weight_sums[player] = np.bincount(indices, weights=block["weights"],
+                                                          minlength=self.num_holdings[player])
+                holding_share_sums[player] = np.bincount(indices, weights=block["weights"] * shares[:, player],
+                                                         minlength=self.num_holdings[player])
+            estimate = estimate + WeightedEstimate(
+                block_trials, (weights * shares).sum(axis=0), ((weights * shares) ** 2).sum(axis=0),
+                weights.sum(), (weights ** 2).sum(), (weights ** 2 * shares).sum(axis=0), holding_weight_sums,
+                holding_share_sums)
+            trials_done += block_trials
+        return estimate
+
+    def run_center(self, num_trials, rng, block_size, stats=None):
+        '''
+        BatchSimulator.run() with the center card summed over: each trial deals the other undealt cards, then goes
+        through every card left for the center, so its share of the pot is the expected share given the other cards.
+        The 4 lines without the center are evaluated once per trial, and each hole card pair with the 2 other cards of
+        a line through the center is looked up once for every center card, see HandEvaluator.center_strengths().
+        With BatchSimulator.street_report, a trial deals the board but the center once, then STREET_INNER_TRIALS hands
+        of the undealt hole cards on it, so that the average of their shares is the equity on the turn, with the hole
+        cards unknown as in the question. If there are at most STREET_EXACT_INNER_TRIALS ways to deal the hole cards,
+        the hands are all of them instead, and the equity on the turn is exact. The equities given each center card
+        come out of the same shares.
+        :return: a ConditionalEstimate of the trials, a StreetEstimate with BatchSimulator.street_report.
+        '''
+        free_lines = np.setdiff1d(self.varying_lines, CENTER_LINES)
+        num_centers = len(self.stub_codes)
+        # the hands dealt on each board, only one if no hole card is undealt, all of them if they are few
+        hole_deals = None
+        num_inner = 1
+        if self.street_report and len(self.unknown_holes) > 0:
+            hole_deals = self.inner_hole_deals()
+            num_inner = STREET_INNER_TRIALS if hole_deals is None else len(hole_deals)
+        # the shares of every center card of every hand of a block are held at once
+        block_size = max(1, block_size * len(BOARD_LINES) // (num_centers * num_inner))
+        num_players = len(self.hole_codes)
+        estimate = ConditionalEstimate(0, np.zeros(num_players), np.zeros(num_players), np.zeros(num_players))
+        if self.street_report:
+            estimate = StreetEstimate(0, np.zeros(num_players), np.zeros(num_players), np.zeros(num_players),
+                                      np.zeros((num_players, STREET_HISTOGRAM_BINS)), np.zeros(num_players),
+                                      self.stub_codes,
+                                      np.zeros(num_centers), np.zeros((num_centers, num_players)))
+        trials_done = 0
+        while trials_done < num_trials:
+            block_trials = min(block_size, num_trials - trials_done)
+            if stats is not None:
+                start = time.perf_counter()
+            if num_inner > 1:
+                board, holes = self.deal_inner_block(block_trials, num_inner, rng, hole_deals)
+            else:
+                board, holes = self.deal_block(block_trials, rng)
+            num_hands = len(board)
+            if stats is not None:
+                dealt = time.perf_counter()
+                stats.add_phase("deal", dealt - start)
+            free_strengths = self.showdown_strengths(board, holes, free_lines)
+            # the hole card pairs with the 2 other cards of each line through the center, of shape (number of trials,
+            # number of players, number of pairs, number of lines, 4)
+            partial_hands = np.empty(holes.shape[:2] + (len(HOLE_CARD_PAIRS), len(CENTER_LINES), 4), dtype=np.int64)
+            partial_hands[..., :2] = holes[:, :, HOLE_CARD_PAIRS][:, :, :, np.newaxis, :]
+            partial_hands[..., 2:] = board[:, np.newaxis, np.newaxis, CENTER_LINE_OTHERS]
+            center_strengths = self.evaluator.center_strengths(partial_hands)[:, :, self.stub_codes]
+            strengths = np.maximum(free_strengths[:, :, np.newaxis], center_strengths).transpose(0, 2, 1).reshape(
+                num_hands * num_centers, num_players)
+            if stats is not None:
+                evaluated = time.perf_counter()
+                stats.add_phase("evaluate", evaluated - dealt)
+            shares = self.shares_from_strengths(strengths).reshape(num_hands, num_centers, num_players)
+            # the center cards dealt elsewhere in the hand are not possible
+            others = np.concatenate((np.delete(board, CENTER, axis=1), holes.reshape(num_hands, -1)), axis=1)
+            possible = ~(self.stub_codes[np.newaxis, :, np.newaxis] == others[:, np.newaxis, :]).any(axis=2)
+            center_weights = (possible / possible.sum(axis=1, keepdims=True))[:, :, np.newaxis]
+            # the share of a trial is the average over its hands
+            hand_shares = (shares * center_weights).sum(axis=1).reshape(block_trials, num_inner, num_players)
+            conditional_shares = hand_shares.mean(axis=1)
+            sums = (block_trials, conditional_shares.sum(axis=0), (conditional_shares ** 2).sum(axis=0),
+                    (shares ** 2 * center_weights).sum(axis=(0, 1)) / num_inner)
+            if self.street_report:
+                # the equity of each trial is the one on the turn, and the shares of its hands those of the river on
+                # each center
+                bins = np.minimum((conditional_shares * STREET_HISTOGRAM_BINS).astype(np.int64),
+                                  STREET_HISTOGRAM_BINS - 1)
+                turn_histograms = np.stack([np.bincount(bins[:, player], minlength=STREET_HISTOGRAM_BINS)
+                                            for player in range(num_players)])
+                # the variance of the equity on the turn of each trial, none if its hands are all gone through
+                turn_variances = np.zeros(num_players)
+                if hole_deals is None and num_inner > 1:
+                    turn_variances = (hand_shares.var(axis=1, ddof=1) / num_inner).sum(axis=0)
+                estimate = estimate + StreetEstimate(*sums, turn_histograms, turn_variances, self.stub_codes,
+                                                     possible.sum(axis=0),
+                                                     (shares * possible[:, :, np.newaxis]).sum(axis=0))
+            else:
+                estimate = estimate + ConditionalEstimate(*sums)
+            if stats is not None:
+                stats.add_phase("showdown", time.perf_counter() - evaluated)
+                stats.num_trials += block_trials
+                # a lookup of a partial hand counting as one hand
+                stats.num_hands_evaluated += num_hands * len(HOLE_CARD_PAIRS) * (
+                    num_players * (len(free_lines) + len(CENTER_LINES)) +
+                    len(self.unknown_players) * len(self.fixed_lines))
+            trials_done += block_trials
+        return estimate
+
+    def run_stratified(self, num_trials, rng, block_size, stats=None):
+        '''
+        BatchSimulator.run() stratified by the rank of the first undealt corner: each block deals each rank there twice
+        if it has trials enough, so that the variance within every stratum is known, the rest of the trials in
+        proportion to the probability of the rank, rounded at random, then the other undealt cards at random.
+        :return: a StratifiedEstimate of the trials.
+        '''
+        corner = [place for place in CORNERS if self.board_codes[place] < 0][0]
+        corner_index = int(np.flatnonzero(self.unknown_board == corner)[0])
+        stub_ranks = self.stub_codes >> 2
+        ranks, rank_counts = np.unique(stub_ranks, return_counts=True)
+        probabilities = rank_counts / len(self.stub_codes)
+        num_players = len(self.hole_codes)
+        estimate = StratifiedEstimate(probabilities, np.zeros(len(ranks), dtype=np.int64),
+                                      np.zeros((len(ranks), num_players)), np.zeros((len(ranks), num_players)))
+        num_unknown = len(self.unknown_board) + len(self.unknown_holes)
+        trials_done = 0
+        while trials_done < num_trials:
+            block_trials = min(block_size, num_trials - trials_done)
+            block = {}
+
+            def deal():
+                # the same minimum number of trials in every stratum, then proportional allocation, the remainder
+                # going to strata drawn in proportion to their fractional parts
+                minimum = min(MIN_STRATUM_TRIALS, block_trials // len(ranks))
+                expected = (block_trials - minimum * len(ranks)) * probabilities
+                counts = np.floor(expected).astype(np.int64)
+                remainder = block_trials - minimum * len(ranks) - counts.sum()
+                if remainder > 0:
+                    fractions = expected - counts
+                    counts[rng.choice(len(ranks), remainder, replace=False, p=fractions / fractions.sum())] += 1
+                counts += minimum
+                strata = np.repeat(np.arange(len(ranks)), counts)
+                # the corner card: a random card of the rank of the stratum, then the others from the rest of the deck
+                keys = rng.random((block_trials, len(self.stub_codes)))
+                corner_keys = np.where(stub_ranks[np.newaxis, :] == ranks[strata][:, np.newaxis], keys, 2.0)
+                corner_cards = np.argmin(corner_keys, axis=1)
+                # new keys, as those of the other cards of the rank are larger than the corner card's
+                keys = rng.random((block_trials, len(self.stub_codes)))
+                keys[np.arange(block_trials), corner_cards] = 2.0
+                order = np.argsort(keys, axis=1)[:, :num_unknown - 1]
+                dealt = np.insert(self.stub_codes[order], corner_index, self.stub_codes[corner_cards], axis=1)
+                block["strata"] = strata
+                return self.fill_block(dealt)
+
+            if stats is None:
+                shares = self.pot_shares(*deal())
+            else:
+                shares = self.timed_pot_shares(deal, "deal", stats)
+            estimate = estimate + StratifiedEstimate(
+                probabilities, np.bincount(block["strata"], minlength=len(ranks)),
+                np.stack([np.bincount(block["strata"], weights=shares[:, player], minlength=len(ranks))
+                          for player in range(num_players)], axis=1),
+                np.stack([np.bincount(block["strata"], weights=shares[:, player] ** 2, minlength=len(ranks))
+                          for player in range(num_players)], axis=1))
+            trials_done += block_trials
+        return estimate
+
+    def run_exact(self, block_size=None, stats=None):
+        '''
+        Goes through every way of dealing the undealt cards instead of sampling them.
+        :param block_size: the number of completions evaluated at once. Defaults to the global variable
+        BATCH_BLOCK_SIZE.
+        :param stats: a SimulationStats object to time the phases in. None for no instrumentation.
+        :return: the exact equity of each player, in an array ordered by the player number.
+        '''
+        if block_size is None:
+            block_size = BATCH_BLOCK_SIZE
+        results = np.zeros(len(self.hole_codes), dtype=float)
+        hole_counts = tuple((self.hole_codes < 0).sum(axis=1))
+        completions = self.generate_completions(tuple(self.stub_codes), len(self.unknown_board), hole_counts)
+        num_completions = 0
+
+        def next_block():
+            dealt = np.array(list(islice(completions, block_size)), dtype=np.int64)
+            return self.fill_block(dealt.reshape(len(dealt), -1)) if len(dealt) > 0 else None
+
+        while True:
+            if stats is None:
+                block = next_block()
+                if block is None:
+                    break
+                shares = self.pot_shares(*block)
+            else:
+                shares = self.timed_pot_shares(next_block, "enumerate", stats)
+                if shares is None:
+                    break
+            results += shares.sum(axis=0)
+            num_completions += len(shares)
+        return results / num_completions
+
+    def timed_pot_shares(self, deal, deal_phase, stats):
+        '''
+        pot_shares() with its phases timed in stats.
+        :param deal: a function returning the board and hole card codes of a block, as deal_block(), or None if there
+        are no more.
+        :param deal_phase: the name of the phase of the deal function.
+        :return: the pot_shares() of the block, None if there are no more.
+        '''
+        start = time.perf_counter()
+        block = deal()
+        dealt = time.perf_counter()
+        stats.add_phase(deal_phase, dealt - start)
+        if block is None:
+            return None
+        strengths = self.showdown_strengths(*block)
+        evaluated = time.perf_counter()
+        stats.add_phase("evaluate", evaluated - dealt)
+        shares = self.shares_from_strengths(strengths)
+        stats.add_phase("showdown", time.perf_counter() - evaluated)
+        stats.num_trials += len(shares)
+        stats.num_hands_evaluated += len(shares) * self.hands_per_trial
+        return shares
+
+    def pot_shares(self, board, holes):
+        '''
+        :return: the share of the pot won by each player in each trial, in an array of shape (number of trials, number
+        of players). Ties split the pot equally between the tied players.
+        '''
+        return self.shares_from_strengths(self.showdown_strengths(board, holes))
+
+    def shares_from_strengths(self, strengths):
+        '''
+        :param strengths: the showdown_strengths() of a block of trials.
+        :return: the pot_shares() of the block.
+        '''
+        winners = strengths == strengths.max(axis=1, keepdims=True)
+        return winners / winners.sum(axis=1, keepdims=True)
+
+
+class SharedDrawSimulator:
+    """
+    Simulates several variants of a question on common random numbers: each trial draws one random ordering of the
+    whole deck, and every variant deals its undealt cards in that order, replacing the cards it already has. The
+    variants thus share their boards and opponents' hole cards in most trials, so the differences between their
+    equities are precise after far fewer trials than with independent simulations. The hands shared by several
+    variants, the same hole cards on the same board, are evaluated once for all of them.
+    Method SharedDrawSimulator.run() returns a PairedEstimate, like BatchSimulator.run() an Estimate.
+    """
+
+    def __init__(self, simulators, variant=None):
+        '''
+        :param simulators: a BatchSimulator for each variant, without ranges nor variance reduction, all with the
+        evaluator of the game variant.
+        :param variant: the GameVariant of the game, whose deck the orderings are drawn from, see get_variant()
+        '''
+        variant = get_variant(variant)
+        for simulator in simulators:
+            if len(simulator.range_tables) > 0 or simulator.variance_reduction is not None:
+                raise Exception("Variants with ranges or variance reduction cannot share draws")
+            if simulator.evaluator is not variant.evaluator():
+                raise Exception("Variants of different games cannot share draws", variant)
+        self.simulators = simulators
+        self.deck_codes = variant.new_deck().codes
+        self.num_players = tuple(len(simulator.hole_codes) for simulator in simulators)
+        self.evaluator = simulators[0].evaluator
+
+    def __repr__(self):
+        return "SharedDrawSimulator for {} variants".format(len(self.simulators))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["evaluator"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.evaluator = self.simulators[0].evaluator
+
+    def empty_estimate(self):
+        """:return: a PairedEstimate of no trials yet."""
+        shape = (len(self.simulators), max(self.num_players))
+        return PairedEstimate(0, np.zeros(shape), np.zeros(shape), np.zeros(shape), np.zeros(shape), self.num_players)
+
+    def deal_block(self, num_trials, rng):
+        '''
+        :return: a list of the board and hole card codes of the trials of each variant, as BatchSimulator.deal_block()
+        '''
+        order = self.deck_codes[np.argsort(rng.random((num_trials, len(self.deck_codes))), axis=1)]
+        blocks = []
+        for simulator in self.simulators:
+            num_unknown = len(simulator.unknown_board) + len(simulator.unknown_holes)
+            is_available = np.isin(order, simulator.stub_codes)
+            dealt, is_missing = order[:, :num_unknown], ~is_available[:, :num_unknown]
+            # The cards the variant already has are replaced by the next cards of the ordering it can deal, so that
+            # a card only changes the place it would have been dealt to, not the cards dealt after it
+            spares = np.take_along_axis(order[:, num_unknown:],
+                                        np.argsort(~is_available[:, num_unknown:], axis=1, kind="stable"), axis=1)
+            spare_index = np.where(is_missing, np.cumsum(is_missing, axis=1) - 1, 0)
+            dealt = np.where(is_missing, np.take_along_axis(spares, spare_index, axis=1), dealt)
+            blocks.append(simulator.fill_block(dealt))
+        return blocks
+
+    def showdown_strengths(self, blocks):
+        '''
+        :param blocks: from deal_block()
+        :return: a tuple of the list of the showdown strengths of each variant, as BatchSimulator.showdown_strengths(),
+        and the number of different hands evaluated.
+        '''
+        # each player's hole cards, sorted, with the board of the trial, as a row of 2 keys: 9 x 6 and 4 x 6 bits
+        rows = []
+        for board, holes in blocks:
+            board_keys = (board << (6 * np.arange(9))).sum(axis=1)
+            hole_keys = (np.sort(holes, axis=2) << (6 * np.arange(NUM_HOLE_CARDS))).sum(axis=2)
+            rows.append(np.stack(np.broadcast_arrays(board_keys[:, np.newaxis], hole_keys), axis=-1).reshape(-1, 2))
+        rows = np.concatenate(rows)
+        unique_rows, inverse = np.unique(rows.view(np.dtype((np.void, 16))).ravel(), return_inverse=True)
+        unique_rows = unique_rows.view(np.int64).reshape(-1, 2)
+        shifts = 6 * np.arange(9)
+        unique_boards = (unique_rows[:, :1] >> shifts) & 63
+        unique_holes = (unique_rows[:, 1:] >> (6 * np.arange(NUM_HOLE_CARDS))) & 63
+        unique_strengths = self.simulators[0].line_strengths(unique_boards, unique_holes[:, np.newaxis, :],
+                                                             np.arange(len(BOARD_LINES)))[:, 0]
+        strengths = []
+        start = 0
+        for board, holes in blocks:
+            end = start + holes.shape[0] * holes.shape[1]
+            strengths.append(unique_strengths[inverse.ravel()[start:end]].reshape(holes.shape[:2]))
+            start = end
+        return strengths, len(unique_rows)
+
+    def run(self, num_trials, rng, block_size=None, stats=None):
+        '''
+        :param num_trials: the number of trials to run.
+        :param rng: a numpy random Generator
+        :param block_size: the number of trials sampled at once. Defaults to the global variable BATCH_BLOCK_SIZE.
+        :param stats: a SimulationStats object to time the phases in. None for no instrumentation.
+        :return: a PairedEstimate of the trials.
+        '''
+        if block_size is None:
+            block_size = BATCH_BLOCK_SIZE
+        estimate = self.empty_estimate()
+        trials_done = 0
+        while trials_done < num_trials:
+            block_trials = min(block_size, num_trials - trials_done)
+            if stats is not None:
+                start = time.perf_counter()
+            blocks = self.deal_block(block_trials, rng)
+            if stats is not None:
+                dealt = time.perf_counter()
+                stats.add_phase("deal", dealt - start)
+            strengths, num_hands = self.showdown_strengths(blocks)
+            if stats is not None:
+                evaluated = time.perf_counter()
+                stats.add_phase("evaluate", evaluated - dealt)
+                stats.num_hands_evaluated += num_hands * len(HOLE_CARD_PAIRS) * len(BOARD_LINES)
+            shares = np.zeros((block_trials,) + estimate.share_sums.shape)
+            for variant, variant_strengths in enumerate(strengths):
+                shares[:, variant, :self.num_players[variant]] = self.simulators[variant].shares_from_strengths(
+                    variant_strengths)
+            differences = shares - shares[:, :1, :]
+            estimate = estimate + PairedEstimate(block_trials, shares.sum(axis=0), (shares ** 2).sum(axis=0),
+                                                 differences.sum(axis=0), (differences ** 2).sum(axis=0),
+                                                 self.num_players)
+            if stats is not None:
+                stats.add_phase("showdown", time.perf_counter() - evaluated)
+                stats.num_trials += block_trials
+            trials_done += block_trials
+        return estimate
+
+
+def simulate_chunk(simulator, num_trials, seed_sequence, instrument=False):
+    """
+    Runs one chunk of simulate_in_chunks(), in a worker process.
+    :param instrument: boolean. True to time the phases of the chunk.
+    :return: a tuple of the Estimate of the chunk, from BatchSimulator.run(), and its SimulationStats, None if not
+    instrumented.
+    """
+    stats = SimulationStats() if instrument else None
+    return simulator.run(num_trials, np.random.default_rng(seed_sequence), stats=stats), stats
+
+
+def simulate_in_chunks(simulator, num_trials, seed=None, chunk_size=None, num_workers=1, stats=None):
+    """
+    Splits the trials of a BatchSimulator into chunks, and runs them in a pool of worker processes.
+    Each chunk has its own random number generator, spawned from the seed, so with a fixed seed the results depend on
+    the chunk size but not on the number of workers.
+    :param simulator: a BatchSimulator object, or a SharedDrawSimulator
+    :param num_trials: the total number of trials to run.
+    :param seed: seed of the random number generators, an int or a numpy SeedSequence. None for a random seed.
+    :param chunk_size: the number of trials in each chunk. Defaults to the global variable CHUNK_SIZE.
+    :param num_workers: the number of worker processes. 1 to run every chunk in this process, None for one process per
+    CPU.
+    :param stats: a SimulationStats object to add the stats of the chunks to. None for no instrumentation.
+    :return: an Estimate of all the trials, a PairedEstimate for a SharedDrawSimulator.
+    """
+    chunk_trials, seed_sequences = split_into_chunks(num_trials, seed, chunk_size)
+    instrument = repeat(stats is not None)
+    if num_workers == 1 or len(chunk_trials) == 1:
+        chunk_results = list(map(simulate_chunk, repeat(simulator), chunk_trials, seed_sequences, instrument))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunk_results = list(executor.map(simulate_chunk, repeat(simulator), chunk_trials, seed_sequences,
+                                              instrument))
+    return add_up_chunks(simulator, chunk_results, stats)
+
+
+def split_into_chunks(num_trials, seed=None, chunk_size=None):
+    """
+    :param num_trials, seed, chunk_size: as in simulate_in_chunks()
+    :return: a tuple of a list of the number of trials of each chunk of simulate_in_chunks(), and a list of the numpy
+    SeedSequence of each chunk.
+    """
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    chunk_trials = [min(chunk_size, num_trials - i) for i in range(0, num_trials, chunk_size)]
+    return chunk_trials, seed.spawn(len(chunk_trials))
+
+
+def add_up_chunks(simulator, chunk_results, stats=None):
+    """
+    :param simulator: the simulator of the chunks, as in simulate_in_chunks()
+    :param chunk_results: the tuples of simulate_chunk() of each chunk, in the order of the chunks.
+    :param stats: a SimulationStats object to add the stats of the chunks to. None for no instrumentation.
+    :return: the Estimate of all the trials of the chunks, as returned by simulate_in_chunks()
+    """
+    # added up in the order of the chunks, so that the rounding is the same too whatever the number of workers
+    estimate = None
+    for chunk_estimate, chunk_stats in chunk_results:
+        estimate = chunk_estimate if estimate is None else estimate + chunk_estimate
+        if stats is not None:
+            stats.merge(chunk_stats)
+    if estimate is None:
+        if isinstance(simulator, SharedDrawSimulator):
+            return simulator.empty_estimate()
+        return empty_estimate(len(simulator.hole_codes))
+    return estimate
+
+
+def simulate_stacked(simulators, num_trials, seed_sequences, chunk_size=None, block_size=None):
+    """
+    Runs the plain Monte Carlo trials of several questions together in this process: the blocks of the questions of
+    the same number of players and evaluator are stacked, and their hands evaluated in a single vectorized call. Each
+    question deals its trials with its own random number generators, chunks and blocks as simulate_in_chunks() and
+    BatchSimulator.run() would, so its results are the same as if it was simulated on its own.
+    :param simulators: a BatchSimulator for each question, without ranges nor variance reduction.
+    :param num_trials: a list of the number of trials of each question.
+    :param seed_sequences: a list of the numpy SeedSequence of each question.
+    :param chunk_size, block_size: as in simulate_in_chunks() and BatchSimulator.run()
+    :return: a list of the Estimate of each question.
+    """
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    if block_size is None:
+        block_size = BATCH_BLOCK_SIZE
+
+    def deal_blocks(simulator, question_trials, seed_sequence):
+        # the blocks of the question, in the order BatchSimulator.run() deals them in each chunk
+        chunk_trials = [min(chunk_size, question_trials - i) for i in range(0, question_trials, chunk_size)]
+        for chunk, (trials, chunk_seed) in enumerate(zip(chunk_trials, seed_sequence.spawn(len(chunk_trials)))):
+            rng = np.random.default_rng(chunk_seed)
+            for start in range(0, trials, block_size):
+                yield chunk, simulator.deal_block(min(block_size, trials - start), rng)
+
+    generators = [deal_blocks(*question) for question in zip(simulators, num_trials, seed_sequences)]
+    # the share sums of the chunks of each question, added up in the order of the chunks at the end
+    chunk_sums = [[] for simulator in simulators]
+    active = list(range(len(simulators)))
+    while len(active) > 0:
+        groups = {}
+        for index in active:
+            block = next(generators[index], None)
+            if block is not None:
+                simulator = simulators[index]
+                key = (len(simulator.hole_codes), simulator.evaluator)
+                groups.setdefault(key, []).append((index, block))
+        active = [index for blocks in groups.values() for index, block in blocks]
+        # stacks of at most block_size trials, so that the arrays stay as small as those of one block
+        stacks = []
+        for blocks in groups.values():
+            stacks.append([])
+            stack_trials = 0
+            for index, (chunk, (board, holes)) in blocks:
+                if stack_trials > 0 and stack_trials + len(board) > block_size:
+                    stacks.append([])
+                    stack_trials = 0
+                stacks[-1].append((index, (chunk, (board, holes))))
+                stack_trials += len(board)
+        for blocks in stacks:
+            boards = np.concatenate([board for index, (chunk, (board, holes)) in blocks])
+            holes = np.concatenate([holes for index, (chunk, (board, holes)) in blocks])
+            # every line, as the lines known differ from question to question
+            strengths = simulators[blocks[0][0]].line_strengths(boards, holes, np.arange(len(BOARD_LINES)))
+            start = 0
+            for index, (chunk, (board, block_holes)) in blocks:
+                shares = simulators[index].shares_from_strengths(strengths[start:start + len(board)])
+                start += len(board)
+                if len(chunk_sums[index]) == chunk:
+                    chunk_sums[index].append([0, np.zeros(shares.shape[1]), np.zeros(shares.shape[1])])
+                sums = chunk_sums[index][chunk]
+                sums[0] += len(shares)
+                sums[1] += shares.sum(axis=0)
+                sums[2] += (shares ** 2).sum(axis=0)
+    estimates = []
+    for simulator, sums in zip(simulators, chunk_sums):
+        estimate = None
+        for chunk_estimate in (Estimate(*chunk) for chunk in sums):
+            estimate = chunk_estimate if estimate is None else estimate + chunk_estimate
+        estimates.append(empty_estimate(len(simulator.hole_codes)) if estimate is None else estimate)
+    return estimates
+
+
+def canonical_question_key(hole_cards_input, board_input, dead_cards_input, variant=None):
+    """
+    Maps a question to a normal form, the same for all the questions that only differ by a relabelling of the suits
+    and/or a rotation or reflection of the board. Those keep the 8 lines of the board and the order the cards are dealt
+    in (corners, sides, center), so all these questions have the same equities.
+    The order of the players is kept, so that the equities of the normal form are those of the players as given.
+    :param hole_cards_input: a 2d array of strings, for the names of the hole cards of each player, * for unknown.
+    :param board_input: a 2d array of strings, for the names of the board cards in each row, * for unknown.
+    :param dead_cards_input: an array of strings, for the names of the dead cards.
+    :param variant: the GameVariant of the question, see get_variant()
+    :return: a string, the normal form, with the settings of the game variant too.
+    """
+    variant = get_variant(variant)
+    def to_codes(card_names):
+        return [-1 if card_name == "*" else card_name_to_code(card_name) for card_name in card_names]
+
+    board_codes = np.array(to_codes(np.ravel(board_input)))
+    hole_codes = [to_codes(player_hole_cards) for player_hole_cards in hole_cards_input]
+    dead_codes = to_codes(dead_cards_input)
+    best = None
+    for board_symmetry in BOARD_SYMMETRIES:
+        for suit_permutation in permutations(range(variant.num_suits)):
+            def relabel(codes):
+                return [-1 if code < 0 else (code & ~3) | suit_permutation[code & 3] for code in codes]
+
+            # the order of the hole cards of a player and of the dead cards does not matter, so they are sorted
+            candidate = (tuple(relabel(board_codes[board_symmetry])),
+                         tuple(tuple(sorted(relabel(codes))) for codes in hole_codes),
+                         tuple(sorted(relabel(dead_codes))))
+            if best is None or candidate < best:
+                best = candidate
+
+    def to_names(codes):
+        return "".join("*" if code < 0 else card_code_to_name(code) for code in codes)
+
+    return "{} | {} | {} | {}".format(variant.settings_name(), to_names(best[0]),
+                                      " ".join(to_names(codes) for codes in best[1]),
+                                      to_names(best[2]))
+
+
+class EquityCache:
+    """
+    An on-disk cache of the equities of questions, keyed by canonical_question_key(), in an sqlite database. For the
+    Monte Carlo results the Estimate is stored, so that later questions can top it up with more trials.
+    The least recently used entries are evicted once there are more than max_entries.
+    """
+
+    def __init__(self, path, max_entries=None):
+        '''
+        :param path: the path of the database file, created if it does not exist.
+        :param max_entries: the most questions kept. Defaults to the global variable EQUITY_CACHE_SIZE.
+        '''
+        self.path = path
+        self.max_entries = EQUITY_CACHE_SIZE if max_entries is None else max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS equities (key TEXT PRIMARY KEY, mode TEXT, num_trials "
+                                "INTEGER, share_sums TEXT, share_square_sums TEXT, last_used REAL)")
+        self.connection.commit()
+
+    def __repr__(self):
+        return "EquityCache at {}".format(self.path)
+
+    def get(self, key):
+        """
+        :return: a tuple of the mode ("exact" or "monte carlo") and the Estimate stored for the key, (None, None) if
+        there is none.
+        """
+        row = self.connection.execute("SELECT mode, num_trials, share_sums, share_square_sums FROM equities "
+                                      "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        self.connection.execute("UPDATE equities SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.connection.commit()
+        return row[0], Estimate(row[1], json.loads(row[2]), json.loads(row[3]))
+
+    def put(self, key, mode, estimate):
+        """
+        Stores the Estimate for the key, replacing what was there, then evicts the least recently used entries.
+        :param mode: "exact" or "monte carlo"
+        """
+        self.connection.execute("INSERT OR REPLACE INTO equities VALUES (?, ?, ?, ?, ?, ?)",
+                                (key, mode, estimate.num_trials, json.dumps(estimate.share_sums.tolist()),
+                                 json.dumps(estimate.share_square_sums.tolist()), time.time()))
+        self.connection.execute("DELETE FROM equities WHERE key IN (SELECT key FROM equities ORDER BY last_used DESC "
+                                "LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self.connection.commit()
+
+
+class PreflopTable:
+    """
+    The precomputed equities of every 4-card starting hand against 1 to PREFLOP_MAX_OPPONENTS random opponents, with the
+    whole board and no dead cards unknown, for the GameVariant of the file. The file is a .npy array,
+    PreflopTable.table, of shape (number of 4-card holdings, PREFLOP_MAX_OPPONENTS, 3): for each holding in the order
+    of holding_index(), and each number of opponents, the equity, its standard error and the number of trials, nan if
+    not computed yet. It is memory-mapped, so opening it reads nothing, and a lookup reads one row. Made by
+    build_preflop_table().
+    """
+
+    def __init__(self, path, variant=None):
+        '''
+        :param variant: the GameVariant of the table, see get_variant()
+        '''
+        self.path = path
+        self.variant = get_variant(variant)
+        self.table = np.load(path, mmap_mode="r")
+
+    def __repr__(self):
+        return "PreflopTable at {}".format(self.path)
+
+    def lookup(self, hole_codes, num_opponents):
+        """
+        :param hole_codes: the codes of the 4 hole cards of the player.
+        :return: a tuple of the equity of the player against num_opponents random opponents, its standard error and
+        the number of trials it was computed with. None if it was not computed.
+        """
+        if not 1 <= num_opponents <= self.table.shape[1]:
+            return None
+        equity, std_error, num_trials = self.table[holding_index(hole_codes, self.variant), num_opponents - 1]
+        if np.isnan(equity):
+            return None
+        return float(equity), float(std_error), int(num_trials)
+
+
+def holding_index(hole_codes, variant=None):
+    """
+    :param hole_codes: the codes of 4 cards of the deck of the game.
+    :param variant: the GameVariant of the game, see get_variant()
+    :return: the index of the holding among all the 4-card holdings of the deck, in the combinatorial number system,
+    so that every holding has an index from 0 to C(number of cards, 4) - 1 without any table.
+    """
+    variant = get_variant(variant)
+    lowest_rank = 15 - variant.num_ranks
+    card_indices = sorted(((code >> 2) - lowest_rank) * variant.num_suits + (code & 3) for code in hole_codes)
+    return sum(math.comb(card_index, i + 1) for i, card_index in enumerate(card_indices))
+
+
+def preflop_table_path(directory=None, variant=None):
+    """
+    :param directory: the directory of the tables. Defaults to the global variable PREFLOP_TABLE_DIR.
+    :param variant: the GameVariant of the game, see get_variant()
+    :return: the path of the PreflopTable file of the game variant.
+    """
+    if directory is None:
+        directory = PREFLOP_TABLE_DIR
+    variant = get_variant(variant)
+    wheel = "nowheel" if variant.wheel_ranks is None else "wheel" + "-".join(str(rank) for rank in variant.wheel_ranks)
+    return os.path.join(directory, "preflop_{}x{}_{}.npy".format(variant.num_ranks, variant.num_suits, wheel))
+
+
+def get_preflop_table(variant=None):
+    """
+    :param variant: the GameVariant of the game, see get_variant()
+    :return: the PreflopTable of the game variant, opened the first time it is asked for, None if there is no file for
+    it.
+    """
+    path = preflop_table_path(variant=variant)
+    if path not in PREFLOP_TABLES:
+        PREFLOP_TABLES[path] = PreflopTable(path, variant) if os.path.exists(path) else None
+    return PREFLOP_TABLES[path]
+
+
+def suit_classes(holdings, variant=None):
+    """
+    Groups 4-card holdings by relabelling of the suits, which does not change their preflop equities.
+    :param holdings: the codes of the holdings, in an array of shape (number of holdings, 4).
+    :param variant: the GameVariant of the game, see get_variant()
+    :return: for each holding, the holding_index() of the representative of its class, the smallest over the suit
+    relabellings.
+    """
+    variant = get_variant(variant)
+    lowest_rank = 15 - variant.num_ranks
+    binomials = np.array([[math.comb(n, k) for k in range(NUM_HOLE_CARDS + 1)]
+                          for n in range(variant.num_ranks * variant.num_suits)])
+    representatives = None
+    for suit_permutation in permutations(range(variant.num_suits)):
+        card_indices = np.sort(((holdings >> 2) - lowest_rank) * variant.num_suits +
+                               np.array(suit_permutation)[holdings & 3], axis=1)
+        indices = binomials[card_indices, np.arange(1, NUM_HOLE_CARDS + 1)].sum(axis=1)
+        representatives = indices if representatives is None else np.minimum(representatives, indices)
+    return representatives
+
+
+def preflop_equities(hole_codes, num_trials, seed_sequence, max_opponents, variant=None):
+    """
+    Simulates the equities of a starting hand against 1 to max_opponents random opponents, in a worker process of
+    build_preflop_table().
+    :return: an array of shape (max_opponents, 3) of rows of PreflopTable.table.
+    """
+    variant = get_variant(variant)
+    rows = np.empty((max_opponents, 3))
+    stub_codes = variant.new_deck().codes
+    stub_codes = stub_codes[~np.isin(stub_codes, hole_codes)]
+    for num_opponents, opponent_seed in zip(range(1, max_opponents + 1), seed_sequence.spawn(max_opponents)):
+        hole_codes_input = np.full((num_opponents + 1, NUM_HOLE_CARDS), -1)
+        hole_codes_input[0] = hole_codes
+        simulator = BatchSimulator(np.full(9, -1), hole_codes_input, stub_codes, num_ranks=variant.num_ranks,
+                                   wheel_ranks=variant.wheel_ranks)
+        estimate = simulator.run(num_trials, np.random.default_rng(opponent_seed))
+        rows[num_opponents - 1] = estimate.equities()[0], estimate.std_errors()[0], num_trials
+    return rows
+
+
+def build_preflop_table(num_trials, path=None, num_workers=1, seed=0, max_opponents=None, flush_interval=100,
+                        variant=None):
+    """
+    Computes the PreflopTable of a game variant, simulating one starting hand per suit class and copying its
+    equities to the whole class. The file is written as the hands are done, so an interrupted build resumes where it
+    stopped, skipping the hands already in the file.
+    :param num_trials: the number of trials for each starting hand and number of opponents.
+    :param path: the path of the file. Defaults to preflop_table_path().
+    :param num_workers: the number of worker processes. 1 to run everything in this process, None for one per CPU.
+    :param seed: the seed of the simulations, each starting hand having its own random number stream spawned from it.
+    :param max_opponents: defaults to the global variable PREFLOP_MAX_OPPONENTS.
+    :param flush_interval: the number of starting hands done between two writes of the file.
+    :param variant: the GameVariant of the game, see get_variant()
+    """
+    variant = get_variant(variant)
+    if path is None:
+        path = preflop_table_path(variant=variant)
+    if max_opponents is None:
+        max_opponents = PREFLOP_MAX_OPPONENTS
+    holdings = four_card_holdings(variant)
+    indices = np.array([holding_index(holding, variant) for holding in holdings])
+    representatives = suit_classes(holdings, variant)
+    if os.path.exists(path):
+        table = np.lib.format.open_memmap(path, mode="r+")
+        if table.shape != (len(holdings), max_opponents, 3):
+            raise Exception("Preflop table of another shape already at", path)
+    else:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                          shape=(len(holdings), max_opponents, 3))
+        table[:] = np.nan
+    class_indices = np.unique(representatives)
+    members = {class_index: indices[representatives == class_index] for class_index in class_indices}
+    todo = [class_index for class_index in class_indices if np.isnan(table[class_index]).any()]
+    print("{} starting hands in {} suit classes, {} to compute".format(len(holdings), len(class_indices), len(todo)))
+    if len(todo) == 0:
+        return
+    holding_by_index = dict(zip(indices, holdings))
+    arguments = ([holding_by_index[class_index] for class_index in todo], repeat(num_trials),
+                 [np.random.SeedSequence(seed, spawn_key=(int(class_index),)) for class_index in todo],
+                 repeat(max_opponents), repeat(variant))
+    if num_workers == 1:
+        results = map(preflop_equities, *arguments)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=warm_up_worker,
+                                                          initargs=([variant],))
+        results = executor.map(preflop_equities, *arguments)
+    try:
+        for i, (class_index, rows) in enumerate(zip(todo, results)):
+            table[members[class_index]] = rows
+            if (i + 1) % flush_interval == 0 or i + 1 == len(todo):
+                table.flush()
+                print("{} / {} done".format(i + 1, len(todo)))
+    finally:
+        table.flush()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+class Question:
+    """
+    An object representing an equity (winning probability) question by the user: If player A holds this and player B
+    holds that on this board, what is the equity of each of the players? Do this many trials in a Monte Carlo
+    simulation to find out.
+    Method Question.answer() prints and returns the results.
+    Two engines can run the simulation: "trial", the reference implementation running Trial objects one at a time, and
+    "batch", the much faster vectorized BatchSimulator.
+    When there are few enough ways to deal the unknown cards, every one of them is gone through instead, and the exact
+    equities are returned.
+    Instead of a number of trials, a target precision can be given, with the simulation stopping once the equities of
+    all players are that precise. Method Question.iter_estimates() yields the estimates along the way.
+    With an EquityCache, questions already answered are not simulated again, only topped up with more trials if needed.
+    """
+
+    def __init__(self, hole_cards_input, board_input, dead_cards_input, num_trials, engine="trial", seed=None,
+                 exact_threshold=None, num_workers=1, chunk_size=None, target_std_error=None, target_ci_width=None,
+                 progress_interval=None, cache=None, instrument=False, stats_hooks=(), verbose=True, ranges=None,
+                 use_preflop_table=True, variance_reduction=None, variant=None, street_report=False):
+        '''
+        :param num_trials: the number of trials to run. With a target precision, the most trials to run, None for no
+        limit.
+        :param engine: "trial" or "batch", the engine running the simulation.
+        :param seed: seed of the random number generators of the "batch" engine. None for a random seed.
+        :param num_workers: the number of processes the "batch" engine runs in. None for one process per CPU.
+        :param chunk_size: the number of trials the "batch" engine gives a worker process at a time. Defaults to the
+        global variable CHUNK_SIZE. With a fixed seed the results depend on it, but not on num_workers.
+        :param exact_threshold: the equities are computed exactly if the number of ways to deal the unknown cards is
+        at most this many, by Monte Carlo simulation otherwise. Defaults to the global variable EXACT_THRESHOLD. 0 to
+        always simulate.
+        :param target_std_error: stop once the standard error of every player's equity is at most this.
+        :param target_ci_width: stop once the 95% confidence interval of every player's equity is at most this wide.
+        :param progress_interval: the most trials between two estimates of Question.iter_estimates(). Defaults to the
+        global variable PROGRESS_INTERVAL.
+        :param cache: an EquityCache to look the answer up in, and to store it in. None for no cache.
+        :param instrument: boolean. True to collect the SimulationStats of the simulation in Question.stats.
+        :param stats_hooks: StatsHook objects to pass the stats on to, which turns instrument on.
+        :param verbose: boolean. False not to print the results in Question.answer(), only return them.
+        :param ranges: None, or a list with for each player a HandRange or its text for parse_range(), or None for the
+        players without a range. The hole cards of the players with a range should be all *. Ranges need the "batch"
+        engine and are always simulated, never answered exactly nor cached.
+        :param use_preflop_table: boolean. True to look preflop questions of one known hand against random opponents up
+        in the PreflopTable of the game, if there is one, see Question.preflop_lookup().
+        :param variance_reduction: None for plain Monte Carlo sampling, "center" to sum over every center card in each
+        trial, or "stratified" to stratify the trials by the rank of a corner card, see BatchSimulator. Both need the
+        "batch" engine, and the center or a corner card unknown.
+        :param variant: the GameVariant of the game, or the name of one of GAME_VARIANTS. None for the variant of the
+        global variables DECK_NUM_RANKS, DECK_NUM_SUITS and WHEEL_RANKS.
+        :param street_report: boolean. True to report the equities street by street from the same simulation too, see
+        Question.street_report(). It needs the center card unknown, and uses the "center" variance reduction, so the
+        question is always simulated. A trial is then a board with STREET_INNER_TRIALS hands of the undealt hole cards
+        on it, or all of them if there are at most STREET_EXACT_INNER_TRIALS.
+        '''
+        if engine not in ENGINES:
+            raise Exception("Unknown engine", engine)
+        self.variant = get_variant(variant)
+        self.evaluator = self.variant.evaluator()
+        self.ranges = None
+        if ranges is not None and any(hand_range is not None for hand_range in ranges):
+            if engine != "batch":
+                raise Exception("Ranges need the batch engine")
+            if cache is not None:
+                raise Exception("Questions with ranges cannot be cached")
+            self.ranges = [parse_range(hand_range, self.variant) if isinstance(hand_range, str) else hand_range
+                           for hand_range in ranges]
+            exact_threshold = -1
+        if street_report:
+            if variance_reduction not in (None, "center"):
+                raise Exception("The street report needs the center variance reduction")
+            variance_reduction = "center"
+            exact_threshold = -1
+            use_preflop_table = False
+        self.with_street_report = street_report
+        if variance_reduction is not None:
+            if engine != "batch":
+                raise Exception("Variance reduction needs the batch engine")
+            if cache is not None:
+                raise Exception("Questions with variance reduction cannot be cached")
+        self.variance_reduction = variance_reduction
+        self.deck = self.variant.new_deck()
+        self.players = np.empty(len(hole_cards_input), dtype=Player)
+        self.board = Board()
+        self.num_trials = num_trials
+        self.engine = engine
+        self.seed = seed
+        self.verbose = verbose
+        self.exact_threshold = EXACT_THRESHOLD if exact_threshold is None else exact_threshold
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        # a target confidence interval width is turned into a target standard error, whichever is the stricter
+        self.target_std_error = target_std_error
+        if target_ci_width is not None:
+            ci_std_error = target_ci_width / (2 * 1.96)
+            if self.target_std_error is None or ci_std_error < self.target_std_error:
+                self.target_std_error = ci_std_error
+        self.progress_interval = PROGRESS_INTERVAL if progress_interval is None else progress_interval
+        # None when not instrumented, so that the simulation loop only has to check that
+        self.stats = SimulationStats(stats_hooks) if instrument or len(stats_hooks) > 0 else None
+        self.cache = cache
+        # the Estimate of the simulation, once Question.answer() has run it
+        self.estimate = None
+        if cache is not None:
+            self.canonical_key = canonical_question_key(hole_cards_input, board_input, dead_cards_input,
+                                                        self.variant)
+        # create players and their hole cards
+        for i in range(len(hole_cards_input)):
+            self.players[i] = Player(player_num=i + 1)
+            for j in range(NUM_HOLE_CARDS):
+                if hole_cards_input[i, j] != "*":
+                    self.players[i].hole_cards[j] = self.deck.pick(hole_cards_input[i, j])
+                else:
+                    self.players[i].hole_cards[j] = None
+        # put the cards on the board
+        for i in range(3):
+            for j in range(3):
+                if board_input[i, j] != "*":
+                    self.board.board_cards[i, j] = self.deck.pick(board_input[i, j])
+        # take away the dead cards
+        for card_name in dead_cards_input:
+            self.deck.pick(card_name)
+        # evaluate once the lines that are the same in every trial
+        for player in self.players:
+            player.generate_fixed_lines(self.board, self.evaluator)
+        # the number of * in the board and hole cards, and the number of ways they can be dealt from the deck
+        self.num_unknown_cards = np.count_nonzero(board_input == "*") + np.count_nonzero(hole_cards_input == "*")
+        # built now, whether the question is answered exactly or not, to check the variance reduction applies and that
+        # the ranges fit together, then reused
+        self.simulator = BatchSimulator(*self.batch_simulator_codes(), num_ranks=self.variant.num_ranks,
+                                        wheel_ranks=self.variant.wheel_ranks, ranges=self.ranges,
+                                        variance_reduction=self.variance_reduction,
+                                        street_report=self.with_street_report)
+        self.num_completions = self.simulator.count_completions()
+        self.preflop_answer = self.preflop_lookup() if use_preflop_table else None
+        if self.target_std_error is None and num_trials is None and self.num_completions > self.exact_threshold and \
+                self.preflop_answer is None:
+            raise Exception("Either a number of trials or a target precision is needed")
+
+    def preflop_lookup(self):
+        """
+        Looks the question up in the PreflopTable of the game, if it is one player's known hand against random
+        opponents, with the whole board unknown and no dead cards, and the table is precise enough: its standard error
+        meets the target precision, or without one, it has at least the number of trials asked for.
+        :return: a tuple of the equities and standard errors of all the players, and the number of trials of the table.
+        None if the question is not in a table.
+        """
+        if self.ranges is not None or self.board.board_cards.any() or self.deck.size + NUM_HOLE_CARDS != \
+                self.variant.num_ranks * self.variant.num_suits:
+            return None
+        known = [player for player in self.players if all(card is not None for card in player.hole_cards)]
+        if len(known) != 1 or self.num_unknown_cards != 9 + NUM_HOLE_CARDS * (len(self.players) - 1):
+            return None
+        table = get_preflop_table(self.variant)
+        if table is None:
+            return None
+        entry = table.lookup([card.code() for card in known[0].hole_cards], len(self.players) - 1)
+        if entry is None:
+            return None
+        if self.target_std_error is not None:
+            if entry[1] > self.target_std_error:
+                return None
+        elif self.num_trials is not None and entry[2] < self.num_trials:
+            return None
+        equity, std_error, num_trials = entry
+        # the opponents all have the same equity
+        num_opponents = len(self.players) - 1
+        equities = np.full(len(self.players), (1 - equity) / num_opponents)
+        std_errors = np.full(len(self.players), std_error / num_opponents)
+        equities[known[0].player_num - 1] = equity
+        std_errors[known[0].player_num - 1] = std_error
+        return equities, std_errors, num_trials
+
+    def answer(self, progress_callback=None):
+        """
+        :param progress_callback: a function called with each Estimate of Question.iter_estimates() along the way. The
+        simulation is cancelled if it returns False.
+        :return: Simulation results in an array, each element is the equity of a player, between 0 and 1, ordered by the
+        player number. The index for each player is [Player.player_num - 1]
+        Question.mode records whether the equities are "exact", from a "monte carlo" simulation, or from the preflop
+        "table", and Question.estimate the Estimate of the simulation.
+        """
+        if self.stats is None:
+            return self.compute_answer(progress_callback)
+        start = time.perf_counter()
+        try:
+            return self.compute_answer(progress_callback)
+        finally:
+            self.stats.finish(time.perf_counter() - start)
+            if self.verbose:
+                print(self.stats.report() + "\n")
+
+    def compute_answer(self, progress_callback=None):
+        """
+        Question.answer(), without the timing of the whole.
+        """
+        if self.preflop_answer is not None:
+            self.mode = "table"
+            equities, std_errors, num_trials = self.preflop_answer
+            if self.verbose:
+                print("###########################")
+                print("Results from the preflop table, simulated with {} trials:\n".format(num_trials))
+                for i in range(len(equities)):
+                    print("    Player {}: {}% (standard error {:.3f}%)".format(i + 1, str(100 * equities[i]),
+                                                                           100 * std_errors[i]))
+                print("###########################\n\n")
+            return equities
+
+        cached_mode, cached_estimate = None, None
+        if self.cache is not None:
+            cached_mode, cached_estimate = self.cache.get(self.canonical_key)
+
+        if self.num_completions <= self.exact_threshold:
+            self.mode = "exact"
+            if cached_mode == "exact":
+                equities = cached_estimate.equities()
+            else:
+                equities = self.batch_simulator().run_exact(stats=self.stats)
+                if self.cache is not None:
+                    self.cache.put(self.canonical_key, self.mode,
+                                   Estimate(self.num_completions, equities * self.num_completions,
+                                            np.zeros(len(equities))))
+            if self.verbose:
+                print("###########################")
+                print("Exact results over all {} ways to deal the {} unknown cards{}:\n".format(
+                    self.num_completions, self.num_unknown_cards,
+                    " (from the cache)" if cached_mode == "exact" else ""))
+                for i in range(len(equities)):
+                    print("    Player {}: {}%".format(i + 1, str(100 * equities[i])))
+                print("###########################\n\n")
+            return equities
+
+        self.mode = "monte carlo"
+        # a cached estimate is topped up with more trials, if it is not precise enough already
+        if cached_mode == "monte carlo":
+            self.estimate = cached_estimate
+        else:
+            self.estimate = empty_estimate(len(self.players))
+        num_cached_trials = self.estimate.num_trials
+        if self.target_std_error is None and progress_callback is None:
+            if num_cached_trials < self.num_trials:
+                self.estimate = self.estimate + self.simulate(self.num_trials - num_cached_trials,
+                                                              self.seed_sequence(num_cached_trials))
+        else:
+            for estimate in self.iter_estimates(self.estimate):
+                self.estimate = estimate
+                if progress_callback is not None and progress_callback(estimate) is False:
+                    break
+        if self.cache is not None and self.estimate.num_trials > num_cached_trials:
+            self.cache.put(self.canonical_key, self.mode, self.estimate)
+
+        equities = self.estimate.equities()
+        if self.verbose:
+            lower, upper = self.estimate.confidence_intervals()
+            print("###########################")
+            print("Monte Carlo results after {} trials{}:\n".format(
+                self.estimate.num_trials,
+                ", {} of them from the cache".format(num_cached_trials) if num_cached_trials else ""))
+            for i in range(len(equities)):
+                print("    Player {}: {}% (95% CI {:.3f}% - {:.3f}%)".format(i + 1, str(100 * equities[i]),
+                                                                           100 * lower[i], 100 * upper[i]))
+            if self.variance_reduction is not None or self.ranges is not None:
+                print("\n    Effective sample size: {:.0f} plain trials".format(self.estimate.effective_sample_size()))
+            if self.with_street_report:
+                self.print_street_report()
+            for i, hand_range in enumerate(self.ranges or []):
+                if hand_range is None:
+                    continue
+                print("\n    Player {} range {}, most held:".format(i + 1, hand_range.description))
+                for holding, frequency, equity in self.range_breakdown(i + 1)[:RANGE_REPORT_SIZE]:
+                    print("        {} held {:.3f}% of the time, equity {:.3f}%".format(holding, 100 * frequency,
+                                                                                     100 * equity))
+            print("###########################\n\n")
+        return equities
+
+    def is_plain_simulation(self):
+        """
+        :return: boolean. True if Question.answer() would run plain Monte Carlo trials with the "batch" engine, a fixed
+        number of them and nothing else, see simulate_stacked().
+        """
+        return self.engine == "batch" and self.ranges is None and self.variance_reduction is None and \
+            self.preflop_answer is None and self.cache is None and self.stats is None and \
+            self.num_completions > self.exact_threshold and self.target_std_error is None and \
+            self.num_trials is not None
+
+    def street_report(self):
+        """
+        The equities street by street, from the StreetEstimate of the simulation: how each player's equity on the turn
+        is spread over the boards dealt, its equity with each center card, and its outs, the center cards giving it a
+        higher equity than it has now, best first. The equity on the turn of each board is estimated with
+        STREET_INNER_TRIALS hands of the undealt hole cards, or exactly if there are few ways to deal them, see
+        BatchSimulator.run_center(); once the turn is dealt, it is the equity of the question. The noise of the
+        estimates spreads the distribution over neighbouring bins, by about their standard errors, also reported.
+        :return: a dict of "equities", "turn" with the "bin_edges" of the equities, the "frequencies" of each player in
+        each bin and the "board_std_errors" of each player, StreetEstimate.turn_std_errors(), "river" with the names of
+        the "center_cards" and the "equities" of each player with each of them, and "outs" with for each player the
+        "num_outs" and the "best" outs, at most OUTS_REPORT_SIZE pairs of the card name and the equity.
+        """
+        if not self.with_street_report:
+            raise ValueError("The question was not asked for a street report")
+        if self.estimate is None:
+            raise ValueError("The question has not been answered yet")
+        equities = self.estimate.equities()
+        turn_frequencies = self.estimate.turn_frequencies()
+        board_std_errors = self.estimate.turn_std_errors()
+        if sum(card is None for card in self.board.board_cards.ravel()) == 1:
+            # only the center is left to deal, so every board has the same turn equity
+            board_std_errors = np.zeros_like(board_std_errors)
+            turn_frequencies = np.zeros_like(turn_frequencies)
+            bins = np.minimum((equities * STREET_HISTOGRAM_BINS).astype(np.int64), STREET_HISTOGRAM_BINS - 1)
+            turn_frequencies[np.arange(len(equities)), bins] = 1.0
+        possible = self.estimate.center_counts > 0
+        center_names = [card_code_to_name(code) for code in self.estimate.center_codes[possible]]
+        center_equities = self.estimate.center_equities()[possible]
+        outs = []
+        for player in range(len(self.players)):
+            improving = np.flatnonzero(center_equities[:, player] > equities[player])
+            improving = improving[np.argsort(-center_equities[improving, player], kind="stable")]
+            outs.append({"num_outs": len(improving),
+                         "best": [(center_names[i], center_equities[i, player])
+                                  for i in improving[:OUTS_REPORT_SIZE]]})
+        return {
+            "equities": equities.tolist(),
+            "turn": {"bin_edges": np.linspace(0, 1, STREET_HISTOGRAM_BINS + 1).tolist(),
+                     "frequencies": turn_frequencies.tolist(),
+                     "board_std_errors": board_std_errors.tolist()},
+            "river": {"center_cards": center_names, "equities": center_equities.tolist()},
+            "outs": outs,
+        }
+
+    def print_street_report(self):
+        """Prints Question.street_report(), a line per player."""
+        report = self.street_report()
+        edges = report["turn"]["bin_edges"]
+        print("\n    Equity distribution on the turn:")
+        print("              " + " ".join("{:>7}".format("{:.0f}-{:.0f}%".format(100 * low, 100 * high))
+                                              for low, high in zip(edges[:-1], edges[1:])))
+        for i, frequencies in enumerate(report["turn"]["frequencies"]):
+            print("    Player {:2}: ".format(i + 1) + " ".join("{:6.1f}%".format(100 * f) for f in frequencies) +
+                  "   (standard error of a board {:.1f}%)".format(100 * report["turn"]["board_std_errors"][i]))
+        print("\n    River outs, the center cards giving a higher equity:")
+        for i, player_outs in enumerate(report["outs"]):
+            print("    Player {:2}: {} out(s){}".format(i + 1, player_outs["num_outs"], "".join(
+                ", {} {:.3f}%".format(name, 100 * equity) for name, equity in player_outs["best"])))
+
+    def range_breakdown(self, player_num):
+        """
+        :param player_num: the Player.player_num of a player with a range.
+        :return: a list of the holdings of the player's range held in the simulation, as tuples of the holding name,
+        how often it was held as a fraction, and the player's equity with it. Most held first.
+        """
+        hand_range = self.ranges[player_num - 1]
+        frequencies, equities = self.estimate.holding_equities(player_num - 1)
+        held = np.flatnonzero(frequencies > 0)
+        held = held[np.argsort(-frequencies[held], kind="stable")]
+        return [(hand_range.holding_name(index), frequencies[index], equities[index]) for index in held]
+
+    def iter_estimates(self, initial_estimate=None):
+        """
+        Runs the Monte Carlo simulation in steps of Question.next_step_trials(), at most progress_interval trials,
+        yielding the Estimate of all the trials so far after each step. Stops once every player's equity has reached the
+        target standard error, or num_trials trials are done. Closing the generator cancels the simulation.
+        With the "batch" engine and several workers, the chunks of the next steps are run by one pool of worker
+        processes while the earlier steps are checked, so that every worker is kept busy even with steps smaller than a
+        chunk. The steps are the same as in one process, and so are the results with a fixed seed. The chunks started
+        beyond the last step needed are cancelled.
+        :param initial_estimate: an Estimate of trials already done, e.g. from the cache, to add the new trials to.
+        """
+        estimate = empty_estimate(len(self.players)) if initial_estimate is None else initial_estimate
+        seed_sequence = self.seed_sequence(estimate.num_trials)
+        if self.engine != "batch" or self.num_workers == 1:
+            while not self.is_precise_enough(estimate):
+                estimate = estimate + self.simulate(self.next_step_trials(estimate.num_trials),
+                                                    seed_sequence.spawn(1)[0])
+                yield estimate
+            return
+        simulator = self.batch_simulator()
+        num_workers = self.num_workers or os.cpu_count()
+        # the futures of the chunks of each step started, in the order of the steps
+        steps = collections.deque()
+        num_trials_started = estimate.num_trials
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+        try:
+            while not self.is_precise_enough(estimate):
+                while sum(len(step) for step in steps) < num_workers and \
+                        (self.num_trials is None or num_trials_started < self.num_trials):
+                    step_trials = self.next_step_trials(num_trials_started)
+                    chunk_trials, seed_sequences = split_into_chunks(step_trials, seed_sequence.spawn(1)[0],
+                                                                     self.chunk_size)
+                    steps.append([executor.submit(simulate_chunk, simulator, trials, chunk_seed, self.stats is not None)
+                                  for trials, chunk_seed in zip(chunk_trials, seed_sequences)])
+                    num_trials_started += step_trials
+                step = steps.popleft()
+                estimate = estimate + add_up_chunks(simulator, [future.result() for future in step], self.stats)
+                yield estimate
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def next_step_trials(self, num_trials_done):
+        """
+        :return: the number of trials of the step of Question.iter_estimates() after num_trials_done trials. With a
+        target precision, the steps start at MIN_TARGET_TRIALS and double up to progress_interval, so that a loose
+        target stops after few trials. They only depend on num_trials_done, for the same steps in every process.
+        """
+        step_trials = self.progress_interval
+        if self.target_std_error is not None:
+            step_trials = min(step_trials, max(MIN_TARGET_TRIALS, num_trials_done))
+        if self.num_trials is None:
+            return step_trials
+        return min(step_trials, self.num_trials - num_trials_done)
+
+    def is_precise_enough(self, estimate):
+        """
+        :return: boolean. True if the Estimate has num_trials trials, or meets the target standard error.
+        """
+        if self.num_trials is not None and estimate.num_trials >= self.num_trials:
+            return True
+        # a few trials are needed before the standard errors themselves can be trusted
+        return self.target_std_error is not None and estimate.num_trials >= MIN_TARGET_TRIALS and \
+            bool(np.all(estimate.std_errors() <= self.target_std_error))
+
+    def seed_sequence(self, num_trials_done):
+        """
+        :param num_trials_done: the number of trials already done, e.g. from the cache. The trials topping them up use
+        another random number stream than those, even with a fixed seed.
+        :return: a numpy SeedSequence for the random number generators of the "batch" engine.
+        """
+        if num_trials_done == 0:
+            return np.random.SeedSequence(self.seed)
+        return np.random.SeedSequence(self.seed, spawn_key=(num_trials_done,))
+
+    def simulate(self, num_trials, seed):
+        """
+        Runs num_trials trials of the Monte Carlo simulation with the engine of the question.
+        :param seed: seed of the random number generators of the "batch" engine, an int or a numpy SeedSequence.
+        :return: an Estimate of the trials.
+        """
+        if self.engine == "batch":
+            return simulate_in_chunks(self.batch_simulator(), num_trials, seed=seed, chunk_size=self.chunk_size,
+                                      num_workers=self.num_workers, stats=self.stats)
+        share_sums = np.zeros(len(self.players), dtype=float)
+        share_square_sums = np.zeros(len(self.players), dtype=float)
+        for i in range(num_trials):
+            trial_winners = Trial(players=self.players, board=self.board, deck=self.deck, stats=self.stats,
+                                  evaluator=self.evaluator).run()
+            for player in trial_winners:
+                # if there are 2 winners in a hand, each of them have 50% equity, thus the 1 / len(trial_winners)
+                # index - 1 because our player_nums start from 1, python counts start from 0
+                share_sums[player.player_num - 1] += 1 / len(trial_winners)
+                share_square_sums[player.player_num - 1] += (1 / len(trial_winners)) ** 2
+        return Estimate(num_trials, share_sums, share_square_sums)
+
+    def batch_simulator_codes(self):
+        """
+        :return: a tuple of the board codes, the hole card codes and the codes of the cards left in the deck, as
+        BatchSimulator takes them.
+        """
+        board_codes = [-1 if card is None else card.code() for card in self.board.board_cards.ravel()]
+        hole_codes = [[-1 if card is None else card.code() for card in player.hole_cards] for player in self.players]
+        return board_codes, hole_codes, self.deck.remaining_codes()
+
+    def batch_simulator(self):
+        """
+        :return: the BatchSimulator of this question, with the cards as integer codes, its ranges and variance
+        reduction. It is built once, by Question.__init__(), kept as Question.simulator, and reused by every simulation
+        of the question.
+        """
+        return self.simulator
+
+
+class MultiQuestion:
+    """
+    Several variants of a question, e.g. with other hole cards, another dead card or more players, simulated together
+    on common random numbers by a SharedDrawSimulator. Method MultiQuestion.answer() prints and returns the equities of
+    each variant, and the differences of each variant with the first one, with their standard errors.
+    """
+
+    def __init__(self, questions, num_trials, seed=None, num_workers=1, chunk_size=None, verbose=True):
+        '''
+        :param questions: a Question object for each variant, the first one being the one the others are compared to.
+        Their own number of trials and settings are not used.
+        :param num_trials, seed, num_workers, chunk_size: as in Question, for the "batch" engine.
+        :param verbose: boolean. False not to print the results in MultiQuestion.answer(), only return them.
+        '''
+        if len(questions) < 2:
+            raise Exception("At least 2 variants are needed")
+        for question in questions:
+            if question.variant.settings_name() != questions[0].variant.settings_name():
+                raise Exception("The questions should all be of the same game variant", question.variant)
+        self.questions = questions
+        self.num_trials = num_trials
+        self.seed = seed
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+
+    def __repr__(self):
+        return "MultiQuestion of {} variants".format(len(self.questions))
+
+    def answer(self):
+        """
+        :return: a list of the equities of each variant, as returned by Question.answer(). MultiQuestion.estimate
+        records the PairedEstimate of the simulation, with the differences between the variants.
+        """
+        simulator = SharedDrawSimulator([question.batch_simulator() for question in self.questions],
+                                        self.questions[0].variant)
+        self.estimate = simulate_in_chunks(simulator, self.num_trials, seed=self.seed, chunk_size=self.chunk_size,
+                                           num_workers=self.num_workers)
+        equities = [self.estimate.variant_estimate(variant).equities() for variant in range(len(self.questions))]
+        if self.verbose:
+            print("###########################")
+            print("Monte Carlo results of {} variants on the same {} trials:".format(len(self.questions),
+                                                                                     self.num_trials))
+            for variant in range(len(self.questions)):
+                estimate = self.estimate.variant_estimate(variant)
+                lower, upper = estimate.confidence_intervals()
+                print("\n    Variant {}:".format(variant + 1))
+                for i in range(len(equities[variant])):
+                    print("        Player {}: {}% (95% CI {:.3f}% - {:.3f}%)".format(
+                        i + 1, str(100 * equities[variant][i]), 100 * lower[i], 100 * upper[i]))
+                if variant == 0:
+                    continue
+                # the standard error the difference would have with independent simulations, for comparison
+                first_std_errors = self.estimate.variant_estimate(0).std_errors()
+                differences, std_errors = self.estimate.differences(variant)
+                for i in range(len(differences)):
+                    independent = math.sqrt(estimate.std_errors()[i] ** 2 + first_std_errors[i] ** 2)
+                    print("        Player {} vs variant 1: {:+.3f}% (standard error {:.3f}%, {:.3f}% if "
+                          "independent)".format(i + 1, 100 * differences[i], 100 * std_errors[i], 100 * independent))
+            print("###########################\n\n")
+        return equities
+
+
+class Trial:
+    """
+    A single trial of the Monte Carlo simulation. Method Trial.run() returns the result.
+    """
+
+    def __init__(self, players, board, deck, stats=None, evaluator=None):
+        '''
+        :param stats: a SimulationStats object to time the phases of the trial in. None for no instrumentation.
+        :param evaluator: the HandEvaluator of the game, get_evaluator() by default.
+        '''
+        self.stats = stats
+        self.evaluator = get_evaluator() if evaluator is None else evaluator
+        if stats is not None:
+            start = time.perf_counter()
+        # deepcopy the players and board from the arguments so that the changes done in this trial would not affect
+        # other trials. The Card objects are shared, not copied. The deck is not copied, but reset at the end of the run
+        self.players = copy.deepcopy(players)
+        self.board = copy.deepcopy(board)
+        self.deck = deck
+        self.deck_size = deck.size
+        if stats is not None:
+            stats.add_phase("copy", time.perf_counter() - start)
+
+    def run(self):
+        """
+        :return: An array of Player objects who have won in this trial.
+        """
+        try:
+            return self.deal_and_showdown()
+        finally:
+            # put the cards dealt in this trial back into the deck for the next trials
+            self.deck.reset(self.deck_size)
+
+    def deal_and_showdown(self):
+        """
+        :return: An array of Player objects who have won in this trial.
+        """
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        # deal the (remainder of) the board
+        for i in range(3):
+            for j in range(3):
+                if self.board.board_cards[i, j] is None:
+                    self.board.board_cards[i, j] = self.deck.deal()
+        self.board.generate_board_combos(self.evaluator)
+
+        # deal to players, if they have None in their hole_cards
+        for player in self.players:
+            for i in range(len(player.hole_cards)):
+                if player.hole_cards[i] is None:
+                    player.hole_cards[i] = self.deck.deal()
+        if stats is not None:
+            now = time.perf_counter()
+            stats.add_phase("deal", now - start)
+            start = now
+
+        for player in self.players:
+            player.generate_hole_cards_combos(self.evaluator)
+        if stats is not None:
+            now = time.perf_counter()
+            stats.add_phase("hole_cards_combos", now - start, len(self.players))
+            start = now
+
+        for player in self.players:
+            player.generate_showdown_hand(self.board, self.evaluator)
+        if stats is not None:
+            now = time.perf_counter()
+            stats.add_phase("evaluate", now - start, len(self.players))
+            start = now
+            stats.num_hands_evaluated += sum(len(player.hole_cards_combos) * (8 - len(player.fixed_lines))
+                                             for player in self.players)
+
+        # showdown
+        winning_players = np.array([self.players[0]])
+        for player in self.players[1:]:
+            if player.showdown_strength > winning_players[0].showdown_strength:
+                winning_players = np.array([player])
+            # in case of a tie
+            elif player.showdown_strength == winning_players[0].showdown_strength:
+                winning_players = np.append(winning_players, player)
+        if stats is not None:
+            stats.add_phase("showdown", time.perf_counter() - start)
+            stats.num_trials += 1
+        return winning_players
+
+
+def parse_question_input(question_input):
+    """
+    Checks a question given as a dict, as in a line of the input of run_batch(), and turns it into the inputs of
+    Question. Raises an Exception if it is not valid.
+    :param question_input: a dict with
+                               "hole_cards": a list of the hole card names of each player, * for unknown.
+                               "board": a list of the 3 rows of 3 board card names, * for unknown.
+                               "dead_cards": optional, a list of dead card names.
+    :return: a tuple of hole_cards_input, board_input and dead_cards_input, as returned by prompt_user()
+    """
+    # checked as given, before the names are cut to 2 characters
+    hole_cards_input = np.array(question_input["hole_cards"], dtype=object)
+    board_input = np.array(question_input["board"], dtype=object)
+    dead_cards_input = np.array(question_input.get("dead_cards", []), dtype=object)
+    if hole_cards_input.ndim != 2 or hole_cards_input.shape[1] != NUM_HOLE_CARDS or \
+            not 2 <= len(hole_cards_input) <= 10:
+        raise Exception("hole_cards should be {} cards for each of 2 to 10 players".format(NUM_HOLE_CARDS))
+    if board_input.shape != (3, 3):
+        raise Exception("board should be 3 rows of 3 cards")
+    if dead_cards_input.ndim != 1:
+        raise Exception("dead_cards should be a list of cards")
+    check_question_settings(question_input)
+    previous_cards = set()
+    for card_name in np.concatenate((hole_cards_input.ravel(), board_input.ravel(), dead_cards_input)):
+        if not isinstance(card_name, str):
+            raise Exception("Card not recognized", card_name)
+        if card_name == "*":
+            continue
+        if len(card_name) != 2 or card_name[0] not in RANK_NAMES.values() or card_name[1] not in SUIT_NAMES.values():
+            raise Exception("Card not recognized", card_name)
+        if card_name in previous_cards:
+            raise Exception("Card appearing more than once", card_name)
+        previous_cards.add(card_name)
+    return hole_cards_input.astype("<U2"), board_input.astype("<U2"), dead_cards_input.astype("<U2")
+
+
+def check_question_settings(question_input):
+    """
+    Raises an Exception if a numeric setting of a question given as a dict, as in answer_question(), is given but is not
+    valid: num_trials should be a positive integer, seed and exact_threshold non-negative integers, and
+    target_std_error and target_ci_width positive numbers.
+    """
+    for name in ("num_trials", "seed", "exact_threshold", "target_std_error", "target_ci_width"):
+        value = question_input.get(name)
+        if value is None:
+            continue
+        if name in ("num_trials", "seed", "exact_threshold"):
+            positive = name == "num_trials"
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0 or (positive and value == 0):
+                raise Exception("{} should be a {} integer, not {}".format(
+                    name, "positive" if positive else "non-negative", json.dumps(value)))
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < math.inf:
+            raise Exception("{} should be a positive number, not {}".format(name, json.dumps(value)))
+
+
+def answer_question(question_input, question=None):
+    """
+    The non-interactive way to ask a question.
+    :param question_input: a dict of the question, as in parse_question_input(), with too, all optional:
+                               "id": anything, returned as is.
+                               "num_trials": the number of trials, or with a target precision the most trials.
+                               "target_std_error", "target_ci_width", "seed", "engine", "exact_threshold",
+                               "ranges", "variance_reduction": as in Question, the ranges as texts. The engine
+                               defaults to "batch".
+                               "variant": the name of one of GAME_VARIANTS, the global variables by default.
+                               "street_report": true for the Question.street_report() of the simulation too.
+    :param question: the Question of the input, if question_from_input() already made it.
+    :return: a dict of the results, with "id", "mode", "num_trials", "equities" and for the Monte Carlo results
+    "std_errors" and "effective_sample_size", "streets" for a street report, and for the questions with ranges
+    "range_breakdowns", for each player the Question.range_breakdown() of its range or None. If the question could not
+    be answered, "error" instead.
+    """
+    result = {"id": question_input.get("id")}
+    try:
+        if question is None:
+            question = question_from_input(question_input)
+        equities = question.answer()
+    except Exception as e:
+        result["error"] = " ".join(str(arg) for arg in e.args)
+        return result
+    return question_result(question, equities, result)
+
+
+def question_from_input(question_input):
+    """
+    :param question_input: a dict of the question, as in answer_question()
+    :return: the Question object, not printing its results.
+    """
+    hole_cards_input, board_input, dead_cards_input = parse_question_input(question_input)
+    return Question(hole_cards_input, board_input, dead_cards_input, question_input.get("num_trials"),
+                    engine=question_input.get("engine", "batch"), seed=question_input.get("seed"),
+                    exact_threshold=question_input.get("exact_threshold"),
+                    target_std_error=question_input.get("target_std_error"),
+                    target_ci_width=question_input.get("target_ci_width"), verbose=False,
+                    ranges=question_input.get("ranges"), variance_reduction=question_input.get("variance_reduction"),
+                    variant=question_input.get("variant"), street_report=bool(question_input.get("street_report")))
+
+
+def question_result(question, equities, result):
+    """
+    Adds the results of an answered question to the result dict of answer_question(), and returns it.
+    """
+    result["mode"] = question.mode
+    result["equities"] = equities.tolist()
+    if question.mode == "exact":
+        result["num_trials"] = question.num_completions
+    elif question.mode == "table":
+        result["num_trials"] = question.preflop_answer[2]
+        result["std_errors"] = finite_or_none(question.preflop_answer[1])
+    else:
+        result["num_trials"] = question.estimate.num_trials
+        result["std_errors"] = finite_or_none(question.estimate.std_errors())
+        result["effective_sample_size"] = question.estimate.effective_sample_size()
+        if question.with_street_report:
+            result["streets"] = question.street_report()
+        if question.ranges is not None:
+            result["range_breakdowns"] = [None if hand_range is None else question.range_breakdown(i + 1)
+                                          for i, hand_range in enumerate(question.ranges)]
+    return result
+
+
+def finite_or_none(values):
+    """
+    :return: the list of the values, with None, null in JSON, for those not finite, e.g. the standard errors of too few
+    trials to estimate them.
+    """
+    return [float(value) if math.isfinite(value) else None for value in values]
+
+
+def answer_questions(question_inputs):
+    """
+    Answers several questions at once, e.g. small ones gathered by a service. The questions only simulated by plain
+    Monte Carlo sampling of a fixed number of trials are simulated together by simulate_stacked(), with the same
+    results as one by one; the others are answered by answer_question().
+    :param question_inputs: a list of dicts of questions, as in answer_question()
+    :return: the list of the results of answer_question(), in the order of the questions.
+    """
+    results = [None] * len(question_inputs)
+    stacked = []
+    for i, question_input in enumerate(question_inputs):
+        try:
+            question = question_from_input(question_input)
+        except Exception as e:
+            results[i] = {"id": question_input.get("id"), "error": " ".join(str(arg) for arg in e.args)}
+            continue
+        if question.is_plain_simulation():
+            stacked.append((i, question))
+        else:
+            results[i] = answer_question(question_input, question)
+    estimates = simulate_stacked([question.batch_simulator() for i, question in stacked],
+                                 [question.num_trials for i, question in stacked],
+                                 [question.seed_sequence(0) for i, question in stacked])
+    for (i, question), estimate in zip(stacked, estimates):
+        question.mode = "monte carlo"
+        question.estimate = estimate
+        results[i] = question_result(question, estimate.equities(), {"id": question_inputs[i].get("id")})
+    return results
+
+
+def answer_question_line(line):
+    """
+    Answers a question given as a line of JSON, in a worker process of run_batch().
+    :return: the result of answer_question(), as a line of JSON.
+    """
+    try:
+        question_input = json.loads(line)
+    except ValueError as e:
+        return json.dumps({"id": None, "error": "Invalid JSON: {}".format(e)})
+    if not isinstance(question_input, dict):
+        return json.dumps({"id": None, "error": "The question should be a JSON object"})
+    result = answer_question(question_input)
+    try:
+        # strict JSON, without the NaN and Infinity of Python
+        return json.dumps(result, allow_nan=False)
+    except ValueError:
+        return json.dumps({"id": result.get("id"), "error": "The results are not finite numbers"})
+
+
+def warm_up_worker(variants=None):
+    """
+    Builds, or loads from the on-disk cache, the evaluator tables, with the center_tables() too, and the deck of game
+    variants once when a worker process of run_batch() or of the service starts, so that no question pays for them.
+    :param variants: a list of GameVariant objects. Defaults to the variant of the global variables and all those of
+    GAME_VARIANTS.
+    """
+    if variants is None:
+        variants = [get_variant()] + list(GAME_VARIANTS.values())
+    for variant in variants:
+        variant.evaluator().center_tables()
+        variant.new_deck()
+
+
+def run_batch(input_file, output_file, num_workers=1):
+    """
+    Answers the questions of a JSONL file, one question per line as in answer_question(), writing one line of results
+    per question to the output file as soon as it is answered, so not necessarily in the order of the input. The
+    questions are answered concurrently by a pool of worker processes, which keep their evaluator tables and decks
+    across the whole batch.
+    :param input_file: a file object to read the questions from.
+    :param output_file: a file object to write the results to.
+    :param num_workers: the number of worker processes. 1 to answer every question in this process, None for one process
+    per CPU.
+    """
+    lines = (line for line in input_file if line.strip())
+    if num_workers == 1:
+        warm_up_worker()
+        for line in lines:
+            output_file.write(answer_question_line(line) + "\n")
+            output_file.flush()
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=warm_up_worker) as executor:
+        max_pending = 2 * (num_workers or os.cpu_count())
+        pending = set()
+        for line in lines:
+            pending.add(executor.submit(answer_question_line, line))
+            # not reading the whole input at once, in case it is a stream
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    output_file.write(future.result() + "\n")
+                output_file.flush()
+        for future in concurrent.futures.as_completed(pending):
+            output_file.write(future.result() + "\n")
+            output_file.flush()
+
+
+def card_input_validate(card_names, previous_cards, num_cards_required=None):
+    """
+    To validate user input of cards, preventing wrong number of cards, cards not recognized in our notation, and
+    duplicated cards.
+    Called by prompt_user()
+    :param card_names: an array of strings, for the card names.
+    :param previous_cards: a set of strings, for the card names previously entered, to check for duplicates.
+    :param num_cards_required: the correct number of cards in card_names.
+    :return: boolean. True if the input is OK
+    """
+    if num_cards_required is not None and len(card_names) != num_cards_required:
+        print("Wrong number of cards.")
+        return False
+    for card_name in card_names:
+        if card_name == "*":
+            pass
+        elif len(card_name) == 2 and card_name[0] in RANK_NAMES.values() and card_name[1] in SUIT_NAMES.values():
+            pass
+        else:
+            print(card_name, " not recognized.")
+            return False
+        if card_name in previous_cards and card_name != "*":
+            print(card_name + " appearing more than once.")
+            return False
+        previous_cards.update(card_name)
+    return True
+
+
+def prompt_user():
+    """
+    Prompts the user for inputs.
+    :return: A tuple containing:
+                 hole_cards_input: an array of strings for the names of the hole cards.
+                 board_input: a 2d array of strings, for the names of the board cards in each row.
+                 dead_cards_input: an array of strings, for the names of dead cards, if any.
+                 num_trials: the number of Monte Carlo trials to run.
+    """
+    while True:
+        try:
+            num_players = int(input("Number of players (2-10)? "))
+        except:
+            print("Not a valid number")
+        else:
+            if num_players > 1 and num_players < 11:
+                break
+            else:
+                print("Not a valid number")
+
+    # previous_cards to record all card names entered for card_input_validate() to check for duplicates
+    previous_cards = set()
+    hole_cards_input = np.empty([num_players, NUM_HOLE_CARDS], dtype="<U2")
+    print("\nFormat e.g.: 'As' for ace of spades, '5c' for 5 of clubs, 'Th' for 10(ten) of hearts. Without the quotes.")
+    print("Use * for an unknown or undealt card.")
+    print("Separate each card with a comma.\n")
+    for i in range(num_players):
+        while True:
+            card_names = np.array(input("Player {} hole cards: \n".format(str(i + 1))).replace(" ", "").split(","))
+            if card_input_validate(card_names, previous_cards, NUM_HOLE_CARDS):
+                previous_cards.update(set(card_names))
+                hole_cards_input[i] = card_names
+                break
+
+    board_input = np.empty([3, 3], dtype="<U2")
+    for i in range(3):
+        while True:
+            card_names = np.array(input("Board row {}:\n".format(str(i + 1))).replace(" ", "").split(","))
+            if card_input_validate(card_names, previous_cards, 3):
+                previous_cards.update(set(card_names))
+                board_input[i] = card_names
+                break
+
+    while True:
+        card_names = np.array(input("Dead cards: \n").replace(" ", "").split(","))
+        # even if the user hit enter without anything, card_names will still get [''] after the split.
+        # putting that into the validate function won't work as it will be counted as one unrecognized card.
+        if len(card_names) == 1 and card_names[0] == "":
+            dead_cards_input = np.empty([0], dtype="<U2")
+            break
+        elif card_input_validate(card_names, previous_cards, None):
+            dead_cards_input = card_names
+            break
+
+    while True:
+        try:
+            num_trials = int(input("Number of trials? "))
+        except:
+            print("Not a valid number")
+        else:
             if num_trials > 0:
                 break
             else:
@@ -468,9 +3593,132 @@ NUM_HOLE_CARDS = 4
 # Also applies to straight flushes.
 # Assign a value of None if wheels not allowed.
 WHEEL_RANKS = np.array([14, 5, 4, 3, 2])
+# A prime for each rank, indexed by the rank, for the HandEvaluator tables.
+RANK_PRIMES = (0, 0, 2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+# The card codes of Card.code() are all below this
+CARD_CODE_LIMIT = 1 << 6
+# The Card object of each card code, by card_from_code()
+CARDS_BY_CODE = {}
+# Full Deck objects, copied by new_deck()
+DECKS = {}
+# HandEvaluator objects already built, by get_evaluator()
+EVALUATORS = {}
+# The engines Question.answer() can run the simulation with
+ENGINES = ("trial", "batch")
+# The indices of the 8 lines of the board, flattened row by row, in the order of Board.generate_board_combos()
+BOARD_LINES = np.array([[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6], [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]])
+# The indices of all the two-card-combos of the hole cards, as in Player.generate_hole_cards_combos()
+HOLE_CARD_PAIRS = np.array(list(combinations(range(NUM_HOLE_CARDS), 2)))
+# Number of trials the BatchSimulator samples at once
+BATCH_BLOCK_SIZE = 1000
+# Questions with at most this many ways to deal the unknown cards are answered exactly rather than by simulation
+EXACT_THRESHOLD = 100000
+# Number of trials simulate_in_chunks() gives a worker process at a time
+CHUNK_SIZE = 50000
+# The most trials between two estimates of Question.iter_estimates()
+PROGRESS_INTERVAL = 20000
+# Number of trials before a Question with a target precision may stop, and of its first step
+MIN_TARGET_TRIALS = 1000
+# The trials a block of stratified sampling deals in every stratum, if it has enough, for the variance within each
+# stratum to be estimated
+MIN_STRATUM_TRIALS = 2
+# The index permutations of the board, flattened row by row, of its 4 rotations and 4 reflections, which keep its lines
+BOARD_SYMMETRIES = [np.rot90(board, k).ravel() for board in (np.arange(9).reshape(3, 3), np.arange(9).reshape(3, 3).T)
+                    for k in range(4)]
+# The sorted suit counts of the suit patterns of parse_range(): double suited, single suited, rainbow, or any
+SUIT_PATTERNS = {"ds": [2, 2, 0, 0], "ss": [2, 1, 1, 0], "r": [1, 1, 1, 1], "": None}
+# Every 4-card holding of each deck, by four_card_holdings()
+FOUR_CARD_HOLDINGS = {}
+# The RangeSampler objects already built, by get_range_sampler(), and the most of them kept
+RANGE_SAMPLERS = {}
+RANGE_SAMPLER_CACHE_SIZE = 8
+# Number of holdings printed per range by Question.answer()
+RANGE_REPORT_SIZE = 5
+# The variance reductions of the BatchSimulator, besides plain sampling
+VARIANCE_REDUCTIONS = ("center", "stratified")
+# The index of the center of the board, flattened row by row, the indices in BOARD_LINES of the 4 lines through it, the
+# indices of the 2 other places of each of those lines, and the indices of the corners
+CENTER = 4
+CENTER_LINES = np.array([1, 4, 6, 7])
+CENTER_LINE_OTHERS = np.array([[place for place in line if place != 4] for line in BOARD_LINES[CENTER_LINES]])
+CORNERS = np.array([0, 2, 6, 8])
+# The number of bins of equal width of the equity distribution before the river, in a street report
+STREET_HISTOGRAM_BINS = 10
+# The hands of the undealt hole cards dealt on each board of a street report, whose average is the equity on the turn
+STREET_INNER_TRIALS = 32
+# Up to this many ways to deal the undealt hole cards on a board of a street report, they are all gone through instead,
+# for the exact equity on the turn
+STREET_EXACT_INNER_TRIALS = 64
+# The most outs of each player listed by a street report
+OUTS_REPORT_SIZE = 5
+# The most questions an EquityCache keeps
+EQUITY_CACHE_SIZE = 100000
+# The directory of the PreflopTable files, by default next to this file
+PREFLOP_TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop_tables")
+# The PreflopTable of each file opened, None if there is no such file, by get_preflop_table()
+PREFLOP_TABLES = {}
+# The PreflopTable has the equities against 1 to this many opponents
+PREFLOP_MAX_OPPONENTS = 9
+# The predefined game variants, by name. A Question may be asked for any of them in the same process.
+GAME_VARIANTS = {
+    "standard": GameVariant("standard"),
+    "short deck": GameVariant("short deck", 9, 4, (14, 9, 8, 7, 6)),
+    "no wheel": GameVariant("no wheel", 13, 4, None),
+}
+# The directory the tables of each HandEvaluator are saved to once built, and memory-mapped from by later processes.
+# None to always build them in memory.
+EVALUATOR_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluator_tables")
+# The version of the layout of the saved evaluator tables, part of their directory so that a change of layout never
+# loads stale tables.
+EVALUATOR_TABLES_VERSION = 1
 
-while True:
-    hole_cards_input, board_input, dead_cards_input, num_trials = prompt_user()
-    q1 = Question(hole_cards_input, board_input, dead_cards_input, num_trials)
-    q1.answer()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="4 card tic-tac-toe poker equity simulator")
+    parser.add_argument("--cross-check", type=int, metavar="NUM_HANDS",
+                        help="check the lookup table evaluator against the reference Hand on random hands and exit")
+    parser.add_argument("--engine", choices=ENGINES, default="batch", help="the engine running the simulation")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the batch engine runs in, 0 for one per CPU")
+    parser.add_argument("--target-std-error", type=float,
+                        help="stop once every player's equity has this standard error, the number of trials being the "
+                             "most trials to run")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="an on-disk cache of the equities of questions already answered")
+    parser.add_argument("--profile", action="store_true", help="print the time spent in each phase of the simulation")
+    parser.add_argument("--variance-reduction", choices=VARIANCE_REDUCTIONS,
+                        help="sum over every center card in each trial, or stratify the trials by a corner rank")
+    parser.add_argument("--batch", metavar="PATH",
+                        help="answer the questions of a JSONL file (- for stdin) instead of prompting, each question "
+                             "answered by one of the --workers processes")
+    parser.add_argument("--output", metavar="PATH", help="the JSONL file the --batch results go to, stdout by default")
+    parser.add_argument("--build-preflop-table", type=int, metavar="NUM_TRIALS",
+                        help="compute the preflop table of the game with this many trials per starting hand and number "
+                             "of opponents, in the --workers processes, resuming an interrupted build, and exit")
+    parser.add_argument("--variant", choices=list(GAME_VARIANTS),
+                        help="the game variant of the questions and of --build-preflop-table, by default the one "
+                             "of the global variables")
+    parser.add_argument("--streets", action="store_true",
+                        help="report the equity distribution before the river and each player's river outs too, from "
+                             "the same simulation")
+    args = parser.parse_args()
+    if args.cross_check is not None:
+        raise SystemExit(1 if cross_check_evaluator(args.cross_check) else 0)
+    if args.build_preflop_table is not None:
+        build_preflop_table(args.build_preflop_table, num_workers=args.workers or None, variant=args.variant)
+        raise SystemExit(0)
+    if args.batch is not None:
+        input_file = sys.stdin if args.batch == "-" else open(args.batch)
+        output_file = sys.stdout if args.output is None else open(args.output, "w")
+        with input_file, output_file:
+            run_batch(input_file, output_file, num_workers=args.workers or None)
+        raise SystemExit(0)
+
+    equity_cache = None if args.cache is None else EquityCache(args.cache)
+    while True:
+        hole_cards_input, board_input, dead_cards_input, num_trials = prompt_user()
+        q1 = Question(hole_cards_input, board_input, dead_cards_input, num_trials, engine=args.engine,
+                      num_workers=args.workers or None, target_std_error=args.target_std_error, cache=equity_cache,
+                      instrument=args.profile, variance_reduction=args.variance_reduction,
+                      variant=args.variant, street_report=args.streets)
+        q1.answer(progress_callback=print if args.target_std_error is not None else None)
 
@@ -0,0 +1,366 @@
+# A long-running local equity service, so that tools asking for equities do not each pay for starting an interpreter
+# and building the evaluator tables. Questions are posted as JSON, in the format of main.answer_question(), over HTTP
+# on a TCP port or a Unix socket:
+#
+#     python service.py --port 8642 --workers 0
+#     curl -d '{"hole_cards": [["As", "Ks", "Qd", "Jd"], ["*", "*", "*", "*"]], "board": [["*", "*", "*"],
+#               ["*", "*", "*"], ["*", "*", "*"]], "num_trials": 20000}' localhost:8642/equity
+#     curl localhost:8642/metrics
+#
+# The questions are answered by a pool of worker processes kept warm across requests. Identical concurrent questions
+# (up to a relabelling of the suits and a symmetry of the board) are answered once. Small questions are gathered into
+# batches answered by a single worker call, their trials simulated together, see main.answer_questions(). Beyond a
+# number of questions pending, requests are turned away with a 503, and each request has a timeout.
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+import main
+
+
+def question_key(question_input):
+    """
+    :return: a string, the same for the questions with the same answer: the canonical form of the cards, see
+    main.canonical_question_key(), and the settings of the question. Questions with ranges or a street report are only
+    the same if their inputs are, as ranges and the outs of street reports name the cards.
+    """
+    settings = {name: value for name, value in question_input.items() if name not in ("id", "timeout")}
+    if settings.get("ranges") is not None or settings.get("street_report"):
+        return json.dumps(settings, sort_keys=True)
+    hole_cards_input, board_input, dead_cards_input = main.parse_question_input(question_input)
+    for name in ("hole_cards", "board", "dead_cards"):
+        settings.pop(name, None)
+    return main.canonical_question_key(hole_cards_input, board_input, dead_cards_input) + " | " + \
+        json.dumps(settings, sort_keys=True)
+
+
+def check_settings(question_input):
+    """
+    Raises an exception if a numeric setting of the question is given but is not valid, before the question is
+    classified and registered: those of main.check_question_settings(), and the timeout, a positive number.
+    """
+    main.check_question_settings(question_input)
+    timeout = question_input.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or
+                                not 0 < timeout < math.inf):
+        raise Exception("timeout should be a positive number, not {}".format(json.dumps(timeout)))
+
+
+def is_small(question_input):
+    """:return: boolean. True if the question is a fixed number of trials, few enough to be batched."""
+    num_trials = question_input.get("num_trials")
+    return num_trials is not None and num_trials <= SMALL_QUESTION_TRIALS and \
+        question_input.get("target_std_error") is None and question_input.get("target_ci_width") is None
+
+
+class PendingQuestion:
+    """
+    A question being answered, shared by all the requests asking it. PendingQuestion.future gets the HTTP status and
+    the result of main.answer_question(). PendingQuestion.work is the concurrent.futures.Future of the worker call,
+    None while the question waits in a batch, and PendingQuestion.batch the PendingQuestion objects answered by that
+    call. A question of a batch no request waits for any more is dropped from it, the call going on for the others.
+    """
+
+    def __init__(self, key, question_input, loop):
+        self.key = key
+        self.question_input = question_input
+        self.future = loop.create_future()
+        self.work = None
+        self.batch = [self]
+        self.num_waiters = 0
+        self.dropped = False
+
+
+class EquityService:
+    """
+    Answers questions posted to it with a pool of warm worker processes, coalescing the identical ones and batching
+    the small ones, and keeps the metrics of the requests. Method EquityService.handle_connection() serves HTTP.
+    """
+
+    def __init__(self, num_workers=None, max_pending=None, timeout=None, batch_window=None, max_batch_size=None):
+        '''
+        :param num_workers: the number of worker processes, None for one per CPU.
+        :param max_pending: the most different questions waiting or being answered, beyond which requests are turned
+        away. Defaults to the global variable SERVICE_MAX_PENDING.
+        :param timeout: the default number of seconds a request waits for its answer, a request may ask for another
+        with "timeout". Defaults to the global variable SERVICE_TIMEOUT.
+        :param batch_window: the number of seconds a small question waits for others to be batched with. Defaults to
+        the global variable BATCH_WINDOW.
+        :param max_batch_size: the most questions in a batch. Defaults to the global variable MAX_BATCH_SIZE.
+        '''
+        self.num_workers = num_workers or os.cpu_count()
+        self.max_pending = SERVICE_MAX_PENDING if max_pending is None else max_pending
+        self.timeout = SERVICE_TIMEOUT if timeout is None else timeout
+        self.batch_window = BATCH_WINDOW if batch_window is None else batch_window
+        self.max_batch_size = MAX_BATCH_SIZE if max_batch_size is None else max_batch_size
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers,
+                                                               initializer=main.warm_up_worker)
+        # the worker processes are only started by the first calls, so they are started and warmed up now
+        for i in range(self.num_workers):
+            self.executor.submit(main.warm_up_worker)
+        # the questions waiting or being answered, by question_key()
+        self.pending = {}
+        # the small questions waiting for the batch to be sent, and the timer sending it
+        self.batch = []
+        self.batch_timer = None
+        self.start_time = time.monotonic()
+        self.counts = collections.Counter()
+        self.num_trials = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def __repr__(self):
+        return "EquityService with {} workers, {} questions pending".format(self.num_workers, len(self.pending))
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    async def answer(self, question_input):
+        """
+        :param question_input: a dict of the question, as in main.answer_question(), with optionally "timeout", the
+        number of seconds to wait for the answer.
+        :return: a tuple of the HTTP status and the dict of the results.
+        """
+        start = time.monotonic()
+        self.counts["requests"] += 1
+        try:
+            check_settings(question_input)
+            key = question_key(question_input)
+            small = is_small(question_input)
+            timeout = float(question_input.get("timeout", self.timeout))
+        except Exception as e:
+            self.counts["errors"] += 1
+            return 400, {"id": question_input.get("id"), "error": " ".join(str(arg) for arg in e.args)}
+        pending = self.pending.get(key)
+        if pending is not None:
+            self.counts["coalesced"] += 1
+        elif len(self.pending) >= self.max_pending:
+            self.counts["rejected"] += 1
+            return 503, {"id": question_input.get("id"), "error": "Too many questions pending, retry later"}
+        else:
+            pending = self.submit(key, question_input, small)
+        pending.num_waiters += 1
+        try:
+            # shielded, so that a request timing out does not cancel the answer for the other requests
+            status, result = await asyncio.wait_for(asyncio.shield(pending.future), timeout)
+        except asyncio.TimeoutError:
+            self.counts["timeouts"] += 1
+            return 504, {"id": question_input.get("id"), "error": "No answer within {} seconds".format(timeout)}
+        finally:
+            pending.num_waiters -= 1
+            if pending.num_waiters == 0 and not pending.future.done():
+                self.cancel(pending)
+        self.latencies.append(time.monotonic() - start)
+        if status != 200:
+            self.counts["errors"] += 1
+        return status, dict(result, id=question_input.get("id"))
+
+    def submit(self, key, question_input, small):
+        """
+        Starts answering a question, on its own or in the next batch if it is small, see is_small(). Returns its
+        PendingQuestion.
+        """
+        pending = PendingQuestion(key, question_input, asyncio.get_running_loop())
+        self.pending[key] = pending
+        if small:
+            self.batch.append(pending)
+            if len(self.batch) >= self.max_batch_size:
+                self.send_batch()
+            elif self.batch_timer is None:
+                self.batch_timer = asyncio.get_running_loop().call_later(self.batch_window, self.send_batch)
+        else:
+            pending.work = self.executor.submit(main.answer_question, question_input)
+            pending.work.add_done_callback(self.work_callback([pending]))
+        return pending
+
+    def send_batch(self):
+        """Sends the small questions waiting to a worker, in one call."""
+        if self.batch_timer is not None:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        if len(self.batch) == 0:
+            return
+        batch, self.batch = self.batch, []
+        work = self.executor.submit(main.answer_questions, [pending.question_input for pending in batch])
+        for pending in batch:
+            pending.work = work
+            pending.batch = batch
+        work.add_done_callback(self.work_callback(batch))
+        self.counts["batches"] += 1
+
+    def work_callback(self, batch):
+        """
+        :param batch: the PendingQuestion objects answered by a worker call.
+        :return: the done callback of the worker call, which hands the results over to the event loop thread.
+        """
+        loop = asyncio.get_running_loop()
+
+        def callback(work):
+            loop.call_soon_threadsafe(self.finish, batch, work)
+
+        return callback
+
+    def finish(self, batch, work):
+        """
+        Sets the HTTP status and the results of a worker call to its PendingQuestion objects: 400 for the questions
+        that are not valid, 503 if the call was cancelled, e.g. by the shutdown of the service, and 500 if it failed.
+        """
+        if work.cancelled():
+            statuses, results = [503] * len(batch), [{"error": "Cancelled"}] * len(batch)
+        elif work.exception() is not None:
+            statuses = [500] * len(batch)
+            results = [{"error": "Worker failed: {}".format(work.exception())}] * len(batch)
+        else:
+            results = work.result()
+            if not isinstance(results, list):
+                results = [results]
+            statuses = [400 if "error" in result else 200 for result in results]
+        for pending, status, result in zip(batch, statuses, results):
+            if pending.dropped:
+                continue
+            if self.pending.get(pending.key) is pending:
+                del self.pending[pending.key]
+            # the trials simulated, not the completions of exact answers nor the trials of the preflop table
+            if result.get("mode") == "monte carlo":
+                self.num_trials += result["num_trials"]
+            if not pending.future.done():
+                pending.future.set_result((status, result))
+
+    def cancel(self, pending):
+        """
+        Drops a question no request waits for any more, if it has not started yet. The worker call of a batch is only
+        cancelled once none of its questions has a request waiting.
+        """
+        if pending in self.batch:
+            self.batch.remove(pending)
+        elif pending.work is None or pending.work.running() or pending.work.done():
+            # already being answered: the answer is not wasted, the worker call finishes it anyway
+            return
+        elif any(other.num_waiters > 0 for other in pending.batch if other is not pending):
+            pending.dropped = True
+        elif not pending.work.cancel():
+            return
+        if self.pending.get(pending.key) is pending:
+            del self.pending[pending.key]
+        pending.future.cancel()
+        self.counts["cancelled"] += 1
+
+    def metrics(self):
+        """:return: a dict of the metrics of the service."""
+        uptime = time.monotonic() - self.start_time
+        latencies = np.array(self.latencies)
+        percentiles = {"p{}".format(q): float(np.percentile(latencies, q)) if len(latencies) else None
+                       for q in (50, 90, 99)}
+        return {
+            "uptime_seconds": uptime,
+            "workers": self.num_workers,
+            "queue_depth": len(self.pending),
+            "batch_waiting": len(self.batch),
+            "max_pending": self.max_pending,
+            "latency_seconds": percentiles,
+            "trials_per_sec": self.num_trials / uptime if uptime > 0 else 0.0,
+            "num_trials": self.num_trials,
+            "counts": dict(self.counts),
+        }
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves one HTTP request: POST /equity with a question as JSON, GET /metrics or GET /health. The connection is
+        closed after the response.
+        """
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                status, result = 400, {"error": "Bad request"}
+            elif request_line[0] == "GET" and request_line[1] == "/metrics":
+                status, result = 200, self.metrics()
+            elif request_line[0] == "GET" and request_line[1] == "/health":
+                status, result = 200, {"status": "ok"}
+            elif request_line[0] == "POST" and request_line[1] == "/equity":
+                try:
+                    question_input = json.loads(body)
+                except ValueError as e:
+                    status, result = 400, {"error": "Invalid JSON: {}".format(e)}
+                else:
+                    if isinstance(question_input, dict):
+                        status, result = await self.answer(question_input)
+                    else:
+                        status, result = 400, {"error": "The question should be a JSON object"}
+            else:
+                status, result = 404, {"error": "Not found"}
+            try:
+                payload = json.dumps(result, allow_nan=False).encode()
+            except ValueError:
+                status, result = 500, {"id": result.get("id"), "error": "The results are not finite numbers"}
+                payload = json.dumps(result).encode()
+            writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}"
+                         "Connection: close\r\n\r\n".format(status, HTTP_REASONS[status], len(payload),
+                                                            "Retry-After: 1\r\n" if status == 503 else "")
+                         .encode() + payload)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(service, host=None, port=None, unix_path=None):
+    """
+    Serves the EquityService over HTTP, on the Unix socket if unix_path is given, on the TCP host and port otherwise.
+    """
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix_path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host=host, port=port)
+    print("Serving on", unix_path if unix_path is not None else "{}:{}".format(host, port))
+    async with server:
+        await server.serve_forever()
+
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+                503: "Service Unavailable", 504: "Gateway Timeout"}
+# The most different questions waiting or being answered before requests are turned away
+SERVICE_MAX_PENDING = 256
+# Seconds a request waits for its answer by default
+SERVICE_TIMEOUT = 60.0
+# Questions of a fixed number of trials up to this many are batched
+SMALL_QUESTION_TRIALS = 20000
+# Seconds a small question waits for others to be batched with, and the most questions in a batch
+BATCH_WINDOW = 0.01
+MAX_BATCH_SIZE = 32
+# Number of the latest requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local equity service of the 4 card tic-tac-toe poker simulator")
+    parser.add_argument("--host", default="127.0.0.1", help="the host to listen on")
+    parser.add_argument("--port", type=int, default=8642, help="the TCP port to listen on")
+    parser.add_argument("--unix", metavar="PATH", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=0, help="number of worker processes, 0 for one per CPU")
+    parser.add_argument("--max-pending", type=int, default=SERVICE_MAX_PENDING,
+                        help="the most different questions pending before requests get a 503")
+    parser.add_argument("--timeout", type=float, default=SERVICE_TIMEOUT, help="default seconds a request waits")
+    args = parser.parse_args()
+    equity_service = EquityService(num_workers=args.workers or None, max_pending=args.max_pending,
+                                   timeout=args.timeout)
+    try:
+        asyncio.run(serve(equity_service, host=args.host, port=args.port, unix_path=args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        equity_service.close()
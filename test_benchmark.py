@@ -0,0 +1,22 @@
+import json
+
+import benchmark
+
+
+def write_results(path, results):
+    with open(path, "w") as f:
+        json.dump({"machine": {}, "results": results}, f)
+    return str(path)
+
+
+def test_compare_flags_the_regressions_beyond_the_threshold(tmp_path, capsys):
+    baseline = write_results(tmp_path / "baseline.json", {"slower": 100.0, "a bit slower": 100.0, "faster": 100.0,
+                                                          "removed": 100.0})
+    current = write_results(tmp_path / "current.json", {"slower": 80.0, "a bit slower": 95.0, "faster": 150.0,
+                                                        "added": 100.0})
+    assert benchmark.compare(baseline, current, 0.1) == 1
+    lines = {line.split("  ")[0]: line for line in capsys.readouterr().out.splitlines()}
+    assert "REGRESSION" in lines["slower"]
+    assert "REGRESSION" not in lines["a bit slower"] and "REGRESSION" not in lines["faster"]
+    assert "only in" in lines["removed"] and "only in" in lines["added"]
+    assert benchmark.compare(baseline, current, 0.25) == 0
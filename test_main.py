@@ -0,0 +1,550 @@
+import io
+import concurrent.futures
+import contextlib
+import json
+
+import numpy as np
+import pytest
+
+import main
+
+# A corner and the center unknown, few enough completions to enumerate, and both a corner and the center to reduce
+# variance over.
+HOLE_CARDS = [["As", "Ad", "Tc", "9d"], ["Qs", "Js", "Th", "5h"]]
+BOARD = [["Ks", "9c", "*"], ["2d", "*", "Qh"], ["4h", "7s", "Jc"]]
+
+
+def make_question(hole_cards=HOLE_CARDS, board=BOARD, dead_cards=(), num_trials=20000, **kwargs):
+    kwargs.setdefault("engine", "batch")
+    kwargs.setdefault("seed", 0)
+    kwargs.setdefault("exact_threshold", 0)
+    return main.Question(np.array(hole_cards, dtype="<U2"), np.array(board, dtype="<U2"),
+                         np.array(dead_cards, dtype="<U2"), num_trials, verbose=False, **kwargs)
+
+
+def answer_quietly(question):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return question.answer()
+
+
+@pytest.fixture(scope="module")
+def exact_equities():
+    question = make_question(exact_threshold=None)
+    equities = question.answer()
+    assert question.mode == "exact"
+    return equities
+
+
+def assert_close(question, equities, exact_equities, num_std_errors=4):
+    std_errors = question.estimate.std_errors()
+    assert np.all(np.abs(equities - exact_equities) <= num_std_errors * std_errors + 1e-9), \
+        (equities, exact_equities, std_errors)
+
+
+def test_evaluator_matches_reference_hand():
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert main.cross_check_evaluator(2000) == 0
+
+
+def test_fixed_lines_match_a_full_evaluation():
+    evaluator = main.get_evaluator()
+    rng = np.random.default_rng(0)
+    codes = np.sort(main.new_deck().codes)
+    for board_num in range(200):
+        dealt = [main.card_from_code(int(code)) for code in rng.choice(codes, 13, replace=False)]
+        board_cards = np.array(dealt[:9], dtype=object).reshape(3, 3)
+        # up to 4 places left undealt, so that some lines are complete and others not
+        undealt = rng.choice(9, rng.integers(5), replace=False)
+        partial_board = main.Board(np.where(np.isin(np.arange(9), undealt).reshape(3, 3), None, board_cards))
+        player = main.Player(1, dealt[9:])
+        player.generate_fixed_lines(partial_board, evaluator)
+        complete_lines = [line for line in range(8) if not np.isin(main.BOARD_LINES[line], undealt).any()]
+        assert sorted(player.fixed_lines) == complete_lines
+        full_board = main.Board(board_cards)
+        full_board.generate_board_combos(evaluator)
+        for line, (strength, cards) in player.fixed_lines.items():
+            assert strength == max(evaluator.evaluate_cards([player.hole_cards[first], player.hole_cards[second]] +
+                                                            list(full_board.board_combos[line]))
+                                   for first, second in main.HOLE_CARD_PAIRS.tolist())
+            assert evaluator.evaluate_cards(cards) == strength
+        # the showdown with the fixed lines is that of the whole board evaluated again
+        player.generate_hole_cards_combos(evaluator)
+        player.generate_showdown_hand(full_board, evaluator)
+        unfixed = main.Player(1, dealt[9:])
+        unfixed.generate_hole_cards_combos(evaluator)
+        unfixed.generate_showdown_hand(full_board, evaluator)
+        assert player.showdown_strength == unfixed.showdown_strength
+        assert evaluator.evaluate_cards(player.showdown_cards) == player.showdown_strength
+
+
+@pytest.mark.parametrize("variant", list(main.GAME_VARIANTS))
+def test_line_evaluator_matches_every_hole_pair(variant):
+    variant = main.GAME_VARIANTS[variant]
+    evaluator = variant.evaluator()
+    codes = np.sort(variant.new_deck().codes)
+    rng = np.random.default_rng(0)
+    for hand in range(2000):
+        if hand % 2 == 0:
+            # a line of one suit, and hole cards mostly of that suit, for the flushes
+            suit = rng.integers(4)
+            suited = codes[codes & 3 == suit]
+            line_codes = rng.choice(suited, 3, replace=False)
+            others = codes[~np.isin(codes, line_codes)]
+            odds = np.where(others & 3 == suit, 4.0, 1.0)
+            hole_codes = rng.choice(others, 4, replace=False, p=odds / odds.sum())
+        else:
+            dealt = rng.choice(codes, 7, replace=False)
+            line_codes, hole_codes = dealt[:3], dealt[3:]
+        line = [main.card_from_code(int(code)) for code in line_codes]
+        hole_cards = [main.card_from_code(int(code)) for code in hole_codes]
+        strength, (i, j) = evaluator.evaluate_line(evaluator.hole_pairs(hole_cards), evaluator.line_data(line))
+        best = max(evaluator.evaluate_cards([hole_cards[first], hole_cards[second]] + line)
+                   for first, second in main.HOLE_CARD_PAIRS.tolist())
+        assert strength == best, (hole_cards, line)
+        assert evaluator.evaluate_cards([hole_cards[i], hole_cards[j]] + line) == strength
+    # the wheel, a straight only where the variant allows it, and a straight flush with a line of the suit of the pair
+    wheel = variant.wheel_ranks or (14, 5, 4, 3, 2)
+    for line_suits, is_straight_flush in (((1, 1, 2), False), ((3, 3, 3), True)):
+        line = [main.Card(rank, suit) for rank, suit in zip(wheel[:3], line_suits)]
+        hole_cards = [main.Card(wheel[3], 3), main.Card(wheel[4], 3), main.Card(wheel[0], 4), main.Card(wheel[1], 4)]
+        strength, pair = evaluator.evaluate_line(evaluator.hole_pairs(hole_cards), evaluator.line_data(line))
+        category = main.unpack_strength(strength)[0]
+        if variant.wheel_ranks is None:
+            assert category not in (5, 9)
+        else:
+            assert category == (9 if is_straight_flush else 5) and pair == (0, 1)
+
+
+@pytest.mark.parametrize("variance_reduction", [None, "center", "stratified"])
+def test_batch_engine_matches_exact(exact_equities, variance_reduction):
+    question = make_question(variance_reduction=variance_reduction)
+    assert_close(question, question.answer(), exact_equities)
+
+
+def test_stratified_sampling_covers_every_stratum():
+    # 13 ranks undealt, so 2 trials of each from 26 trials
+    question = make_question(variance_reduction="stratified", num_trials=26)
+    question.answer()
+    assert np.all(question.estimate.stratum_counts == 2)
+    assert np.all(np.isfinite(question.estimate.std_errors()))
+    # too few trials to sample every stratum twice
+    question = make_question(variance_reduction="stratified", num_trials=20)
+    question.answer()
+    assert np.all(question.estimate.std_errors() == np.inf)
+
+
+def test_trials_deal_from_the_deck_and_restore_it():
+    question = make_question(hole_cards=[HOLE_CARDS[0], ["*"] * 4], dead_cards=["2c", "Ah"], engine="trial")
+    deck = question.deck
+    codes, size, remaining = deck.codes.copy(), deck.size, set(deck.remaining_codes().tolist())
+    assert len(remaining) == 52 - 4 - 7 - 2 and not {main.card_name_to_code(name) for name in ("2c", "Ah")} & remaining
+    for trial_num in range(200):
+        trial = main.Trial(question.players, question.board, deck, evaluator=question.evaluator)
+        trial.run()
+        dealt = [card.code() for card in trial.board.board_cards[np.equal(question.board.board_cards, None)]] + \
+            [card.code() for card in trial.players[1].hole_cards]
+        # the unknown cards only, each dealt once
+        assert len(set(dealt)) == 2 + 4 and set(dealt) <= remaining
+        assert deck.size == size and np.array_equal(deck.codes, codes)
+        assert np.array_equal(deck.positions[deck.codes], np.arange(len(deck.codes)))
+    # the question's own cards are untouched
+    assert all(card is None for card in question.players[1].hole_cards)
+
+
+def test_exact_matches_trial_engine_on_the_river():
+    board = [row[:] for row in BOARD]
+    board[0][2] = "8d"
+    exact = make_question(board=board, exact_threshold=None).answer()
+    question = make_question(board=board, num_trials=400, engine="trial")
+    assert_close(question, answer_quietly(question), exact)
+
+
+def test_batch_engine_does_not_depend_on_workers():
+    one = make_question(chunk_size=5000).answer()
+    two = make_question(chunk_size=5000, num_workers=2).answer()
+    assert np.array_equal(one, two)
+
+
+def test_target_precision_runs_the_steps_in_the_workers(monkeypatch):
+    submitted = []
+    submit = concurrent.futures.ProcessPoolExecutor.submit
+
+    def counting_submit(executor, function, *args):
+        submitted.append(args[1])
+        return submit(executor, function, *args)
+
+    monkeypatch.setattr(concurrent.futures.ProcessPoolExecutor, "submit", counting_submit)
+    # a target never reached, so that the steps run up to num_trials, each smaller than a chunk
+    settings = dict(num_trials=60000, target_std_error=1e-6, progress_interval=20000)
+    one = make_question(**settings).answer()
+    assert submitted == []
+    two = make_question(num_workers=2, **settings).answer()
+    # doubling from MIN_TARGET_TRIALS up to progress_interval
+    assert submitted == [1000, 1000, 2000, 4000, 8000, 16000, 20000, 8000]
+    assert np.array_equal(one, two)
+
+
+def test_steps_reuse_the_simulator_of_the_question(monkeypatch):
+    built = []
+
+    class CountingSimulator(main.BatchSimulator):
+        def __init__(self, *args, **kwargs):
+            built.append(args)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(main, "BatchSimulator", CountingSimulator)
+    question = make_question(hole_cards=[HOLE_CARDS[0], ["*"] * 4], ranges=[None, "QQxx"], num_trials=4000,
+                             target_std_error=1e-6, progress_interval=1000)
+    question.answer()
+    assert question.estimate.num_trials == 4000
+    assert len(built) == 1
+
+
+def test_loose_target_precision_stops_early():
+    question = make_question(num_trials=None, target_std_error=0.02)
+    question.answer()
+    assert question.estimate.num_trials < main.PROGRESS_INTERVAL / 4
+    assert np.all(question.estimate.std_errors() <= 0.02)
+
+
+class RecordingHook(main.StatsHook):
+    def __init__(self):
+        self.phase_calls = {}
+        self.finished = []
+
+    def on_phase(self, phase, seconds, calls):
+        assert seconds >= 0
+        self.phase_calls[phase] = self.phase_calls.get(phase, 0) + calls
+
+    def on_finish(self, stats):
+        self.finished.append(stats)
+
+
+@pytest.mark.parametrize("engine, num_workers, phases",
+                         [("trial", 1, {"copy", "deal", "hole_cards_combos", "evaluate", "showdown"}),
+                          ("batch", 1, {"deal", "evaluate", "showdown"}),
+                          ("batch", 2, {"deal", "evaluate", "showdown"})])
+def test_stats_count_the_phases_and_call_the_hooks(engine, num_workers, phases):
+    hook = RecordingHook()
+    num_trials = 50 if engine == "trial" else 5000
+    question = make_question(num_trials=num_trials, engine=engine, num_workers=num_workers, chunk_size=2000,
+                             stats_hooks=[hook])
+    answer_quietly(question)
+    stats = question.stats
+    assert hook.finished == [stats] and stats.wall_seconds > 0
+    assert set(stats.phase_calls) == phases and hook.phase_calls == dict(stats.phase_calls)
+    assert stats.num_trials == num_trials
+    if engine == "trial":
+        assert stats.phase_calls["deal"] == num_trials
+        assert stats.phase_calls["evaluate"] == num_trials * len(HOLE_CARDS)
+    else:
+        # chunks of 2000, 2000 and 1000 trials, in blocks of at most BATCH_BLOCK_SIZE, whichever worker ran them
+        assert all(calls == 5 for calls in stats.phase_calls.values())
+        assert stats.num_hands_evaluated == num_trials * question.batch_simulator().hands_per_trial
+
+
+def test_canonical_key_is_the_same_for_equivalent_questions():
+    def key(hole_cards, board):
+        return main.canonical_question_key(np.array(hole_cards, dtype="<U2"), np.array(board, dtype="<U2"),
+                                           np.array([], dtype="<U2"))
+
+    # hearts and spades swapped, and the board reflected left to right
+    swap = str.maketrans("hs", "sh")
+    relabelled_holes = [[card.translate(swap) for card in hole] for hole in HOLE_CARDS]
+    reflected_board = [[card.translate(swap) for card in row[::-1]] for row in BOARD]
+    assert key(HOLE_CARDS, BOARD) == key(relabelled_holes, reflected_board)
+    other_board = [row[:] for row in BOARD]
+    other_board[0][0] = "Kd"
+    assert key(HOLE_CARDS, BOARD) != key(HOLE_CARDS, other_board)
+
+
+def test_cache_tops_up_its_estimates(tmp_path):
+    cache = main.EquityCache(str(tmp_path / "equities.sqlite"))
+    first = make_question(num_trials=4000, cache=cache)
+    first.answer()
+    topped_up = make_question(num_trials=10000, cache=cache)
+    topped_up.answer()
+    # only the trials missing are simulated, from their own random number stream
+    extra = make_question().simulate(6000, first.seed_sequence(4000))
+    assert topped_up.estimate.num_trials == 10000
+    assert np.array_equal(topped_up.estimate.share_sums, first.estimate.share_sums + extra.share_sums)
+    mode, estimate = cache.get(first.canonical_key)
+    assert mode == "monte carlo" and estimate.num_trials == 10000
+    # precise enough already
+    fewer = make_question(num_trials=8000, cache=cache)
+    assert np.array_equal(fewer.answer(), topped_up.estimate.equities())
+    assert fewer.estimate.num_trials == 10000
+
+
+def test_cache_evicts_the_least_recently_used(tmp_path):
+    cache = main.EquityCache(str(tmp_path / "equities.sqlite"), max_entries=2)
+    estimate = main.Estimate(1, [1.0, 0.0], [1.0, 0.0])
+    cache.put("a", "exact", estimate)
+    cache.put("b", "exact", estimate)
+    cache.get("a")
+    cache.put("c", "exact", estimate)
+    assert cache.get("b") == (None, None)
+    assert cache.get("a")[0] == "exact" and cache.get("c")[0] == "exact"
+
+
+def test_batch_runner_answers_bad_lines_with_errors():
+    good = {"id": 4, "hole_cards": HOLE_CARDS, "board": BOARD, "num_trials": 1000, "seed": 0, "exact_threshold": 0}
+    lines = ['{"id": 1, "hole_cards": [["As"]], "board": []}', "not JSON", "[1, 2]",
+             '{"id": 3, "hole_cards": [["Jdx", "*", "*", "*"], ["*", "*", "*", "*"]], '
+             '"board": [["*", "*", "*"], ["*", "*", "*"], ["*", "*", "*"]]}', json.dumps(good)]
+    output = io.StringIO()
+    main.run_batch(io.StringIO("\n".join(lines) + "\n"), output)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result["id"] for result in results] == [1, None, None, 3, 4]
+    assert all("error" in result for result in results[:4])
+    assert "Jdx" in results[3]["error"]
+    assert results[4]["mode"] == "monte carlo" and results[4]["num_trials"] == 1000
+
+
+@pytest.mark.parametrize("settings", [{"num_trials": -5}, {"num_trials": "5"}, {"num_trials": 0},
+                                      {"num_trials": True}, {"target_std_error": 0}, {"target_ci_width": "0.01"},
+                                      {"seed": -1}])
+def test_invalid_settings_are_rejected(settings):
+    question_input = dict({"hole_cards": HOLE_CARDS, "board": BOARD}, **settings)
+    result = json.loads(main.answer_question_line(json.dumps(question_input)))
+    assert list(settings)[0] in result["error"]
+
+
+@pytest.mark.parametrize("variance_reduction", ["center", "antithetic"])
+def test_variance_reduction_is_checked_on_exact_questions(variance_reduction):
+    # the center known, and few enough completions to be answered exactly
+    board = [row[:] for row in BOARD]
+    board[1][1] = "8c"
+    with pytest.raises(Exception):
+        make_question(board=board, exact_threshold=None, variance_reduction=variance_reduction)
+
+
+def test_standard_errors_of_too_few_trials_are_null():
+    question_input = {"hole_cards": HOLE_CARDS, "board": BOARD, "num_trials": 1, "exact_threshold": 0}
+    # strict JSON, which json.loads would not check
+    line = main.answer_question_line(json.dumps(question_input))
+    assert "Infinity" not in line and "NaN" not in line
+    assert json.loads(line)["std_errors"] == [None, None]
+
+
+def test_single_holding_range_matches_exact(exact_equities):
+    hole_cards = [HOLE_CARDS[0], ["*"] * 4]
+    question = make_question(hole_cards=hole_cards, ranges=[None, "".join(HOLE_CARDS[1])])
+    assert_close(question, question.answer(), exact_equities)
+
+
+def test_range_sampler_draws_from_the_holdings_fitting():
+    simulator = make_question(hole_cards=[["*"] * 4] * 3, ranges=["AAxx", "KKxx ss", "*"]).batch_simulator()
+    board, holes, weights, holding_indices = simulator.deal_range_block(50, np.random.default_rng(0))
+    taken_codes = np.concatenate((holes[:, 0], holes[:, 1]), axis=1)
+    player, range_indices, holdings, masks, range_weights = simulator.range_tables[2]
+    sampler = simulator.range_samplers[2]
+    fitting = sampler.fitting_weights(taken_codes)
+    # the trials where no holding of the second range fits have any cards, and a weight of 0
+    for trial in np.flatnonzero(weights > 0):
+        collides = np.isin(holdings, taken_codes[trial]).any(axis=1)
+        assert np.isclose(fitting[trial], range_weights[~collides].sum())
+        assert np.isclose(sampler.fitting_weights(taken_codes[trial:trial + 1], np.array([1000]))[0],
+                          range_weights[:1001][~collides[:1001]].sum())
+    # a weighted range drawn with some of its cards taken, every holding as often as its share of those fitting
+    hand_range = main.parse_range("AKQJ ss:2, AKQJ r")
+    sampler = main.RangeSampler(hand_range.holdings, hand_range.weights)
+    taken_codes = np.array([main.card_name_to_code(name) for name in ("As", "Qh")])
+    taken = np.uint64((1 << int(taken_codes[0])) | (1 << int(taken_codes[1])))
+    num_trials = 40000
+    picks, available = sampler.draw(np.full(num_trials, taken), np.tile(taken_codes, (num_trials, 1)),
+                                    np.random.default_rng(0))
+    fits = (hand_range.masks & taken) == 0
+    assert np.all(available == hand_range.weights[fits].sum()) and np.all(fits[picks])
+    expected = np.where(fits, hand_range.weights, 0) / hand_range.weights[fits].sum()
+    frequencies = np.bincount(picks, minlength=len(fits)) / num_trials
+    assert np.all(np.abs(frequencies - expected) <= 5 * np.sqrt(expected * (1 - expected) / num_trials) + 1e-12)
+
+
+def test_ranges_that_never_fit_together_are_rejected():
+    hole_cards = [["*"] * 4, ["*"] * 4]
+    with pytest.raises(ValueError):
+        make_question(hole_cards=hole_cards, ranges=["AsAdTc9d", "AsAdTc9d"])
+    with pytest.raises(ValueError):
+        main.WeightedEstimate(10, np.zeros(2), np.zeros(2), 0.0, 0.0, np.zeros(2)).equities()
+
+
+def test_parse_range_patterns():
+    pairs = main.parse_range("AAxx")
+    # 2, 3 or 4 aces
+    assert len(pairs.holdings) == 6 * 1128 + 4 * 48 + 1
+    double_suited = main.parse_range("AAxx ds")
+    for holding in double_suited.holdings:
+        assert np.count_nonzero(holding >> 2 == 14) >= 2
+        assert sorted(np.bincount(holding & 3, minlength=4)) == [0, 0, 2, 2]
+    rainbow = main.parse_range("AKQJr")
+    assert len(rainbow.holdings) == 24
+    weighted = main.parse_range("AsKsQhJh:0.5, AKQJ ss:0.25")
+    heaviest = weighted.holdings[np.argmax(weighted.weights)]
+    assert heaviest.tolist() == sorted(main.card_name_to_code(name) for name in ("As", "Ks", "Qh", "Jh"))
+    assert sorted(set(weighted.weights)) == [0.25, 0.5]
+    assert len(main.parse_range("*").holdings) == len(main.four_card_holdings())
+    for text in ("AAx", "AAAAA", "AAAA ds", "AsKs:heavy", ""):
+        with pytest.raises(Exception):
+            main.parse_range(text)
+
+
+@pytest.fixture(scope="module")
+def preflop_table_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("preflop") / "table.npy")
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.build_preflop_table(10, path=path, max_opponents=1, variant="short deck")
+    return path
+
+
+def card_codes(card_names):
+    return [main.card_name_to_code(card_name) for card_name in card_names]
+
+
+def test_preflop_table_lookup(preflop_table_path):
+    table = main.PreflopTable(preflop_table_path, "short deck")
+    equity, std_error, num_trials = table.lookup(card_codes(["As", "Ks", "Qh", "9h"]), 1)
+    assert 0 < equity < 1 and std_error > 0 and num_trials == 10
+    # the same class of starting hands
+    assert table.lookup(card_codes(["Ad", "Kd", "Qc", "9c"]), 1) == (equity, std_error, num_trials)
+    assert table.lookup(card_codes(["As", "Ks", "Qh", "9h"]), 2) is None
+
+
+def test_preflop_table_build_resumes(preflop_table_path, tmp_path, capsys):
+    path = str(tmp_path / "table.npy")
+    table = np.load(preflop_table_path)
+    holdings = main.four_card_holdings("short deck")
+    classes = main.suit_classes(holdings, "short deck")
+    hand_class = main.suit_classes(np.array([card_codes(["As", "Ks", "Qh", "9h"])]), "short deck")[0]
+    members = [main.holding_index(holding, "short deck") for holding in holdings[classes == hand_class]]
+    interrupted = table.copy()
+    interrupted[members] = np.nan
+    np.save(path, interrupted)
+    main.build_preflop_table(10, path=path, max_opponents=1, seed=1, variant="short deck")
+    assert "1 to compute" in capsys.readouterr().out
+    resumed = np.load(path)
+    assert not np.isnan(resumed).any()
+    others = np.ones(len(table), dtype=bool)
+    others[members] = False
+    assert np.array_equal(resumed[others], table[others])
+
+
+def test_stacked_simulation_matches_one_by_one():
+    questions = [make_question(), make_question(hole_cards=[HOLE_CARDS[0], ["*"] * 4], seed=1)]
+    estimates = main.simulate_stacked([question.batch_simulator() for question in questions],
+                                      [question.num_trials for question in questions],
+                                      [question.seed_sequence(0) for question in questions])
+    for question, estimate in zip(questions, estimates):
+        assert np.array_equal(estimate.equities(), question.answer())
+
+
+def test_answer_questions_builds_each_question_once(monkeypatch):
+    built = []
+    question_from_input = main.question_from_input
+
+    def counting_question_from_input(question_input):
+        built.append(question_input["id"])
+        return question_from_input(question_input)
+
+    monkeypatch.setattr(main, "question_from_input", counting_question_from_input)
+    question_inputs = [{"id": id, "hole_cards": HOLE_CARDS, "board": BOARD, "num_trials": 1000, "seed": 0,
+                        "exact_threshold": 0, "variance_reduction": variance_reduction}
+                       for id, variance_reduction in enumerate([None, "center", "stratified"])]
+    results = main.answer_questions(question_inputs)
+    assert [result["id"] for result in results] == [0, 1, 2]
+    assert all("equities" in result for result in results)
+    assert sorted(built) == [0, 1, 2]
+
+
+def test_warm_up_builds_the_tables_of_every_variant():
+    main.warm_up_worker()
+    for variant in main.GAME_VARIANTS.values():
+        assert hasattr(variant.evaluator(), "partial_keys")
+
+
+def test_evaluator_tables_reload_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "EVALUATOR_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "EVALUATORS", {})
+    for variant in main.GAME_VARIANTS.values():
+        variant.evaluator().center_tables()
+    assert [path.name for path in tmp_path.iterdir()] == ["v{}".format(main.EVALUATOR_TABLES_VERSION)]
+    monkeypatch.setattr(main, "EVALUATORS", {})
+    for variant in main.GAME_VARIANTS.values():
+        loaded = variant.evaluator()
+        built = main.HandEvaluator(num_ranks=variant.num_ranks, wheel_ranks=variant.wheel_ranks)
+        assert loaded.tables_dir.startswith(str(tmp_path)) and built.tables_dir is None
+        for loaded_table, built_table in ((loaded.product_keys, built.product_keys),
+                                          (loaded.product_key_strengths, built.product_key_strengths),
+                                          (loaded.flush_strengths_array, built.flush_strengths_array),
+                                          *zip(loaded.center_tables(), built.center_tables())):
+            assert isinstance(loaded_table, np.memmap)
+            assert loaded_table.dtype == built_table.dtype and np.array_equal(loaded_table, built_table)
+
+
+def test_shared_draws_match_exact(exact_equities):
+    other_board = [row[:] for row in BOARD]
+    other_board[0][2] = "8d"
+    exact_other = make_question(board=other_board, exact_threshold=None).answer()
+    multi = main.MultiQuestion([make_question(), make_question(board=other_board), make_question()], 20000, seed=0,
+                               verbose=False)
+    equities = multi.answer()
+    for variant, exact in ((0, exact_equities), (1, exact_other)):
+        std_errors = multi.estimate.variant_estimate(variant).std_errors()
+        assert np.all(np.abs(equities[variant] - exact) <= 4 * std_errors + 1e-9)
+    # the same question twice is simulated on the same cards
+    differences, std_errors = multi.estimate.differences(2)
+    assert np.all(differences == 0)
+
+
+def test_shared_draws_of_no_trials():
+    simulator = main.SharedDrawSimulator([make_question().batch_simulator(),
+                                          make_question(hole_cards=[HOLE_CARDS[0], ["*"] * 4]).batch_simulator()])
+    estimate = main.simulate_in_chunks(simulator, 0, seed=0)
+    assert isinstance(estimate, main.PairedEstimate) and estimate.num_trials == 0
+    assert estimate.share_sums.shape == (2, 2)
+
+
+def test_street_report_matches_exact_river_equities():
+    board = [row[:] for row in BOARD]
+    board[0][2] = "8d"
+    question = make_question(board=board, num_trials=5, street_report=True)
+    with pytest.raises(ValueError, match="not been answered"):
+        question.street_report()
+    question.answer()
+    report = question.street_report()
+    for name, equities in list(zip(report["river"]["center_cards"], report["river"]["equities"]))[:5]:
+        board[1][1] = name
+        assert np.allclose(make_question(board=board, exact_threshold=None).answer(), equities)
+    question = make_question(board=board, num_trials=5)
+    question.answer()
+    with pytest.raises(ValueError, match="street report"):
+        question.street_report()
+
+
+def test_street_report_turn_distribution_is_exact_with_few_hole_deals():
+    # one hole card of the opponent unknown, so every way to deal it is gone through on each board
+    hole_cards = [HOLE_CARDS[0], HOLE_CARDS[1][:3] + ["*"]]
+    question = make_question(hole_cards=hole_cards, num_trials=2000, street_report=True)
+    question.answer()
+    report = question.street_report()
+    assert report["turn"]["board_std_errors"] == [0, 0]
+    # the corner is the only other card to deal, each card of the deck equally likely
+    known = {card for cards in hole_cards + BOARD for card in cards}
+    corners = [rank + suit for rank in main.RANK_NAMES.values() for suit in main.SUIT_NAMES.values()
+               if rank + suit not in known]
+    frequencies = np.zeros((2, main.STREET_HISTOGRAM_BINS))
+    for corner in corners:
+        board = [row[:] for row in BOARD]
+        board[0][2] = corner
+        equities = make_question(hole_cards=hole_cards, board=board, exact_threshold=None).answer()
+        bins = np.minimum((equities * main.STREET_HISTOGRAM_BINS).astype(int), main.STREET_HISTOGRAM_BINS - 1)
+        frequencies[[0, 1], bins] += 1 / len(corners)
+    # within 5 standard errors of the frequencies of the corners dealt
+    assert np.allclose(report["turn"]["frequencies"], frequencies, atol=0.05)
+
+
+def test_street_report_reports_the_noise_of_sampled_hands():
+    question = make_question(hole_cards=[HOLE_CARDS[0], ["*"] * 4], num_trials=2000, street_report=True)
+    question.answer()
+    board_std_errors = question.street_report()["turn"]["board_std_errors"]
+    assert all(0 < std_error < 0.5 / np.sqrt(main.STREET_INNER_TRIALS) for std_error in board_std_errors)
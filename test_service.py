@@ -0,0 +1,84 @@
+import asyncio
+import concurrent.futures
+
+import service
+
+HOLE_CARDS = [["As", "Ad", "Tc", "9d"], ["Qs", "Js", "Th", "5h"]]
+BOARD = [["Ks", "9c", "*"], ["2d", "*", "Qh"], ["4h", "7s", "Jc"]]
+
+
+def make_input(hole_cards=HOLE_CARDS, board=BOARD, **settings):
+    return dict({"hole_cards": hole_cards, "board": board, "num_trials": 30000, "seed": 0, "exact_threshold": 0},
+                **settings)
+
+
+def answer_together(equity_service, question_inputs):
+    async def answer():
+        return await asyncio.gather(*(equity_service.answer(question_input) for question_input in question_inputs))
+
+    try:
+        return asyncio.run(answer())
+    finally:
+        equity_service.close()
+
+
+def test_equivalent_questions_are_answered_once():
+    # hearts and spades swapped
+    swap = str.maketrans("hs", "sh")
+    relabelled = make_input([[card.translate(swap) for card in hole] for hole in HOLE_CARDS],
+                            [[card.translate(swap) for card in row] for row in BOARD], id="relabelled")
+    equity_service = service.EquityService(num_workers=1)
+    (status, result), (other_status, other_result) = answer_together(equity_service, [make_input(id=1), relabelled])
+    assert status == other_status == 200
+    assert (result["id"], other_result["id"]) == (1, "relabelled")
+    assert result["equities"] == other_result["equities"]
+    assert equity_service.counts["coalesced"] == 1
+    assert equity_service.num_trials == 30000
+
+
+def test_slow_question_times_out():
+    equity_service = service.EquityService(num_workers=1)
+    [(status, result)] = answer_together(equity_service, [make_input(num_trials=200000, timeout=0.01)])
+    assert status == 504 and "error" in result
+    assert equity_service.counts["timeouts"] == 1
+
+
+def test_questions_beyond_max_pending_are_turned_away():
+    other_board = [row[:] for row in BOARD]
+    other_board[0][2] = "8d"
+    equity_service = service.EquityService(num_workers=1, max_pending=1)
+    (status, result), (other_status, other_result) = answer_together(
+        equity_service, [make_input(), make_input(board=other_board)])
+    assert status == 200 and "equities" in result
+    assert other_status == 503 and "error" in other_result
+    assert equity_service.counts["rejected"] == 1
+
+
+def test_invalid_settings_are_rejected():
+    equity_service = service.EquityService(num_workers=1)
+    results = answer_together(equity_service, [make_input(num_trials="many"), make_input(num_trials=-5),
+                                               make_input(target_ci_width=0), make_input(timeout=-1)])
+    for (status, result), name in zip(results, ("num_trials", "num_trials", "target_ci_width", "timeout")):
+        assert status == 400 and name in result["error"]
+    assert len(equity_service.pending) == 0
+
+
+def test_worker_failures_are_server_errors(monkeypatch):
+    equity_service = service.EquityService(num_workers=1)
+    works = iter([RuntimeError("worker died"), None])
+
+    def failing_submit(function, *args):
+        work = concurrent.futures.Future()
+        error = next(works)
+        if error is None:
+            work.cancel()
+        else:
+            work.set_exception(error)
+        return work
+
+    monkeypatch.setattr(equity_service.executor, "submit", failing_submit)
+    # questions too large to be batched, each answered by its own worker call
+    (status, result), (other_status, other_result) = answer_together(
+        equity_service, [make_input(id=1), make_input(id=2, num_trials=40000)])
+    assert status == 500 and "worker died" in result["error"] and result["id"] == 1
+    assert other_status == 503 and other_result["error"] == "Cancelled"